@@ -13,9 +13,12 @@
 # Import python standard libs
 import os
 import os.path
+import copy
+import glob
 import time
-import csv
 import argparse
+import threading
+import concurrent.futures
 import logging
 import pprint
 
@@ -23,6 +26,24 @@ import osgeo.ogr, osgeo.osr
 
 import parse_datatypes
 import read_key
+import geojson_writer
+import vector_tiles
+import shapefile_writer
+import partition
+import fast_reader
+import string_dict
+import records
+import row_filter
+import fanout
+import geocoder
+import spatial_join
+import column_stats
+import watcher
+import pipeline
+import geoparquet_writer
+import checkpoint
+import run_log
+import spatial_sort
 
 
 STARTTIME = time.time()
@@ -30,23 +51,77 @@ LOGFILE = os.path.join(os.path.dirname(__file__),"logs",
                        os.path.basename(__file__)+
                        time.strftime('.%Y%m%d_%H%M%S.log', time.localtime(STARTTIME)))
 DATA_PARSE = parse_datatypes.ParseDatatype(number_NA=[''])
+GEOJSON_EXTS = ['.geojson', '.GeoJSON']
+MBTILES_EXT = '.mbtiles'
+PARQUET_EXT = '.parquet'
+SEQ_EXT = '.geojsonl'
+# Output extensions that can be added to, so --resume can carry on
+# writing them.
+RESUMABLE_EXTS = ['.gpkg', '.shp', SEQ_EXT]
+# Output extensions written through OGR, and their drivers.
+OGR_DRIVERS = {'.geojson': 'GeoJSON',
+               '.GeoJSON': 'GeoJSON',
+               '.shp': 'ESRI Shapefile',
+               '.gpkg': 'GPKG',
+               '.fgb': 'FlatGeobuf'}
+# The run's geocoder.Geocoder objects, by (gazetteer, cache file, EPSG
+# code).
+GEOCODERS = {}
+# The run's spatial_join.SpatialJoin objects, by (filename, fields, EPSG
+# code).
+SPATIAL_JOINS = {}
+# Key files already read, by (filename, encoding), with the file's
+# (size, mtime) when it was read.
+KEYFILES = {}
+# Guards the memos above when conversions run in parallel.
+MEMO_LOCK = threading.Lock()
 
-if not os.path.exists(os.path.dirname(LOGFILE)):
-    os.makedirs(os.path.dirname(LOGFILE))
-
-logging.basicConfig(
-    filename=LOGFILE,
-    format='%(asctime)s|%(levelno)d|%(levelname)s|%(filename)s|%(lineno)d|%(message)s',
-    level=logging.DEBUG
-    )
 
 
 def parse_args(argv=None):
     parser = argparse.ArgumentParser(description='Convert a CSV file with lat/lon positions into a GeoJSON file with point data')
     parser.add_argument('--keyfile', metavar='keyfile', help='Name of a the key CSV file')
-    parser.add_argument('--datafile', metavar='datafile', help='Name of the data CSV file')
-    parser.add_argument('--outext', dest='outext', default='.geojson', help='Name of output format extension, either .shp (for ESRI shapefile) or .geojson')
+    parser.add_argument('--datafile', metavar='datafile', nargs='+', help='Name of the data CSV file, or several files or globs like "daily/*.csv" with the same columns, to merge into one output')
+    parser.add_argument('--outname', dest='outname', default=None, help='Name to base the output filenames on, in place of the data file name; needed with several data files')
+    parser.add_argument('--outext', dest='outext', default='.geojson', help='Name of output format extension, one of .shp (for ESRI shapefile), .geojson, .gpkg (for GeoPackage), .fgb (for FlatGeobuf), .mbtiles (for vector tiles), .parquet (for GeoParquet) or .geojsonl (for newline-delimited GeoJSON). Give several, separated by commas, to write them all in one pass')
     parser.add_argument('--kfencoding', dest='kfencoding', default='utf-8', help="Name of keyfile's CSV file encoding, if not utf-8")
+    parser.add_argument('--precision', dest='precision', type=int, default=None, help='Number of decimal places to keep in output coordinates')
+    parser.add_argument('--compact', dest='compact', action='store_true', help='Write GeoJSON with compact separators, one feature per line')
+    parser.add_argument('--dropnulls', dest='dropnulls', action='store_true', help='Leave null properties out of GeoJSON features')
+    parser.add_argument('--compress', dest='compress', choices=sorted(geojson_writer.COMPRESS_EXTS), default=None, help='Also write a pre-compressed .gz or .br copy of GeoJSON output')
+    parser.add_argument('--minzoom', dest='minzoom', type=int, default=0, help='Lowest zoom level for .mbtiles output')
+    parser.add_argument('--maxzoom', dest='maxzoom', type=int, default=14, help='Highest zoom level for .mbtiles output')
+    parser.add_argument('--clusterzoom', dest='clusterzoom', type=int, default=None, help='Highest zoom level where .mbtiles points are clustered; defaults to one below maxzoom')
+    parser.add_argument('--clusterpx', dest='clusterpx', type=int, default=16, help='Size in pixels of the grid used to cluster .mbtiles points')
+    parser.add_argument('--row-group-size', dest='row_group_size', type=int, default=geoparquet_writer.DEFAULT_ROW_GROUP_SIZE, help='Rows in each row group of .parquet output')
+    parser.add_argument('--parquet-compression', dest='parquet_compression', choices=geoparquet_writer.COMPRESSIONS, default='snappy', help='Compression for .parquet output')
+    parser.add_argument('--writer', dest='writer', choices=['ogr', 'native'], default='ogr', help="Which writer makes .shp output: 'ogr', or the faster 'native' bulk writer")
+    parser.add_argument('--reader', dest='reader', choices=sorted(fast_reader.READERS), default='csv', help="How to read the data file: 'csv', or 'mmap' for faster reading of large UTF-8 or Latin-1 files")
+    parser.add_argument('--partition-by', dest='partition_by', default=None, help='Write a separate output file for each value of this identifier')
+    parser.add_argument('--partition-grid', dest='partition_grid', type=float, default=None, help='Write a separate output file for each grid cell of this size, in the coordinate units of the data')
+    parser.add_argument('--maxopen', dest='maxopen', type=int, default=64, help='Most output files to keep open at once when partitioning')
+    parser.add_argument('--bbox', dest='bbox', default=None, help='Only convert rows inside this minlon,minlat,maxlon,maxlat box, in the coordinates of the data')
+    parser.add_argument('--where', dest='where', action='append', default=None, help="Only convert rows where this 'identifier=value' holds; also takes !=, <, <=, > and >=. May be repeated")
+    parser.add_argument('--gazetteer', dest='gazetteer', default=None, help="Address points file (.csv, or any OGR point layer) used to place rows whose dllre 'address' group matched but that have no coordinates")
+    parser.add_argument('--gazetteer-fields', dest='gazetteer_fields', default='address,lat,lon', help='Address, lat and lon column names in the gazetteer, separated by commas; only the address is used for non-CSV gazetteers')
+    parser.add_argument('--geocode-cache', dest='geocode_cache', default=None, help='SQLite file caching geocoded addresses between runs; defaults to the gazetteer name with .geocache.sqlite')
+    parser.add_argument('--join', dest='join', default=None, help='Polygon file (any OGR format); each point is tagged with the attributes of the polygon containing it')
+    parser.add_argument('--join-fields', dest='join_fields', default=None, help='Polygon attributes to copy, separated by commas; defaults to all of them')
+    parser.add_argument('--stats', dest='stats', action='store_true', help='Also gather per-column statistics in the check pass, and write them with the extent to <output root>.stats.json')
+    parser.add_argument('--workers', dest='workers', type=int, default=None, help='Number of worker processes or threads; defaults to one per CPU')
+    parser.add_argument('--engine', dest='engine', choices=['serial', 'pipeline'], default='serial', help="How to run the conversion pass: 'serial', or 'pipeline' to read, parse and write in separate threads")
+    parser.add_argument('--queue-mb', dest='queue_mb', type=float, default=pipeline.DEFAULT_MEMORY_MB, help='Most memory, in megabytes, for rows waiting between the pipeline stages')
+    parser.add_argument('--spatial-sort', dest='spatial_sort', action='store_true', help='Write the features in Hilbert curve order, so features near each other on the map are near each other in the output')
+    parser.add_argument('--sort-mb', dest='sort_mb', type=float, default=spatial_sort.DEFAULT_MEMORY_MB, help='Most memory, in megabytes, for records waiting to be sorted; more are sorted in runs spilled to temporary files')
+    parser.add_argument('--sort-dir', dest='sort_dir', default=None, help='Directory for the temporary files of --spatial-sort; defaults to the system temporary directory')
+    parser.add_argument('--checkpoint', dest='checkpoint', type=int, default=None, help='Save a checkpoint every this many rows, so a failed conversion can be resumed with --resume; only for a single .gpkg, .shp or .geojsonl output')
+    parser.add_argument('--resume', dest='resume', action='store_true', help='Carry on from the last checkpoint of an earlier, failed, run with the same options')
+    parser.add_argument('--log-file', dest='log_file', default=LOGFILE, help="File to write the log to, or '-' for the console; defaults to a new file in the logs directory")
+    parser.add_argument('--log-level', dest='log_level', choices=run_log.LEVELS, default='INFO', help='Least important messages to log')
+    parser.add_argument('--skip-examples', dest='skip_examples', type=int, default=run_log.DEFAULT_EXAMPLES, help='Number of skipped rows to log for each reason they were skipped; the rest are just counted')
+    parser.add_argument('--watch', dest='watch', default=None, help='Watch this directory, and convert each NAME.csv with its NAME.key.csv whenever either one changes, until interrupted')
+    parser.add_argument('--settle', dest='settle', type=float, default=2.0, help='Seconds a watched file must go unchanged before it is converted')
+    parser.add_argument('--poll', dest='poll', type=float, default=1.0, help='Seconds between scans of the watched directory')
 
     args = parser.parse_args(argv)
     return args
@@ -54,12 +129,20 @@ def parse_args(argv=None):
 
 
 
-def process_data_row(args, kf, raw_record, line_num):
+def process_data_row(args, kf, raw_record, line_num, row_filter=None, geocoder=None):
     """Reads a {header: cell} record, per the key file rules.
 
-    Data will come back as a typle of a {identifier: typed_value} record
-    and a None error message, if the record could be parsed cleanly
-    and has a location.
+    Data will come back as a typle of a record, of the key file's
+    record_type(), and None, if the record could be parsed cleanly and
+    has a location. If it has no location, it's None and a run_log.Skip
+    saying why.
+
+    If there's a row_filter.RowFilter and the row doesn't pass it, the
+    result is (None, None). The filter is checked before the rest of
+    the row is stripped or converted.
+
+    If there's a geocoder.Geocoder, rows whose dllre match has an
+    'address' group but no lat/lon are placed by geocoding the address.
 
     If the location could not be parsed, that *might* be OK -- the
     keyfile.globals['maxskippct'] allows the file to have some
@@ -70,47 +153,68 @@ def process_data_row(args, kf, raw_record, line_num):
     Any parsing errors for a field that isn't a location (EG, integer
     column that isn't an integer) will raise a ValueError.
     """
-    # first, cleanup any leading/trailing whitespace
-    for k in raw_record:
-        raw_record[k] = raw_record[k].strip()
+    if row_filter is not None and not row_filter.match_cells(raw_record):
+        return (None, None)
+
+    # first, cleanup any leading/trailing whitespace on the location
+    # cells; the rest wait until the location is checked.
+    for g in ['dllcol', 'dlatcol', 'dloncol']:
+        k = kf.globals.get(g)
+        if k and k in raw_record:
+            raw_record[k] = raw_record[k].strip()
 
-    retval = {'dlat': None, 'dlon': None}
+    record_type = kf.record_type()
+    index = record_type._index
+    retval = [None] * len(index)
     # If there's a regexp pattern, process that into additional
     # "cells" first
     if kf.globals['dllcol']:
         m = kf.globals['dllre'].match(raw_record.get(kf.globals['dllcol'], ''))
         if not m:
-            msg = "CSV row {line} column {c} is '{val}', which does not matches the pattern {pat}".format(
+            skip = run_log.Skip(
+                "location doesn't match the dllre pattern",
+                "CSV row {line} column {c} is '{val}', which does not matches the pattern {pat}",
                 line=line_num, c=kf.globals['dllcol'],
                 val=raw_record.get(kf.globals['dllcol']),
                 pat=kf.globals['dllre'].pattern)
-            return (None, msg)
+            return (None, skip)
 
         # Put dlat and dlon into the results, if they're present
         try:
-            retval['dlat'] = DATA_PARSE.real(m.group('dlat'))
-            retval['dlon'] = DATA_PARSE.real(m.group('dlon'))
+            retval[records.DLAT] = DATA_PARSE.real(m.group('dlat'))
+            retval[records.DLON] = DATA_PARSE.real(m.group('dlon'))
         except ValueError:
-            msg = "CSV row {line} column {c} is '{val}', which does not yeild a valid lat/lon with pattern {pat}".format(
+            skip = run_log.Skip(
+                "location isn't a valid lat/lon",
+                "CSV row {line} column {c} is '{val}', which does not yeild a valid lat/lon with pattern {pat}",
                 line=line_num, c=kf.globals['dllcol'],
                 val=raw_record.get(kf.globals['dllcol']),
                 pat=kf.globals['dllre'].pattern)
-            return (None, msg)
+            return (None, skip)
+
+        # No position, but maybe an address to look up.
+        if (retval[records.DLAT] is None or retval[records.DLON] is None) and \
+           geocoder is not None and m.groupdict().get('address'):
+            point = geocoder.geocode(m.group('address'))
+            if point is not None:
+                (retval[records.DLAT], retval[records.DLON]) = point
 
         # OK, parsed... But now check for None values.
-        if retval['dlat'] is None or retval['dlon'] is None:
-            msg = "CSV row {line} column {c} is '{val}', which yeilds a blank lat/lon with pattern {pat}".format(
+        if retval[records.DLAT] is None or retval[records.DLON] is None:
+            skip = run_log.Skip(
+                "location has a blank lat/lon",
+                "CSV row {line} column {c} is '{val}', which yeilds a blank lat/lon with pattern {pat}",
                 line=line_num, c=kf.globals['dllcol'],
                 val=raw_record.get(kf.globals['dllcol']),
                 pat=kf.globals['dllre'].pattern)
-            return (None, msg)
+            return (None, skip)
 
         # Handle any other identifiers parsed out of the column.
         for k in m.groupdict():
             if k not in ['dlat','dlon']:
                 if k in kf.ids:
                     try:
-                        retval[k] = DATA_PARSE.typed_val(kf.ids[k]['datatype'], m.group(k))
+                        retval[index[k]] = DATA_PARSE.typed_val(kf.ids[k]['datatype'], m.group(k))
                     except ValueError:
                         msg = "CSV row {line} column {c} is '{val}', which does not yeild a valid {k} of {datatype} with pattern {pat}".format(
                             line=line_num, c=kf.globals['dllcol'],
@@ -120,33 +224,43 @@ def process_data_row(args, kf, raw_record, line_num):
                         raise ValueError(msg)
     else:
         try:
-            retval['dlat'] = DATA_PARSE.real(raw_record.get(kf.globals['dlatcol']))
-            retval['dlon'] = DATA_PARSE.real(raw_record.get(kf.globals['dloncol']))
+            retval[records.DLAT] = DATA_PARSE.real(raw_record.get(kf.globals['dlatcol']))
+            retval[records.DLON] = DATA_PARSE.real(raw_record.get(kf.globals['dloncol']))
         except ValueError:
-            msg = "CSV row {line} columns {dlatcol} and {dloncol} are '{dlatval}' and '{dlonval}', which does not yeild a valid lat/lon".format(
+            skip = run_log.Skip(
+                "lat/lon isn't a valid number",
+                "CSV row {line} columns {dlatcol} and {dloncol} are '{dlatval}' and '{dlonval}', which does not yeild a valid lat/lon",
                 line=line_num,
                 dlatcol=kf.globals['dlatcol'],
                 dloncol=kf.globals['dlatcol'],
                 dlatval=raw_record.get(kf.globals['dlatcol'], ''),
                 dlonval=raw_record.get(kf.globals['dloncol'], ''))
-            return (None, msg)
+            return (None, skip)
 
         # Now check for None values...
-        if retval['dlat'] is None or retval['dlon'] is None:
-            msg = "CSV row {line} columns {dlatcol} and {dloncol} are '{dlatval}' and '{dlonval}', which does not yeild a valid lat/lon".format(
+        if retval[records.DLAT] is None or retval[records.DLON] is None:
+            skip = run_log.Skip(
+                "lat/lon is blank",
+                "CSV row {line} columns {dlatcol} and {dloncol} are '{dlatval}' and '{dlonval}', which does not yeild a valid lat/lon",
                 line=line_num,
                 dlatcol=kf.globals['dlatcol'],
                 dloncol=kf.globals['dlatcol'],
                 dlatval=raw_record.get(kf.globals['dlatcol']),
                 dlonval=raw_record.get(kf.globals['dloncol']))
-            return (None, msg)
+            return (None, skip)
+
+    if row_filter is not None and not row_filter.match_location(retval[records.DLAT], retval[records.DLON]):
+        return (None, None)
+
+    for k in raw_record:
+        raw_record[k] = raw_record[k].strip()
 
     for id in kf.ids:
         if id not in ['dlat','dlon']:
             hdr = kf.ids[id]['csv_header']
             if hdr != '':
                 try:
-                    retval[id] = DATA_PARSE.typed_val(kf.ids[id]['datatype'], raw_record.get(hdr))
+                    retval[index[id]] = DATA_PARSE.typed_val(kf.ids[id]['datatype'], raw_record.get(hdr))
                 except ValueError:
                     msg = "CSV row {line} column {c} is '{val}', which does not yeild a valid {datatype}.".format(
                         line=line_num, c=hdr,
@@ -154,22 +268,227 @@ def process_data_row(args, kf, raw_record, line_num):
                         datatype=kf.ids[id]['datatype'])
                     raise ValueError(msg)
 
-    return (retval, None)
+    return (record_type._make(retval), None)
+
+
+def needed_headers(kf):
+    """Return the set of data file column headers the key file uses."""
+    headers = set(kf.hdr_to_id)
+    for g in ['dllcol', 'dlatcol', 'dloncol']:
+        if kf.globals.get(g):
+            headers.add(kf.globals[g])
+    return headers
+
+
+def open_reader(args, kf):
+    """Open the data file with the --reader engine. The reader has a
+    header attribute, and yields ({header: cell}, line_num) tuples.
+    Several data files are read one after the other.
+    """
+    if len(args.datafile) > 1:
+        return fast_reader.ShardReader(args.datafile, kf.globals['encoding'],
+                                       needed_headers(kf), args.reader)
+    return fast_reader.open_reader(args.datafile[0], kf.globals['encoding'],
+                                   needed_headers(kf), args.reader)
+
+
+def open_resumable_reader(args, kf, start=None):
+    """Open the data file with a reader that can report its position
+    for a checkpoint, starting at start, an earlier reader's position.
+    """
+    return fast_reader.ResumableReader(args.datafile[0], kf.globals['encoding'],
+                                       needed_headers(kf), start)
+
+
+def make_row_filter(args, kf):
+    """Return a row_filter.RowFilter for the --bbox and --where
+    options, or None if there aren't any.
+    """
+    if args.bbox is None and not args.where:
+        return None
+    bbox = row_filter.parse_bbox(args.bbox) if args.bbox is not None else None
+    return row_filter.RowFilter(kf, DATA_PARSE, bbox, args.where)
+
+
+def get_geocoder(args, kf, count=True):
+    """Return the run's geocoder.Geocoder for the --gazetteer, or None
+    if there isn't one. Both passes over the data share it; the writing
+    pass gives count=False, so its rows, which the check pass has
+    already counted, aren't counted again.
+    """
+    if args.gazetteer is None:
+        return None
+    cache_file = args.geocode_cache
+    if cache_file is None:
+        cache_file = os.path.splitext(args.gazetteer)[0] + '.geocache.sqlite'
+    epsg_code = kf.globals['epsg_code']
+    key = (args.gazetteer, cache_file, epsg_code)
+    with MEMO_LOCK:
+        if key not in GEOCODERS:
+            # A cache file holds points in one EPSG code, so a geocoder
+            # for another code, in a --watch run, gets its own.
+            if any(k[1] == cache_file for k in GEOCODERS):
+                (root, ext) = os.path.splitext(cache_file)
+                cache_file = '{root}.{epsg}{ext}'.format(root=root, epsg=epsg_code, ext=ext)
+            GEOCODERS[key] = geocoder.Geocoder(args.gazetteer, args.gazetteer_fields.split(','),
+                                               epsg_code, cache_file)
+        gc = GEOCODERS[key]
+    return gc if count else geocoder.Uncounted(gc)
 
 
-def check_cols(args, kf):
+def close_geocoders():
+    """Report on and close the run's geocoders."""
+    for gc in GEOCODERS.values():
+        geocoder.report_stats(gc.stats)
+        gc.close()
+    GEOCODERS.clear()
+
+
+def get_spatial_join(args, kf):
+    """Return the run's spatial_join.SpatialJoin for --join, or None if
+    there isn't one. The first call loads the polygons and adds their
+    fields to kf as identifiers.
+    """
+    if args.join is None:
+        return None
+    fields = None if args.join_fields is None else [f.strip() for f in args.join_fields.split(',')]
+    key = (args.join, args.join_fields, kf.globals['epsg_code'])
+    with MEMO_LOCK:
+        if key not in SPATIAL_JOINS:
+            SPATIAL_JOINS[key] = spatial_join.load_polygons(args.join, fields, kf.globals['epsg_code'])
+        sj = SPATIAL_JOINS[key]
+    # The polygons may be shared by conversions with other key files.
+    if not all(f in kf.added_ids for f in sj.fields):
+        for f in sj.fields:
+            if f in kf.ids:
+                msg = "The --join field '{f}' is already an identifier in the key file".format(f=f)
+                raise ValueError(msg)
+            kf.add_id(f, sj.datatypes[f])
+    return sj
+
+
+def close_spatial_joins():
+    """Report on the run's spatial joins."""
+    for sj in SPATIAL_JOINS.values():
+        spatial_join.report_stats(sj.stats)
+    SPATIAL_JOINS.clear()
+
+
+def check_cols(args, kf, stats=None, ckpt=None):
     """Check that the file can be processed by the rules
-    in the key file.
+    in the key file. Several data files are checked in parallel, and
+    the skip threshold applies to all of them together.
+
+    stats is an optional column_stats.LayerStats, which is given
+    every record that will be written
+    ckpt is an optional checkpoint.Checkpoint to save progress to, and
+      to resume from
 
     Return the string columns and their widths.
     """
+    if len(args.datafile) > 1:
+        (str_col_widths, row_count, filtered_count, skips) = check_shards(args, kf, stats)
+    else:
+        (str_col_widths, row_count, filtered_count, skips) = scan_datafile(args, kf, stats, ckpt)
+
+    skipped_count = skips.count()
+    logging.info("Have {rows} rows, {skipped} of which were skipped.".format(rows=row_count, skipped=skipped_count))
+    skips.report()
+    if args.bbox is not None or args.where:
+        logging.info("Left out {filtered} rows that did not pass --bbox or --where.".format(filtered=filtered_count))
+
+    # Rows left out by the filter don't count toward the skip threshold.
+    considered = row_count - filtered_count
+    if considered > 0 and (100.0*skipped_count/considered) > kf.globals['maxskippct']:
+        raise RuntimeError("Skipped {skipped} of {rows} rows for missing position, which is more than the {pct} percent threshold".format(
+            skipped=skipped_count, rows=considered, pct=kf.globals['maxskippct']))
+
+    # The spatial join fields aren't filled in yet, but their widths
+    # are known from the polygons.
+    sj = get_spatial_join(args, kf)
+    if sj is not None:
+        str_col_widths.update(sj.str_widths)
+
+    return str_col_widths
+
+
+def check_shards(args, kf, stats=None):
+    """Scan each of several data files in its own worker, and add up
+    what they found. The workers are processes, unless there's a
+    --gazetteer, whose geocoder and cache the workers must share, when
+    they're threads. Either way, their log messages go to the run's log.
+
+    Returns the same as scan_datafile, with each skipped row example
+    saying which data file it's from.
+    """
+    columns = list(stats.columns) if stats is not None else None
+    if args.gazetteer is not None:
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=args.workers or os.cpu_count() or 1)
+    else:
+        pool = run_log.process_pool(args.workers)
+    with pool as executor:
+        results = list(executor.map(_check_shard, [args]*len(args.datafile), args.datafile,
+                                    [columns]*len(args.datafile)))
+
     str_col_widths = {k:0 for k in kf.ids if kf.ids[k]['datatype'] == 'string'}
-    skipped_count = 0
+    (row_count, filtered_count) = (0, 0)
+    skips = run_log.SkipLog(args.skip_examples)
+    for (datafile, result) in zip(args.datafile, results):
+        (widths, rows, filtered, skips_state, stats_state) = result
+        for (k, width) in widths.items():
+            str_col_widths[k] = max(str_col_widths[k], width)
+        row_count += rows
+        filtered_count += filtered
+        skips.merge(skips_state, prefix=datafile+': ')
+        if stats is not None:
+            shard_stats = column_stats.LayerStats(kf.ids, columns)
+            shard_stats.restore(stats_state)
+            stats.merge(shard_stats)
+    return (str_col_widths, row_count, filtered_count, skips)
+
+
+def _check_shard(args, datafile, columns):
+    shard_args = copy.copy(args)
+    shard_args.datafile = [datafile]
+    kf = load_keyfile(shard_args)
+    stats = column_stats.LayerStats(kf.ids, columns) if columns is not None else None
+    try:
+        (widths, row_count, filtered_count, skips) = scan_datafile(shard_args, kf, stats)
+    except ValueError as e:
+        raise ValueError("{f}: {e}".format(f=datafile, e=e))
+    return (widths, row_count, filtered_count, skips.state(),
+            stats.state() if stats is not None else None)
+
+
+def scan_datafile(args, kf, stats=None, ckpt=None):
+    """Parse every row of the only --datafile, for check_cols.
+
+    Returns the string column widths, the number of rows, the number
+    left out by --bbox and --where, and a run_log.SkipLog of the rows
+    skipped for having no position.
+    """
+    str_col_widths = {k:0 for k in kf.ids if kf.ids[k]['datatype'] == 'string'}
+    index = kf.record_type()._index
+    str_cols = [(sc, index[sc]) for sc in str_col_widths]
+    filtered_count = 0
     row_count = 0
-    skipped_msgs = []
-    with open(args.datafile, encoding=kf.globals['encoding'], newline='') as fp:
-        reader = csv.reader(fp)
-        header = next(reader)
+    skips = run_log.SkipLog(args.skip_examples)
+    rf = make_row_filter(args, kf)
+    gc = get_geocoder(args, kf)
+    if ckpt is None:
+        reader = open_reader(args, kf)
+    elif ckpt.resuming('check'):
+        saved = ckpt.state
+        (row_count, filtered_count) = (saved['row_count'], saved['filtered_count'])
+        skips.restore(saved['skips'])
+        str_col_widths.update(saved['str_col_widths'])
+        if stats is not None:
+            stats.restore(saved['stats'])
+        reader = open_resumable_reader(args, kf, ckpt.position())
+    else:
+        reader = open_resumable_reader(args, kf)
+    with reader:
+        header = reader.header
 
         logging.info("datafile header is {hdr}".format(hdr=repr(header)))
         # Confirm header has the expected columns
@@ -181,46 +500,71 @@ def check_cols(args, kf):
         # OK, now look at every row to confirm int & real values are ints or reals.
         # And that every row has a lat and a lon.
         # And build up the string widths while we're here.
-        for row in reader:
-            raw_record = dict(zip(header, row))
+        for (raw_record, line_num) in reader:
             row_count += 1
 
             # Process the row.
             # This will raise a value error for most 'unparseable' data types
-            # or return a skipped_msg if the row has no lat/lon
-            (record, skipped_msg) = process_data_row(args, kf, raw_record, reader.line_num)
-            if skipped_msg is not None:
-                skipped_msgs.append(skipped_msg)
-                skipped_count += 1
-                continue
+            # or return a skip if the row has no lat/lon
+            (record, skip) = process_data_row(args, kf, raw_record, line_num, rf, gc)
+            if skip is not None:
+                skips.add(skip)
+            elif record is None:
+                filtered_count += 1
+            else:
+                for (sc, pos) in str_cols:
+                     str_col_widths[sc] = max(str_col_widths[sc], len(record[pos] or ''))
+                if stats is not None:
+                    stats.add(record)
 
-            for sc in str_col_widths:
-                 str_col_widths[sc] = max(str_col_widths[sc], len(record.get(sc, '')))
+            if ckpt is not None and row_count % ckpt.every == 0:
+                ckpt.save('check', reader.position(), row_count=row_count,
+                          skips=skips.state(), filtered_count=filtered_count,
+                          str_col_widths=str_col_widths,
+                          stats=stats.state() if stats is not None else None)
 
-    logging.info("Have {rows} rows, {skipped} of which were skipped.".format(rows=row_count, skipped=skipped_count))
-    for m in skipped_msgs:
-        logging.info("  "+m)
+    return (str_col_widths, row_count, filtered_count, skips)
 
-    if (100.0*skipped_count/row_count) > kf.globals['maxskippct']:
-        raise RuntimeError("Skipped {skipped} of {rows} rows for missing position, which is more than the {pct} percent threshold".format(
-            skipped=skipped_count, rows=row_count, pct=kf.globals['maxskippct']))
 
-    return str_col_widths
+def make_layer_stats(args, kf):
+    """Make the column_stats.LayerStats for check_cols to fill in.
+
+    Without --stats it has no columns, and only finds the row count and
+    extent, which cost next to nothing. The spatial join fields aren't
+    filled in until the records are written, so they're left out.
+    """
+    if not args.stats:
+        return column_stats.LayerStats(kf.ids, [])
+    sj = get_spatial_join(args, kf)
+    columns = [c for c in kf.ids if sj is None or c not in sj.fields]
+    return column_stats.LayerStats(kf.ids, columns)
+
+
+def write_stats(args, stats):
+    """Write the column stats and extent next to the output, if --stats
+    was given.
+    """
+    if not args.stats:
+        logging.info("Read {rows} rows; extent is {extent}".format(rows=stats.rows, extent=stats.extent))
+        return
+    (fileroot, fileext) = os.path.splitext(output_name(args))
+    stats.write(fileroot+'.stats.json', source=', '.join(os.path.basename(f) for f in args.datafile))
+    logging.info("Wrote the column stats for {rows} rows to {f}; extent is {extent}".format(
+        rows=stats.rows, f=fileroot+'.stats.json', extent=stats.extent))
 
 
-def make_output(datafile, outext, epsg_code):
+def make_output(datafile, outext, epsg_code, layer_options=None):
     """Make the output shapefile or geojson data source.
     Will need to add columns to this, but it will create
     the basics.
 
     datafile is the base name --- any extension will be stripped off and replaced with outext
-    outext is the output format extension, one of .shp or .GeoJSON
+    outext is the output format extension, one of the OGR_DRIVERS
     epsg_code is the integer EPSG projection code
+    layer_options is an optional list of 'NAME=VALUE' layer creation options
     """
     # Pick an output driver. Popular choices would be "GeoJSON" or "ESRI Shapefile"
-    driver_name = {'.geojson': 'GeoJSON',
-                   '.GeoJSON': 'GeoJSON',
-                   '.shp': 'ESRI Shapefile'}[outext]
+    driver_name = OGR_DRIVERS[outext]
     (fileroot, fileext) = os.path.splitext(datafile)
 
     output_driver = osgeo.ogr.GetDriverByName(driver_name)
@@ -232,7 +576,9 @@ def make_output(datafile, outext, epsg_code):
     srs.ImportFromEPSG(epsg_code)
 
     # Make a point layer
-    layer = data_src.CreateLayer(os.path.basename(fileroot), srs, osgeo.ogr.wkbPoint)
+    if layer_options is None:
+        layer_options = []
+    layer = data_src.CreateLayer(os.path.basename(fileroot), srs, osgeo.ogr.wkbPoint, layer_options)
 
     return (data_src, layer)
 
@@ -259,65 +605,612 @@ def add_schema(layer, ids, str_col_widths):
             raise ValueError(msg)
 
 
-def add_data(layer, args, kf):
+def iter_records(args, kf):
+    """Yield each record in the data file
+    that has a location, skipping the rest.
+
+    check_cols should have been run first, so any rows that would
+    raise a ValueError have already been reported.
+    """
+    sj = get_spatial_join(args, kf)
+    if sj is not None:
+        for record in sj.tag_records(_iter_parsed(args, kf), kf.record_type()):
+            yield record
+    else:
+        for record in _iter_parsed(args, kf):
+            yield record
+
+
+def _iter_parsed(args, kf):
+    rf = make_row_filter(args, kf)
+    gc = get_geocoder(args, kf, count=False)
+    with open_reader(args, kf) as reader:
+        for (raw_record, line_num) in reader:
+            (record, skip) = process_data_row(args, kf, raw_record, line_num, rf, gc)
+
+            if record is not None:
+                yield record
+
+
+def write_records(args, kf, add_record, extent=None):
+    """Call add_record with each record that iter_records would yield.
+
+    With --engine pipeline, the data file is read in a reader thread,
+    and add_record is called from a writer thread, while this thread
+    parses.
+
+    With --spatial-sort, the records are given to add_record in Hilbert
+    order, over a grid on extent, instead of data file order.
+    """
+    if not args.spatial_sort:
+        _write_records(args, kf, add_record)
+        return
+    sorter = spatial_sort.SpatialSorter(add_record, kf.record_type(), extent,
+                                        memory_mb=args.sort_mb, tmpdir=args.sort_dir)
+    _write_records(args, kf, sorter.add_record)
+    spatial_sort.report_stats(sorter.close())
+
+
+def _write_records(args, kf, add_record):
+    if args.engine != 'pipeline':
+        for record in iter_records(args, kf):
+            add_record(record)
+        return
+
+    rf = make_row_filter(args, kf)
+    gc = get_geocoder(args, kf, count=False)
+    sj = get_spatial_join(args, kf)
+    record_type = kf.record_type()
+
+    def parse_block(rows):
+        block = []
+        for (raw_record, line_num) in rows:
+            (record, skip) = process_data_row(args, kf, raw_record, line_num, rf, gc)
+            if record is not None:
+                block.append(record)
+        if sj is not None:
+            block = list(sj.tag_records(block, record_type))
+        return block
+
+    def write_block(block):
+        for record in block:
+            add_record(record)
+
+    with open_reader(args, kf) as reader:
+        stats = pipeline.run(reader, parse_block, write_block, memory_mb=args.queue_mb)
+    pipeline.report_stats(stats)
+
+
+def feature_fields(ids):
+    """Return a list of (OGR field index, record position) for the
+    fields of ids, so add_feature needn't look them up by name.
+    add_schema makes the fields in the order of ids.
+    """
+    index = records.field_index(ids)
+    return [(i, index[c]) for (i, c) in enumerate(ids)]
+
+
+def add_feature(layer, layer_def, fields, record):
+    """Add one record to the layer as a point feature.
+
+    fields is the list from feature_fields()
+    """
+    feature = osgeo.ogr.Feature(layer_def)
+
+    for (i, pos) in fields:
+        feature.SetField(i, record[pos])
+
+    point = osgeo.ogr.Geometry(osgeo.ogr.wkbPoint)
+    point.AddPoint(record[records.DLON], record[records.DLAT]) # Note it's lon,lat not lat,lon
+    feature.SetGeometry(point)
+
+    layer.CreateFeature(feature)
+
+    feature.Destroy() # free resources
+
+
+def add_data(layer, args, kf, extent=None):
     layer_def = layer.GetLayerDefn()
-    with open(args.datafile, encoding=kf.globals['encoding'], newline='') as fp:
-        reader = csv.reader(fp)
-        header = next(reader)
+    fields = feature_fields(kf.ids)
+    write_records(args, kf, lambda record: add_feature(layer, layer_def, fields, record), extent)
 
-        for row in reader:
-            raw_record = dict(zip(header, row))
-            (record, skipped_msg) = process_data_row(args, kf, raw_record, reader.line_num)
 
+class OGRWriter(object):
+    """Writes records into an OGR data source, for places that need a
+    writer object rather than a layer.
+
+    filename is the output filename, including the extension
+    outext is the output format extension
+    kf is the KeyFile
+    str_col_widths is a dictionary of {identifiers: width}
+    append opens an existing filename to add more features to it
+    """
+    def __init__(self, filename, outext, kf, str_col_widths, layer_options=None, append=False):
+        self.filename = filename
+        self.outext = outext
+        if append:
+            self.ds = osgeo.ogr.Open(filename, 1)
+            if self.ds is None:
+                raise RuntimeError("Could not reopen {f} to append to it".format(f=filename))
+            self.layer = self.ds.GetLayer(0)
+            self.count = self.layer.GetFeatureCount()
+        else:
+            (self.ds, self.layer) = make_output(filename, outext, kf.globals['epsg_code'], layer_options)
+            add_schema(self.layer, kf.ids, str_col_widths)
+            self.count = 0
+        self.layer_def = self.layer.GetLayerDefn()
+        self.fields = feature_fields(kf.ids)
+        if outext == '.gpkg':
+            self.ds.StartTransaction() # one transaction per commit() is much faster than one per feature
+
+
+    def add_record(self, record):
+        add_feature(self.layer, self.layer_def, self.fields, record)
+        self.count += 1
+
+
+    def commit(self):
+        """Make the features written so far durable, and return the
+        size of the output, for truncate() after a crash.
+        """
+        if self.outext == '.gpkg':
+            self.ds.CommitTransaction()
+            self.ds.StartTransaction()
+        else:
+            self.layer.SyncToDisk()
+        return {'features': self.count}
+
+
+    def truncate(self, count):
+        """Delete the features after the first count, which were written
+        after the last commit().
+        """
+        first_fid = 1 if self.outext == '.gpkg' else 0
+        for fid in range(first_fid + count, first_fid + self.count):
+            self.layer.DeleteFeature(fid)
+        if self.outext == '.gpkg':
+            self.ds.CommitTransaction()
+            self.ds.StartTransaction()
+        elif self.count > count:
+            self.ds.ExecuteSQL('REPACK {name}'.format(name=self.layer.GetName()))
+        self.count = count
+
+
+    def close(self):
+        if self.outext == '.gpkg':
+            self.ds.CommitTransaction()
+        self.ds.Destroy() # flush and free resources
+
+
+    def abort(self):
+        """Stop without finishing the output, and delete it."""
+        if self.outext == '.gpkg':
+            self.ds.RollbackTransaction()
+        self.ds.Destroy()
+        self.ds = None
+        osgeo.ogr.GetDriverByName(OGR_DRIVERS[self.outext]).DeleteDataSource(self.filename)
+
+
+def output_exts(args):
+    """Return the list of output format extensions in --outext."""
+    return [e.strip() for e in args.outext.split(',')]
+
+
+def compact_geojson(args):
+    """Return True if GeoJSON output is written by the compact writer."""
+    return args.compact or args.dropnulls or args.compress is not None
+
+
+def make_layer_options(args, outext):
+    """Return the OGR layer creation options for outext."""
+    layer_options = []
+    if args.precision is not None and outext in GEOJSON_EXTS:
+        layer_options.append('COORDINATE_PRECISION={p}'.format(p=args.precision))
+    if outext in GEOJSON_EXTS:
+        layer_options.append('WRITE_BBOX=YES')
+    return layer_options
+
+
+def open_output(args, kf, str_col_widths, outext, extent=None):
+    """Return a writer, with add_record and close methods, for the
+    outext output of the data file.
+
+    extent is the optional [minx, miny, maxx, maxy] of the records, for
+    formats that write it before the features
+
+    .mbtiles goes to the vector tile writer, .parquet to the GeoParquet
+    writer, .geojsonl to the GeoJSONSeq writer, and .shp goes to the native bulk writer if --writer native
+    was given. GeoJSON goes straight to
+    the compact writer if any of its options were given, so the layout
+    can be made smaller than OGR's. Everything else goes through OGR.
+    """
+    (fileroot, fileext) = os.path.splitext(output_name(args))
+    if outext == MBTILES_EXT:
+        return vector_tiles.MBTilesWriter(
+            fileroot+outext, kf.ids, kf.globals['epsg_code'],
+            minzoom=args.minzoom, maxzoom=args.maxzoom,
+            clusterzoom=args.clusterzoom, clusterpx=args.clusterpx,
+            workers=args.workers)
+    if outext == PARQUET_EXT:
+        return geoparquet_writer.GeoParquetWriter(
+            fileroot+outext, kf.ids, kf.globals['epsg_code'],
+            row_group_size=args.row_group_size,
+            compression=args.parquet_compression, bbox=extent)
+    if outext == SEQ_EXT:
+        return geojson_writer.GeoJSONSeqWriter(
+            fileroot+outext, kf.ids, kf.globals['epsg_code'],
+            precision=args.precision, dropnulls=args.dropnulls)
+    if outext == '.shp' and args.writer == 'native':
+        shapefile_writer.remove_shapefile(fileroot)
+        return shapefile_writer.ShapefileWriter(
+            fileroot, kf.ids, str_col_widths, kf.globals['epsg_code'])
+    if outext in GEOJSON_EXTS and compact_geojson(args):
+        return geojson_writer.CompactGeoJSONWriter(
+            fileroot+outext, kf.ids, kf.globals['epsg_code'],
+            precision=args.precision, compact=args.compact,
+            dropnulls=args.dropnulls, compress=args.compress, bbox=extent)
+    return OGRWriter(fileroot+outext, outext, kf, str_col_widths, make_layer_options(args, outext))
+
+
+def report_output(args, outext, writer, result):
+    """Log, and for some writers print, what was written to outext.
+
+    result is what the writer's close returned
+    """
+    if outext == MBTILES_EXT:
+        string_dict.report_stats(writer.encoder.stats())
+        logging.info("Wrote {n} vector tiles.".format(n=result))
+    elif outext == PARQUET_EXT:
+        geoparquet_writer.report_stats(result)
+    elif outext == '.shp' and args.writer == 'native':
+        logging.info("Wrote {n} records with the native shapefile writer.".format(n=result))
+    elif outext == SEQ_EXT or (outext in GEOJSON_EXTS and compact_geojson(args)):
+        geojson_writer.report_stats(result)
+    else:
+        logging.info("Wrote {ext} output through OGR.".format(ext=outext))
+
+
+def write_outputs(args, kf, str_col_widths, outexts, extent=None):
+    """Write the records to each of the outexts in one pass over the
+    data file. With more than one, each output is written by its own
+    thread. Returns the list of what each writer's close returned.
+    """
+    writers = [open_output(args, kf, str_col_widths, outext, extent) for outext in outexts]
+    if len(writers) == 1:
+        writer = writers[0]
+    else:
+        writer = fanout.FanOutWriter(writers)
+    try:
+        write_records(args, kf, writer.add_record, extent)
+    except BaseException:
+        # Release the outputs and remove what's been written, rather than
+        # leave them open (and, with several, their threads running) or
+        # finish them as if they were complete.
+        writer.abort()
+        raise
+    if len(writers) == 1:
+        results = [writer.close()]
+    else:
+        results = writer.close()
+    for (outext, w, result) in zip(outexts, writers, results):
+        report_output(args, outext, w, result)
+    return results
+
+
+def write_checkpointed(args, kf, str_col_widths, ckpt, stats):
+    """Write the records to the single --outext output, committing the
+    output and saving a checkpoint every ckpt.every rows. If ckpt has
+    saved progress for the write pass, the output is cut back to its
+    size at that checkpoint, and the data file read on from there.
+
+    stats is the column_stats.LayerStats of the check pass, saved with
+    each checkpoint
+    """
+    (fileroot, fileext) = os.path.splitext(output_name(args))
+    filename = fileroot + args.outext
+    output = ckpt.state['output'] if ckpt.resuming('write') else None
+    if args.outext == SEQ_EXT:
+        writer = geojson_writer.GeoJSONSeqWriter(
+            filename, kf.ids, kf.globals['epsg_code'], precision=args.precision,
+            dropnulls=args.dropnulls, resume=output)
+    elif output is not None:
+        writer = OGRWriter(filename, args.outext, kf, str_col_widths, append=True)
+        writer.truncate(output['features'])
+    else:
+        writer = OGRWriter(filename, args.outext, kf, str_col_widths, make_layer_options(args, args.outext))
+
+    rf = make_row_filter(args, kf)
+    gc = get_geocoder(args, kf, count=False)
+    sj = get_spatial_join(args, kf)
+    record_type = kf.record_type()
+    pending = []
+
+    def flush():
+        for record in sj.tag_records(pending, record_type):
+            writer.add_record(record)
+        del pending[:]
+
+    row_count = 0
+    with open_resumable_reader(args, kf, ckpt.position() if output is not None else None) as reader:
+        for (raw_record, line_num) in reader:
+            row_count += 1
+            (record, skip) = process_data_row(args, kf, raw_record, line_num, rf, gc)
             if record is not None:
-                feature = osgeo.ogr.Feature(layer_def)
+                if sj is None:
+                    writer.add_record(record)
+                else:
+                    pending.append(record)
+                    if len(pending) >= spatial_join.BATCH_SIZE:
+                        flush()
 
-                for c in kf.ids:
-                    feature.SetField(c, record[c])
+            if row_count % ckpt.every == 0:
+                if pending:
+                    flush()
+                ckpt.save('write', reader.position(), str_col_widths=str_col_widths,
+                          stats=stats.state(), output=writer.commit())
+    if pending:
+        flush()
+    report_output(args, args.outext, writer, writer.close())
 
-                point = osgeo.ogr.Geometry(osgeo.ogr.wkbPoint)
-                point.AddPoint(record['dlon'], record['dlat']) # Note it's lon,lat not lat,lon
-                feature.SetGeometry(point)
 
-                layer.CreateFeature(feature)
+def record_encoder(kf):
+    """Make a string_dict.RecordEncoder for buffering records from kf."""
+    keys = records.record_fields(kf.ids)
+    datatypes = {c: kf.ids[c]['datatype'] for c in kf.ids}
+    return string_dict.RecordEncoder(keys, datatypes)
 
-                feature.Destroy() # free resources
 
+def write_partitioned(args, kf, str_col_widths, layer_options=None, extent=None):
+    """Write the records into one output per partition, plus a CSV
+    index of the partitions. Returns the PartitionRouter.
+    """
+    (fileroot, fileext) = os.path.splitext(output_name(args))
+
+    def open_writer(filename, append):
+        return OGRWriter(filename, args.outext, kf, str_col_widths, layer_options, append)
+
+    router = partition.PartitionRouter(
+        fileroot, args.outext, open_writer, records.record_fields(kf.ids),
+        partition_by=args.partition_by, grid_size=args.partition_grid,
+        threads=args.workers or os.cpu_count() or 1, max_open=args.maxopen,
+        encoder=record_encoder(kf))
+    try:
+        write_records(args, kf, router.add_record, extent)
+        router.close()
+    finally:
+        # If anything failed, the writer threads still have to be
+        # stopped and their data sources closed.
+        router.abort()
+    router.write_index(fileroot+'.partitions.csv')
+    string_dict.report_stats(router.encoder.stats())
+    return router
+
+
+def load_keyfile(args):
+    """Return a KeyFile for --keyfile. A key file that hasn't changed
+    since it was last read isn't read again, which saves time when
+    watching a directory. Each caller gets its own copy, since a
+    spatial join adds identifiers to it.
+    """
+    key = (os.path.abspath(args.keyfile), args.kfencoding)
+    sig = watcher.file_signature(args.keyfile)
+    with MEMO_LOCK:
+        (kf_sig, kf) = KEYFILES.get(key, (None, None))
+    if kf is None or kf_sig != sig:
+        kf = read_key.KeyFile()
+        kf.read(args.keyfile, args.kfencoding)
+        with MEMO_LOCK:
+            KEYFILES[key] = (sig, kf)
+    return kf.copy()
+
+
+def check_args(args):
+    """Check the options that don't depend on the key or data file."""
+    outexts = output_exts(args)
+    for outext in outexts:
+        if outext not in OGR_DRIVERS and outext not in [MBTILES_EXT, PARQUET_EXT, SEQ_EXT]:
+            raise ValueError("Output extension must be one of '.shp', '.geojson', '.gpkg', '.fgb', '.mbtiles', '.parquet' or '.geojsonl'")
+    if len(set(e.lower() for e in outexts)) < len(outexts):
+        raise ValueError("The --outext '{outext}' lists an extension more than once".format(outext=args.outext))
+    if compact_geojson(args) and not any(e in GEOJSON_EXTS + [SEQ_EXT] for e in outexts):
+        raise ValueError("The --compact, --dropnulls and --compress options only apply to '.geojson' output")
+    if PARQUET_EXT in outexts and geoparquet_writer.pyarrow is None:
+        raise ValueError("GeoParquet output needs the 'pyarrow' package")
+    if args.row_group_size < 1:
+        raise ValueError("The --row-group-size must be at least 1")
+    if args.writer == 'native' and '.shp' not in outexts:
+        raise ValueError("The native writer only handles '.shp' output")
+    if is_partitioned(args) and (len(outexts) > 1 or outexts[0] not in ['.shp'] + GEOJSON_EXTS or
+                                 args.writer == 'native' or compact_geojson(args)):
+        raise ValueError("Partitioned output is only available for a single '.shp' or '.geojson' output written through OGR")
+    if args.maxopen < 1:
+        raise ValueError("The --maxopen must be at least 1")
+    if args.precision is not None and args.precision < 0:
+        raise ValueError("The --precision must be zero or more decimal places")
+    if args.skip_examples < 0:
+        raise ValueError("The --skip-examples must be zero or more")
+    if args.queue_mb <= 0:
+        raise ValueError("The --queue-mb must be more than zero")
+    if args.sort_mb <= 0:
+        raise ValueError("The --sort-mb must be more than zero")
+    if args.checkpoint is not None or args.resume:
+        if args.spatial_sort:
+            raise ValueError("The --checkpoint and --resume options can't be used with --spatial-sort, which writes nothing until every row is read")
+        if len(outexts) > 1 or outexts[0] not in RESUMABLE_EXTS:
+            raise ValueError("The --checkpoint and --resume options need a single '.gpkg', '.shp' or '.geojsonl' output")
+        if is_partitioned(args) or args.writer == 'native' or args.engine != 'serial' or args.reader != 'csv':
+            raise ValueError("The --checkpoint and --resume options need the csv reader, serial engine and OGR writer, without partitioning")
+        if args.checkpoint is not None and args.checkpoint < 1:
+            raise ValueError("The --checkpoint must be at least 1 row")
+
+
+def expand_datafiles(names):
+    """Return the data files for the --datafile names, with any globs
+    expanded in sorted order, and each file only once.
+    """
+    datafiles = []
+    for name in names:
+        if any(c in name for c in '*?['):
+            matches = sorted(glob.glob(name))
+            if not matches:
+                raise ValueError("The --datafile '{name}' does not match any files".format(name=name))
+        else:
+            matches = [name]
+        for datafile in matches:
+            if os.path.abspath(datafile) not in [os.path.abspath(d) for d in datafiles]:
+                datafiles.append(datafile)
+    return datafiles
+
+
+def output_name(args):
+    """Return the name the output filenames are based on: --outname, or
+    the data file's name.
+    """
+    return args.outname if args.outname is not None else args.datafile[0]
 
-def main(argv=None):
-    print("Writing log to {lf}; consult that for more details if needed.".format(lf=LOGFILE))
-    args = parse_args(argv)
-    logging.info("Initial arguments are {args}".format(args=repr(args)))
 
-    if args.keyfile is None:
-        raise ValueError("Must supply a --keyfile")
+def is_partitioned(args):
+    return args.partition_by is not None or args.partition_grid is not None
+
+
+def output_files(args):
+    """Return the main files the conversion of --datafile writes."""
+    (fileroot, fileext) = os.path.splitext(output_name(args))
+    if is_partitioned(args):
+        return [fileroot+'.partitions.csv']
+    return [fileroot+outext for outext in output_exts(args)]
+
+
+def convert(args):
+    """Convert --datafile with --keyfile. The caller closes the
+    geocoders and spatial joins when it's done with them.
+    """
     if not os.path.exists(args.keyfile):
         raise ValueError("The --keyfile '{filename}' does not exist".format(filename=args.keyfile))
-    if args.datafile is None:
-        raise ValueError("Must supply a --datafile")
-    if not os.path.exists(args.datafile):
-        raise ValueError("The --datafile '{filename}' does not exist".format(filename=args.datafile))
-    if args.outext not in ['.shp', '.geojson', '.GeoJSON']:
-        raise ValueError("Output extension must be one of '.shp' or '.geojson'")
-
+    args = copy.copy(args)
+    args.datafile = expand_datafiles(args.datafile)
+    for datafile in args.datafile:
+        if not os.path.exists(datafile):
+            raise ValueError("The --datafile '{filename}' does not exist".format(filename=datafile))
+    if len(args.datafile) > 1:
+        if args.outname is None:
+            raise ValueError("Give an --outname for the output of several data files")
+        if args.checkpoint is not None or args.resume:
+            raise ValueError("The --checkpoint and --resume options need a single data file")
+    outexts = output_exts(args)
+    (fileroot, fileext) = os.path.splitext(output_name(args))
 
     # Do as much sanity checking as possible before making, and
     # perhaps breaking, the output. And get the string column
     # widths.
-    kf = read_key.KeyFile()
-    kf.read(args.keyfile, args.kfencoding)
-    str_col_widths = check_cols(args, kf)
+    kf = load_keyfile(args)
+    if args.partition_by is not None and args.partition_by not in kf.ids:
+        raise ValueError("The --partition-by '{id}' is not an identifier in the key file".format(id=args.partition_by))
+    make_row_filter(args, kf) # check the --bbox and --where options
+    if args.gazetteer is not None and (not kf.globals['dllcol'] or 'address' not in kf.globals['dllre'].groupindex):
+        raise ValueError("The --gazetteer needs a key file whose dllre has an 'address' group")
+    get_spatial_join(args, kf) # load the --join polygons, and add their fields to kf
 
-    # OK, that's all the checking we can do. Make the layer.
-    (ds, layer) = make_output(args.datafile, args.outext, kf.globals['epsg_code'])
+    stats = make_layer_stats(args, kf)
+    if args.checkpoint is not None or args.resume:
+        ckpt = checkpoint.Checkpoint(fileroot+checkpoint.CHECKPOINT_EXT, args,
+                                     args.checkpoint or checkpoint.DEFAULT_EVERY, args.resume)
+        if ckpt.resuming('write'):
+            str_col_widths = ckpt.state['str_col_widths']
+            stats.restore(ckpt.state['stats'])
+        else:
+            str_col_widths = check_cols(args, kf, stats, ckpt)
+            ckpt.save('write', None, str_col_widths=str_col_widths, stats=stats.state(), output=None)
+        write_stats(args, stats)
+        write_checkpointed(args, kf, str_col_widths, ckpt, stats)
+        ckpt.remove()
+        return
+
+    str_col_widths = check_cols(args, kf, stats)
+    write_stats(args, stats)
+
+    # OK, that's all the checking we can do. Make the output.
+    if is_partitioned(args):
+        router = write_partitioned(args, kf, str_col_widths, make_layer_options(args, args.outext), stats.extent)
+        logging.info("Wrote {n} partitions.".format(n=len(router.partitions)))
+        return
+    if len(outexts) > 1 or args.outext not in OGR_DRIVERS or args.writer == 'native' or compact_geojson(args):
+        write_outputs(args, kf, str_col_widths, outexts, stats.extent)
+        return
+
+    layer_options = make_layer_options(args, args.outext)
+    (ds, layer) = make_output(output_name(args), args.outext, kf.globals['epsg_code'], layer_options)
     add_schema(layer, kf.ids, str_col_widths)
-    add_data(layer, args, kf)
+    add_data(layer, args, kf, stats.extent)
+    ds.Destroy() # flush and free resources
 
 
-if __name__ == '__main__':
+def watch(args):
+    """Convert the pairs in the --watch directory as they change, until
+    interrupted.
+    """
+    def convert_pair(keyfile, datafile):
+        pair_args = copy.copy(args)
+        pair_args.keyfile = keyfile
+        pair_args.datafile = [datafile]
+        convert(pair_args)
+
+    def up_to_date(keyfile, datafile):
+        pair_args = copy.copy(args)
+        pair_args.datafile = [datafile]
+        newest = max(os.path.getmtime(keyfile), os.path.getmtime(datafile))
+        return all(os.path.exists(f) and os.path.getmtime(f) >= newest
+                   for f in output_files(pair_args))
+
+    w = watcher.Watcher(args.watch, convert_pair, up_to_date, workers=args.workers,
+                        settle=args.settle, poll=args.poll)
+    print("Watching {d}; press Ctrl-C to stop.".format(d=args.watch))
+    try:
+        w.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        w.close()
+        watcher.report_stats(w.stats)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.log_file != '-':
+        print("Writing log to {lf}; consult that for more details if needed.".format(lf=args.log_file))
+    run_log.start(args.log_file, args.log_level)
     try:
-        main()
+        run(args)
     except Exception as e:
         logging.exception(e)
         raise
+    finally:
+        run_log.stop()
+
+
+def run(args):
+    logging.info("Initial arguments are {args}".format(args=repr(args)))
+
+    if args.watch is not None:
+        if args.keyfile is not None or args.datafile is not None or args.outname is not None:
+            raise ValueError("The --watch directory supplies the key and data files, so don't give --keyfile, --datafile or --outname")
+    else:
+        if args.keyfile is None:
+            raise ValueError("Must supply a --keyfile")
+        if args.datafile is None:
+            raise ValueError("Must supply a --datafile")
+    check_args(args)
+
+    try:
+        if args.watch is not None:
+            watch(args)
+        else:
+            convert(args)
+    finally:
+        close_geocoders()
+        close_spatial_joins()
+
+
+if __name__ == '__main__':
+    main()
 
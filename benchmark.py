@@ -0,0 +1,233 @@
+# Rough timings for the different ways CSVToGeo can do its work.
+#
+# Benchmarks run on a scaled-up copy of an example data file, made by
+# repeating its data rows, so the timings aren't lost in startup costs.
+# Run like this:
+#
+#   python3 benchmark.py shapefile --keyfile examples/Solid_Waste_Centers.key.csv --copies 500
+#
+# and consult --help for the list of benchmarks.
+
+import os
+import csv
+import json
+import time
+import zlib
+import random
+import shutil
+import argparse
+import tempfile
+
+import CSVToGeo
+import read_key
+
+
+def scale_datafile(src, dest, copies, encoding='utf-8'):
+    """Write dest with the header of src, and the data rows of src
+    repeated copies times. Returns the number of data rows written.
+    """
+    with open(src, encoding=encoding, newline='') as fp:
+        reader = csv.reader(fp)
+        header = next(reader)
+        rows = list(reader)
+    with open(dest, 'w', encoding=encoding, newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow(header)
+        for i in range(copies):
+            writer.writerows(rows)
+    return copies*len(rows)
+
+
+def timed(func, *args):
+    """Return (seconds, result) for func(*args)."""
+    start = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start, result)
+
+
+def report(name, secs, rows):
+    print("{name:>24s}: {secs:8.3f}s {rate:10.0f} rows/s".format(
+        name=name, secs=secs, rate=rows/secs if secs > 0 else 0))
+
+
+def bench_shapefile(args, kf, datafile, rows):
+    """Compare the OGR and native shapefile writers. Only the writing
+    pass is timed; the check_cols pass is the same for both.
+    """
+    conv_args = CSVToGeo.parse_args(['--keyfile', args.keyfile, '--datafile', datafile, '--outext', '.shp'])
+    str_col_widths = CSVToGeo.check_cols(conv_args, kf)
+
+    def ogr_writer():
+        (ds, layer) = CSVToGeo.make_output(datafile, '.shp', kf.globals['epsg_code'])
+        CSVToGeo.add_schema(layer, kf.ids, str_col_widths)
+        CSVToGeo.add_data(layer, conv_args, kf)
+        ds.Destroy()
+
+    native_args = CSVToGeo.parse_args(['--keyfile', args.keyfile, '--datafile', datafile, '--outext', '.shp', '--writer', 'native'])
+
+    def native_writer():
+        CSVToGeo.write_outputs(native_args, kf, str_col_widths, ['.shp'])
+
+    for (name, func) in [('ogr shapefile', ogr_writer), ('native shapefile', native_writer)]:
+        (secs, result) = timed(func)
+        report(name, secs, rows)
+
+
+def bench_readers(args, kf, datafile, rows):
+    """Compare the csv module and mmap readers, both reading alone and
+    as part of the check_cols pass.
+    """
+    for engine in sorted(CSVToGeo.fast_reader.READERS):
+        conv_args = CSVToGeo.parse_args(['--keyfile', args.keyfile, '--datafile', datafile, '--reader', engine])
+
+        def read_all():
+            with CSVToGeo.open_reader(conv_args, kf) as reader:
+                for row in reader:
+                    pass
+
+        (secs, result) = timed(read_all)
+        report(engine+' read', secs, rows)
+        (secs, result) = timed(CSVToGeo.check_cols, conv_args, kf)
+        report(engine+' check_cols', secs, rows)
+
+
+def bench_outputs(args, kf, datafile, rows):
+    """Compare writing .shp, .geojson and .gpkg output in a pass each,
+    against writing all three from one pass.
+    """
+    outexts = ['.shp', '.geojson', '.gpkg']
+    conv_args = CSVToGeo.parse_args(['--keyfile', args.keyfile, '--datafile', datafile, '--outext', ','.join(outexts)])
+    str_col_widths = CSVToGeo.check_cols(conv_args, kf)
+
+    def separate_passes():
+        for outext in outexts:
+            CSVToGeo.write_outputs(conv_args, kf, str_col_widths, [outext])
+
+    def one_pass():
+        CSVToGeo.write_outputs(conv_args, kf, str_col_widths, outexts)
+
+    for (name, func) in [('separate passes', separate_passes), ('one pass', one_pass)]:
+        (secs, result) = timed(func)
+        report(name, secs, rows)
+
+
+def bench_engines(args, kf, datafile, rows):
+    """Compare the serial and pipelined conversion passes, writing
+    .shp through OGR and compact GeoJSON.
+    """
+    for (outext, extra) in [('.shp', []), ('.geojson', ['--compact'])]:
+        base = ['--keyfile', args.keyfile, '--datafile', datafile, '--outext', outext] + extra
+        str_col_widths = CSVToGeo.check_cols(CSVToGeo.parse_args(base), kf)
+        for engine in ['serial', 'pipeline']:
+            conv_args = CSVToGeo.parse_args(base + ['--engine', engine])
+            (secs, result) = timed(CSVToGeo.write_outputs, conv_args, kf, str_col_widths, [outext])
+            report(engine+' '+outext, secs, rows)
+
+
+# Features per block for the bbox query benchmark, and its queries.
+QUERY_BLOCK = 1024
+QUERIES = 50
+QUERY_FRACTION = 0.05
+
+
+def block_index(filename):
+    """Read GeoJSONSeq filename into blocks of QUERY_BLOCK lines, each
+    with the [minx, miny, maxx, maxy] of its points.
+    """
+    with open(filename, 'rb') as fp:
+        lines = fp.read().splitlines()
+    blocks = []
+    for i in range(0, len(lines), QUERY_BLOCK):
+        block = lines[i:i+QUERY_BLOCK]
+        points = [json.loads(line)['geometry']['coordinates'] for line in block]
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        blocks.append(([min(xs), min(ys), max(xs), max(ys)], block))
+    return blocks
+
+
+def bbox_queries(blocks, queries):
+    """Run the [minx, miny, maxx, maxy] queries against blocks, parsing
+    only the blocks whose bbox meets the query, the way a reader of
+    GeoParquet row groups or FlatGeobuf and GeoPackage pages can.
+    Returns (features found, blocks read).
+    """
+    (found, read) = (0, 0)
+    for (qx0, qy0, qx1, qy1) in queries:
+        for ((bx0, by0, bx1, by1), block) in blocks:
+            if bx0 > qx1 or bx1 < qx0 or by0 > qy1 or by1 < qy0:
+                continue
+            read += 1
+            for line in block:
+                (x, y) = json.loads(line)['geometry']['coordinates']
+                if qx0 <= x <= qx1 and qy0 <= y <= qy1:
+                    found += 1
+    return (found, read)
+
+
+def bench_sort(args, kf, datafile, rows):
+    """Compare .geojsonl output in data file order and with
+    --spatial-sort: the time to write it, the time for bbox queries
+    that skip blocks by their bbox, and its gzipped size.
+    """
+    base = ['--keyfile', args.keyfile, '--datafile', datafile, '--outext', '.geojsonl']
+    conv_args = CSVToGeo.parse_args(base)
+    stats = CSVToGeo.make_layer_stats(conv_args, kf)
+    str_col_widths = CSVToGeo.check_cols(conv_args, kf, stats)
+    (minx, miny, maxx, maxy) = stats.extent
+    (w, h) = ((maxx - minx) * QUERY_FRACTION, (maxy - miny) * QUERY_FRACTION)
+    rand = random.Random(1)
+    queries = []
+    for i in range(QUERIES):
+        (x, y) = (rand.uniform(minx, maxx - w), rand.uniform(miny, maxy - h))
+        queries.append((x, y, x + w, y + h))
+
+    for (name, extra) in [('data file order', []), ('hilbert order', ['--spatial-sort'])]:
+        conv_args = CSVToGeo.parse_args(base + extra)
+        (secs, results) = timed(CSVToGeo.write_outputs, conv_args, kf, str_col_widths, ['.geojsonl'], stats.extent)
+        report(name+' write', secs, rows)
+        filename = results[0]['filename']
+        blocks = block_index(filename)
+        (secs, (found, read)) = timed(bbox_queries, blocks, queries)
+        with open(filename, 'rb') as fp:
+            gzipped = len(zlib.compress(fp.read(), 6))
+        print("{name:>24s}: {secs:8.3f}s for {q} bbox queries finding {found} features, reading {pct:.1f}% of blocks; {gz} bytes compressed".format(
+            name=name+' queries', secs=secs, q=len(queries), found=found,
+            pct=100.0*read/max(len(blocks)*len(queries), 1), gz=gzipped))
+
+
+BENCHMARKS = {
+    'engines': bench_engines,
+    'outputs': bench_outputs,
+    'readers': bench_readers,
+    'shapefile': bench_shapefile,
+    'sort': bench_sort,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time CSVToGeo conversions on a scaled-up example')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS), help='Which benchmark to run')
+    parser.add_argument('--keyfile', default=os.path.join('examples', 'Solid_Waste_Centers.key.csv'), help='Name of the key CSV file')
+    parser.add_argument('--datafile', default=None, help="Name of the data CSV file; defaults to the keyfile's data file")
+    parser.add_argument('--copies', type=int, default=500, help='Number of copies of the data rows to time')
+    args = parser.parse_args(argv)
+
+    if args.datafile is None:
+        args.datafile = args.keyfile.replace('.key.csv', '.csv')
+
+    kf = read_key.KeyFile()
+    kf.read(args.keyfile)
+
+    workdir = tempfile.mkdtemp(prefix='csvtogeo_bench')
+    try:
+        datafile = os.path.join(workdir, os.path.basename(args.datafile))
+        rows = scale_datafile(args.datafile, datafile, args.copies, kf.globals['encoding'])
+        print("Benchmark {b} on {rows} rows from {src}".format(b=args.benchmark, rows=rows, src=args.datafile))
+        BENCHMARKS[args.benchmark](args, kf, datafile, rows)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# Checkpoints, so a long conversion that fails part way through can
+# be resumed rather than started over.
+#
+# Both passes over the data file save their progress every so many
+# rows: where they are in the data file, and what they've gathered so
+# far (row counts, string widths and column stats). The writing pass
+# also commits the output at each checkpoint, and saves how much of it
+# there is. A resumed run reads the data file on from the saved offset,
+# and cuts the output back to its size at the checkpoint, dropping
+# anything written after it.
+#
+# The checkpoint is a small JSON file next to the output, replaced
+# atomically each time, and removed once the conversion finishes.
+
+import os
+import json
+import hashlib
+import logging
+
+
+CHECKPOINT_EXT = '.checkpoint.json'
+DEFAULT_EVERY = 100000
+
+# Options that change what's written, so a checkpoint made with
+# different ones can't be resumed.
+OPTIONS = ['outext', 'outname', 'compact', 'kfencoding', 'precision', 'dropnulls',
+           'bbox', 'where', 'gazetteer', 'gazetteer_fields', 'join', 'join_fields',
+           'stats']
+
+
+def file_sha1(filename):
+    """Return the SHA-1 of the contents of filename."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        while True:
+            data = fp.read(1 << 20)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class Checkpoint(object):
+    """The saved progress of one conversion.
+
+    filename is the checkpoint file
+    args is the parsed CSVToGeo arguments
+    every is the number of rows between checkpoints
+    resume picks up from an existing checkpoint file, if there is one
+    """
+    def __init__(self, filename, args, every, resume=False):
+        self.filename = filename
+        self.every = every
+        self.identity = {'datafile': [os.path.abspath(f) for f in args.datafile],
+                         'keyfile': file_sha1(args.keyfile),
+                         'options': {o: getattr(args, o) for o in OPTIONS}}
+        self.state = None
+        if resume:
+            self.state = self._load()
+        elif os.path.exists(filename):
+            os.remove(filename)
+
+
+    def _load(self):
+        if not os.path.exists(self.filename):
+            logging.info("No checkpoint {f} to resume from; starting from the beginning".format(f=self.filename))
+            return None
+        with open(self.filename, encoding='utf-8') as fp:
+            saved = json.load(fp)
+        for key in sorted(self.identity):
+            if saved.get(key) != self.identity[key]:
+                msg = "The checkpoint {f} doesn't match this run's {key}, so it can't be resumed".format(
+                    f=self.filename, key=key)
+                raise ValueError(msg)
+        state = saved['state']
+        logging.info("Resuming the {phase} pass after line {n}, using checkpoint {f}".format(
+            phase=state['phase'], n=state['position']['line_num'] if state['position'] else 1, f=self.filename))
+        return state
+
+
+    def resuming(self, phase):
+        """Return True if there's saved progress for phase, 'check' or
+        'write'.
+        """
+        return self.state is not None and self.state['phase'] == phase
+
+
+    def position(self):
+        """Return the saved data file position, or None to start at the
+        beginning.
+        """
+        return self.state['position'] if self.state is not None else None
+
+
+    def save(self, phase, position, **state):
+        """Save the progress of phase at the data file position."""
+        state.update({'phase': phase, 'position': position})
+        saved = dict(self.identity)
+        saved['state'] = state
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fp:
+            json.dump(saved, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp, self.filename)
+        self.state = state
+
+
+    def remove(self):
+        """Remove the checkpoint once the conversion is finished."""
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        self.state = None
@@ -0,0 +1,243 @@
+# Per-column statistics and the layer extent, gathered a record at a
+# time during the check_cols pass, and written as a JSON sidecar file
+# next to the output so consumers don't need to rescan the data.
+#
+# Every column gets a count of null and non-null values. integer and
+# real columns also get their min and max, and string columns get a
+# count of distinct values. Distinct values are counted exactly up to
+# EXACT_LIMIT; past that, the count is a HyperLogLog estimate, which
+# takes a fixed 2**HLL_PRECISION bytes per column however many values
+# there are, with a standard error of about 1.04/sqrt(2**HLL_PRECISION).
+#
+# HyperLogLog is described in Flajolet, Fusy, Gandouet and Meunier,
+# "HyperLogLog: the analysis of a near-optimal cardinality estimation
+# algorithm", AofA 2007.
+
+import json
+import math
+import hashlib
+
+import records
+
+
+EXACT_LIMIT = 1024
+HLL_PRECISION = 12 # 4096 registers, about 1.6% standard error
+
+
+def _hash64(val):
+    """Return a 64 bit hash of val that's the same in every process
+    (unlike hash()), so saved registers can be added to later.
+    """
+    return int.from_bytes(hashlib.blake2b(str(val).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class DistinctCounter(object):
+    """Counts distinct values, exactly while there are few of them and
+    with HyperLogLog after that.
+    """
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.exact = set()
+        self.registers = None
+
+
+    def add(self, val):
+        if self.registers is None:
+            self.exact.add(val)
+            if len(self.exact) > EXACT_LIMIT:
+                self.registers = bytearray(1 << self.precision)
+                for v in self.exact:
+                    self._add_hll(v)
+                self.exact = None
+        else:
+            self._add_hll(val)
+
+
+    def _add_hll(self, val):
+        p = self.precision
+        h = _hash64(val)
+        j = h >> (64 - p)
+        rest = h & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - rest.bit_length() + 1
+        if rank > self.registers[j]:
+            self.registers[j] = rank
+
+
+    def merge(self, other):
+        """Add the values counted by other into this counter."""
+        if other.registers is None:
+            for v in other.exact:
+                self.add(v)
+            return
+        if self.registers is None:
+            self.registers = bytearray(1 << self.precision)
+            for v in self.exact:
+                self._add_hll(v)
+            self.exact = None
+        for (j, r) in enumerate(other.registers):
+            if r > self.registers[j]:
+                self.registers[j] = r
+
+
+    def exact_count(self):
+        return self.registers is None
+
+
+    def state(self):
+        """Return the counter as a JSON-ready value, for checkpoints."""
+        if self.registers is None:
+            return {'exact': sorted(self.exact)}
+        return {'registers': self.registers.hex()}
+
+
+    @classmethod
+    def from_state(cls, state, precision=HLL_PRECISION):
+        dc = cls(precision)
+        if 'registers' in state:
+            dc.registers = bytearray.fromhex(state['registers'])
+            dc.exact = None
+        else:
+            dc.exact = set(state['exact'])
+        return dc
+
+
+    def count(self):
+        if self.registers is None:
+            return len(self.exact)
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079/m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5*m and zeros > 0:
+            # Small range correction: linear counting.
+            estimate = m * math.log(float(m) / zeros)
+        return int(round(estimate))
+
+
+class LayerStats(object):
+    """Gathers the column statistics and extent of a stream of records.
+
+    ids is the key file's {identifier: {name: value}} map
+    columns is the list of identifiers to gather stats for; defaults
+      to all of ids
+    """
+    def __init__(self, ids, columns=None):
+        if columns is None:
+            columns = list(ids)
+        index = records.field_index(ids)
+        self.rows = 0
+        self.extent = None
+        self.columns = {}
+        self._numeric = []
+        self._strings = []
+        for c in columns:
+            col = {'datatype': ids[c]['datatype'], 'count': 0, 'nulls': 0}
+            if ids[c]['datatype'] == 'string':
+                col['distinct'] = DistinctCounter()
+                self._strings.append((index[c], col))
+            else:
+                col['min'] = None
+                col['max'] = None
+                self._numeric.append((index[c], col))
+            self.columns[c] = col
+
+
+    def add(self, record):
+        self.rows += 1
+        (x, y) = (record[records.DLON], record[records.DLAT])
+        e = self.extent
+        if e is None:
+            self.extent = [x, y, x, y]
+        else:
+            if x < e[0]: e[0] = x
+            if y < e[1]: e[1] = y
+            if x > e[2]: e[2] = x
+            if y > e[3]: e[3] = y
+
+        for (pos, col) in self._numeric:
+            val = record[pos]
+            if val is None:
+                col['nulls'] += 1
+                continue
+            col['count'] += 1
+            if col['min'] is None or val < col['min']:
+                col['min'] = val
+            if col['max'] is None or val > col['max']:
+                col['max'] = val
+        for (pos, col) in self._strings:
+            val = record[pos]
+            if val is None:
+                col['nulls'] += 1
+                continue
+            col['count'] += 1
+            col['distinct'].add(val)
+
+
+    def state(self):
+        """Return everything gathered so far as a JSON-ready value, for
+        checkpoints.
+        """
+        columns = {}
+        for (c, col) in self.columns.items():
+            columns[c] = dict(col)
+            if 'distinct' in col:
+                columns[c]['distinct'] = col['distinct'].state()
+        return {'rows': self.rows, 'extent': self.extent, 'columns': columns}
+
+
+    def restore(self, state):
+        """Carry on from a state() saved earlier, with the same columns."""
+        self.rows = state['rows']
+        self.extent = state['extent']
+        for (c, col) in self.columns.items():
+            saved = state['columns'][c]
+            for name in col:
+                if name == 'distinct':
+                    col[name] = DistinctCounter.from_state(saved[name])
+                else:
+                    col[name] = saved[name]
+
+
+    def merge(self, other):
+        """Add in the stats of other, gathered from different records
+        with the same columns.
+        """
+        self.rows += other.rows
+        if self.extent is None:
+            self.extent = list(other.extent) if other.extent is not None else None
+        elif other.extent is not None:
+            self.extent = [min(self.extent[0], other.extent[0]), min(self.extent[1], other.extent[1]),
+                           max(self.extent[2], other.extent[2]), max(self.extent[3], other.extent[3])]
+        for (c, col) in self.columns.items():
+            theirs = other.columns[c]
+            col['count'] += theirs['count']
+            col['nulls'] += theirs['nulls']
+            if 'distinct' in col:
+                col['distinct'].merge(theirs['distinct'])
+                continue
+            if theirs['min'] is not None and (col['min'] is None or theirs['min'] < col['min']):
+                col['min'] = theirs['min']
+            if theirs['max'] is not None and (col['max'] is None or theirs['max'] > col['max']):
+                col['max'] = theirs['max']
+
+
+    def as_dict(self):
+        """Return the stats as a JSON-ready dictionary."""
+        columns = {}
+        for (c, col) in self.columns.items():
+            out = dict(col)
+            if 'distinct' in col:
+                out['distinct'] = col['distinct'].count()
+                out['distinct_exact'] = col['distinct'].exact_count()
+            columns[c] = out
+        return {'rows': self.rows, 'extent': self.extent, 'columns': columns}
+
+
+    def write(self, filename, source=None):
+        """Write the stats as a JSON sidecar file."""
+        stats = self.as_dict()
+        if source is not None:
+            stats['source'] = source
+        with open(filename, 'w', encoding='utf-8') as fp:
+            json.dump(stats, fp, indent=2, sort_keys=True, ensure_ascii=False)
+            fp.write('\n')
@@ -0,0 +1,370 @@
+# Checks that CSVToGeo's faster ways of converting write the same
+# features as the default one, and times them.
+#
+# Each mode (an output format plus the options for a writer, reader or
+# engine) converts every example, and scaled-up copies of them, in
+# parallel worker processes, though only one converts at a time so the
+# timings are comparable. Every output is read back a feature at a
+# time and summarized by a multiset hash: each feature's properties and
+# point are normalized and hashed, and the hashes are added up, so the
+# order of the features doesn't matter and nothing is held in memory.
+# Each mode is then compared with its baseline mode, and reported with
+# its throughput. Run like this:
+#
+#   python3 compare.py --copies 1,100
+#
+# The scaled data files, and the results for inputs and code that
+# haven't changed, are cached between runs; give --refresh to run
+# everything again.
+
+import io
+import os
+import sys
+import csv
+import json
+import glob
+import time
+import struct
+import hashlib
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+import osgeo.ogr
+
+import CSVToGeo
+import read_key
+import benchmark
+import geoparquet_writer
+
+
+# (name, extra CSVToGeo options, output extension, baseline mode name).
+# A mode with no baseline is one.
+MODES = [
+    ('ogr', [], '.geojson', None),
+    ('compact', ['--compact', '--dropnulls'], '.geojson', 'ogr'),
+    ('mmap', ['--reader', 'mmap'], '.geojson', 'ogr'),
+    ('pipeline', ['--engine', 'pipeline'], '.geojson', 'ogr'),
+    ('geojsonl', [], '.geojsonl', 'ogr'),
+    ('spatial-sort', ['--spatial-sort'], '.geojsonl', 'ogr'),
+    ('parquet', [], '.parquet', 'ogr'),
+    ('ogr-shp', [], '.shp', None),
+    ('native-shp', ['--writer', 'native'], '.shp', 'ogr-shp'),
+    ]
+
+# Decimal places real values and coordinates are rounded to, since
+# writers print them with different numbers of digits.
+PLACES = 9
+
+DIGEST_BITS = 128
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'csvtogeo_compare')
+RESULTS_CACHE = 'results.json'
+
+
+def normalize(value):
+    if isinstance(value, float):
+        return round(value, PLACES)
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def feature_digest(props, x, y):
+    """Return the hash of one feature as an integer. Null properties
+    are left out, so writers that drop them hash the same.
+    """
+    canonical = (sorted((k, normalize(v)) for (k, v) in props.items() if v is not None),
+                 normalize(x), normalize(y))
+    return int.from_bytes(hashlib.blake2b(repr(canonical).encode('utf-8'),
+                                          digest_size=DIGEST_BITS // 8).digest(), 'little')
+
+
+class MultisetHash(object):
+    """An order-independent hash of a multiset of features: the sum of
+    their hashes. Unlike XOR, a repeated feature doesn't cancel out.
+    """
+    def __init__(self):
+        self.total = 0
+        self.count = 0
+
+
+    def add(self, props, x, y):
+        self.total = (self.total + feature_digest(props, x, y)) % (1 << DIGEST_BITS)
+        self.count += 1
+
+
+    def hexdigest(self):
+        return '{t:032x}'.format(t=self.total)
+
+
+def iter_geojsonl(filename):
+    with open(filename, encoding='utf-8') as fp:
+        for line in fp:
+            feature = json.loads(line)
+            (x, y) = feature['geometry']['coordinates'][:2]
+            yield (feature['properties'], x, y)
+
+
+def iter_parquet(filename):
+    pf = geoparquet_writer.pyarrow.parquet.ParquetFile(filename)
+    for batch in pf.iter_batches():
+        rows = batch.to_pydict()
+        geometry = rows.pop('geometry')
+        names = list(rows)
+        for (i, wkb) in enumerate(geometry):
+            (x, y) = struct.unpack_from('<dd', wkb, 5)
+            yield ({n: rows[n][i] for n in names}, x, y)
+
+
+def iter_ogr(filename):
+    ds = osgeo.ogr.Open(filename)
+    if ds is None:
+        raise RuntimeError("Could not open {f}".format(f=filename))
+    try:
+        layer = ds.GetLayer(0)
+        layer_def = layer.GetLayerDefn()
+        names = [layer_def.GetFieldDefn(i).GetName() for i in range(layer_def.GetFieldCount())]
+        for feature in layer:
+            point = feature.GetGeometryRef()
+            yield ({n: feature.GetField(n) for n in names}, point.GetX(), point.GetY())
+    finally:
+        ds.Destroy()
+
+
+def iter_features(filename):
+    """Yield (properties, x, y) for each feature in filename, a feature
+    at a time.
+    """
+    ext = os.path.splitext(filename)[1]
+    if ext == CSVToGeo.SEQ_EXT:
+        return iter_geojsonl(filename)
+    if ext == CSVToGeo.PARQUET_EXT:
+        return iter_parquet(filename)
+    return iter_ogr(filename)
+
+
+def layer_hash(filename):
+    """Return the MultisetHash of the features in filename."""
+    mh = MultisetHash()
+    for (props, x, y) in iter_features(filename):
+        mh.add(props, x, y)
+    return mh
+
+
+def file_sha1(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as fp:
+        for data in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def code_fingerprint():
+    """Return a hash of the program's source, so cached results are
+    thrown away when it changes.
+    """
+    digest = hashlib.sha1()
+    for filename in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        if not os.path.basename(filename).startswith('test_'):
+            digest.update(os.path.basename(filename).encode('utf-8'))
+            digest.update(file_sha1(filename).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Held by a worker while it converts, so conversions are timed one at a
+# time and their rows per second can be compared. Reading the outputs
+# back runs in parallel.
+_timing_lock = None
+
+
+def _start_worker(lock):
+    global _timing_lock
+    _timing_lock = lock
+
+
+def run_case(case):
+    """Convert one example with one mode in a fresh directory, and return
+    a dictionary of what it wrote and how long it took.
+    """
+    (name, extra, outext, baseline) = case['mode']
+    result = {'example': case['example'], 'copies': case['copies'], 'rows': case['rows'],
+              'mode': name, 'secs': None, 'features': None, 'hash': None, 'error': None}
+    with tempfile.TemporaryDirectory(prefix='csvtogeo_compare') as workdir:
+        outname = os.path.join(workdir, case['example'] + '.csv')
+        argv = ['--keyfile', case['keyfile'], '--datafile', case['datafile'], '--outname', outname,
+                '--outext', outext] + extra
+        try:
+            args = CSVToGeo.parse_args(argv)
+            lock = _timing_lock if _timing_lock is not None else contextlib.nullcontext()
+            with lock, contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                CSVToGeo.run(args)
+                result['secs'] = time.perf_counter() - start
+            mh = layer_hash(os.path.join(workdir, case['example'] + outext))
+            (result['features'], result['hash']) = (mh.count, mh.hexdigest())
+        except Exception as e:
+            result['error'] = '{t}: {e}'.format(t=type(e).__name__, e=e)
+    return result
+
+
+def prepare_cases(args, modes):
+    """Return the list of cases to run, making any scaled data files
+    that aren't in the cache yet.
+    """
+    cases = []
+    for keyfile in sorted(glob.glob(os.path.join(args.examples, '*.key.csv'))):
+        if keyfile.endswith('.gen.key.csv'):
+            continue
+        example = os.path.basename(keyfile)[:-len('.key.csv')]
+        src = keyfile[:-len('.key.csv')] + '.csv'
+        for copies in args.copies:
+            datafile = os.path.join(args.cache_dir, '{e}.x{n}.csv'.format(e=example, n=copies))
+            rows_file = datafile + '.rows'
+            if os.path.exists(datafile) and os.path.exists(rows_file) and \
+               os.path.getmtime(datafile) >= os.path.getmtime(src):
+                with open(rows_file) as fp:
+                    rows = int(fp.read())
+            else:
+                kf = read_key.KeyFile()
+                kf.read(keyfile)
+                rows = benchmark.scale_datafile(src, datafile, copies, kf.globals['encoding'])
+                with open(rows_file, 'w') as fp:
+                    fp.write(str(rows))
+            for mode in modes:
+                cases.append({'example': example, 'keyfile': keyfile, 'datafile': datafile,
+                              'copies': copies, 'rows': rows, 'mode': mode})
+    return cases
+
+
+def case_key(case, fingerprint):
+    return hashlib.sha1(repr((fingerprint, file_sha1(case['keyfile']), file_sha1(case['datafile']),
+                              case['mode'])).encode('utf-8')).hexdigest()
+
+
+def run_cases(args, cases):
+    """Run the cases in parallel, using cached results where the inputs
+    and code haven't changed. Only one case converts at a time, so the
+    timings aren't skewed by the others. Returns the results in case
+    order.
+    """
+    cache_file = os.path.join(args.cache_dir, RESULTS_CACHE)
+    cache = {}
+    if os.path.exists(cache_file) and not args.refresh:
+        with open(cache_file, encoding='utf-8') as fp:
+            cache = json.load(fp)
+    fingerprint = code_fingerprint()
+    keys = [case_key(c, fingerprint) for c in cases]
+
+    todo = [(k, c) for (k, c) in zip(keys, cases) if k not in cache]
+    ran = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers, initializer=_start_worker,
+                                                initargs=(multiprocessing.Lock(),)) as pool:
+        for ((key, case), result) in zip(todo, pool.map(run_case, [c for (k, c) in todo])):
+            ran[key] = result
+            if result['error'] is None: # failures may be down to the environment, so try them again
+                cache[key] = result
+
+    with open(cache_file, 'w', encoding='utf-8') as fp:
+        json.dump(cache, fp)
+    results = []
+    for key in keys:
+        result = dict(ran[key] if key in ran else cache[key])
+        result['cached'] = key not in ran
+        results.append(result)
+    return results
+
+
+def compare_results(results, modes, baseline_mode=None):
+    """Fill in each result's 'equivalent': 'baseline', 'same',
+    'DIFFERENT', or why it couldn't be compared.
+
+    baseline_mode is a mode to compare all the others with, in place of
+    their own baselines
+    """
+    if baseline_mode is not None:
+        baselines = {m[0]: None if m[0] == baseline_mode else baseline_mode for m in modes}
+    else:
+        baselines = {name: baseline for (name, extra, outext, baseline) in modes}
+    by_case = {(r['example'], r['copies'], r['mode']): r for r in results}
+    for r in results:
+        baseline = baselines[r['mode']]
+        if r['error'] is not None:
+            r['equivalent'] = 'failed'
+        elif baseline is None:
+            r['equivalent'] = 'baseline'
+        else:
+            other = by_case.get((r['example'], r['copies'], baseline))
+            if other is None or other['error'] is not None:
+                r['equivalent'] = 'no ' + baseline
+            elif (r['features'], r['hash']) == (other['features'], other['hash']):
+                r['equivalent'] = 'same'
+            else:
+                r['equivalent'] = 'DIFFERENT'
+    return results
+
+
+FIELDS = ['example', 'copies', 'rows', 'mode', 'secs', 'rows_per_sec', 'features', 'hash',
+          'equivalent', 'cached', 'error']
+
+
+def report(results, output=None):
+    """Print a table of the results, and write them all to the CSV file
+    output, if given.
+    """
+    for r in results:
+        r['rows_per_sec'] = r['rows']/r['secs'] if r['secs'] else None
+    print("{e:>40s} {c:>6s} {m:>14s} {s:>9s} {rate:>11s} {f:>9s}  {q}".format(
+        e='example', c='copies', m='mode', s='secs', rate='rows/s', f='features', q='result'))
+    for r in results:
+        print("{e:>40s} {c:6d} {m:>14s} {s:>9s} {rate:>11s} {f:>9s}  {q}{cached}".format(
+            e=r['example'][:40], c=r['copies'], m=r['mode'],
+            s='{t:.3f}'.format(t=r['secs']) if r['secs'] is not None else '-',
+            rate='{t:.0f}'.format(t=r['rows_per_sec']) if r['rows_per_sec'] is not None else '-',
+            f=str(r['features']) if r['features'] is not None else '-',
+            q=r['equivalent'] if r['error'] is None else 'failed: ' + r['error'][:80],
+            cached=' (cached)' if r['cached'] else ''))
+    print("Each conversion was timed on its own, with no other case converting at the same time.")
+    if output is not None:
+        with open(output, 'w', encoding='utf-8', newline='') as fp:
+            writer = csv.DictWriter(fp, FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that CSVToGeo's modes write the same features, and time them")
+    parser.add_argument('--examples', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples'), help='Directory of NAME.key.csv and NAME.csv examples')
+    parser.add_argument('--copies', default='1,100', help='Comma-separated list of how many copies of each example to run')
+    parser.add_argument('--modes', default=None, help='Comma-separated list of modes to run; defaults to all of them: {m}'.format(m=', '.join(m[0] for m in MODES)))
+    parser.add_argument('--baseline', default=None, help="Compare every mode with this one, rather than with its own baseline, like '--modes geojsonl,parquet,spatial-sort --baseline geojsonl'")
+    parser.add_argument('--workers', type=int, default=None, help='Number of cases to run at once; defaults to one per CPU')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=DEFAULT_CACHE_DIR, help='Directory for the scaled data files and cached results')
+    parser.add_argument('--refresh', action='store_true', help='Run every case again, rather than using cached results')
+    parser.add_argument('--output', default=None, help='CSV file to write the results to')
+    args = parser.parse_args(argv)
+
+    args.copies = [int(c) for c in args.copies.split(',')]
+    if any(c < 1 for c in args.copies):
+        raise ValueError("The --copies must be at least 1")
+    modes = MODES
+    if args.modes is not None:
+        names = [m.strip() for m in args.modes.split(',')]
+        unknown = [n for n in names if n not in [m[0] for m in MODES]]
+        if unknown:
+            raise ValueError("Unrecognized --modes {u}, must be some of {opts}".format(
+                u=', '.join(unknown), opts=', '.join(m[0] for m in MODES)))
+        modes = [m for m in MODES if m[0] in names]
+    if args.baseline is not None and args.baseline not in [m[0] for m in modes]:
+        raise ValueError("The --baseline '{b}' must be one of the modes being run".format(b=args.baseline))
+    if not os.path.exists(args.cache_dir):
+        os.makedirs(args.cache_dir)
+
+    results = compare_results(run_cases(args, prepare_cases(args, modes)), modes, args.baseline)
+    report(results, args.output)
+    return 1 if any(r['equivalent'] == 'DIFFERENT' for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
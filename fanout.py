@@ -0,0 +1,147 @@
+# Sends one stream of records to several writers at once, so several
+# output formats can be written from a single pass over the data file.
+#
+# Each writer runs in its own thread and is fed batches of records
+# through a bounded queue, so a slow writer holds back the reader
+# rather than letting records pile up in memory. GDAL releases the GIL
+# while it writes, so OGR writers overlap with each other and with the
+# parsing. Records are tuples, so the same batch can be handed to every
+# writer.
+
+import queue
+import logging
+import threading
+
+
+# Records are handed to the writer threads in batches of this size.
+BATCH_SIZE = 512
+
+# Batches each writer thread may have waiting in its queue.
+QUEUE_BATCHES = 16
+
+
+# What the writer threads are told once the records have all been sent.
+_CLOSE = 'close'
+_ABORT = 'abort'
+
+
+class _FanOutThread(threading.Thread):
+    """Feeds the batches from its queue to one writer, then closes or
+    aborts it.
+    """
+    def __init__(self, writer):
+        threading.Thread.__init__(self, daemon=True)
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=QUEUE_BATCHES)
+        self.result = None
+        self.error = None
+
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is _CLOSE or item is _ABORT:
+                    break
+                # After an error, keep draining so the reader never
+                # blocks on a full queue.
+                if self.error is None:
+                    try:
+                        for record in item:
+                            self.writer.add_record(record)
+                    except Exception as e:
+                        self.error = e
+                        self._abort()
+            finally:
+                self.queue.task_done()
+        if self.error is not None:
+            return
+        if item is _ABORT:
+            self._abort()
+            return
+        try:
+            self.result = self.writer.close()
+        except Exception as e:
+            self.error = e
+
+
+    def _abort(self):
+        try:
+            self.writer.abort()
+        except Exception:
+            logging.exception("Could not clean up after a failed writer")
+
+
+class FanOutWriter(object):
+    """Writes each record to all of the writers. If any of them fails,
+    the others are aborted rather than closed, so no output is left
+    looking complete.
+
+    writers is a list of objects with add_record, close and abort
+      methods; abort stops without finishing the output
+    """
+    def __init__(self, writers):
+        self._threads = [_FanOutThread(w) for w in writers]
+        self._batch = []
+        self._stopped = False
+        for t in self._threads:
+            t.start()
+
+
+    def add_record(self, record):
+        self._batch.append(record)
+        if len(self._batch) >= BATCH_SIZE:
+            self._send()
+
+
+    def _send(self):
+        self._raise_error()
+        for t in self._threads:
+            t.queue.put(self._batch)
+        self._batch = []
+
+
+    def _raise_error(self):
+        for t in self._threads:
+            if t.error is not None:
+                raise t.error
+
+
+    def _stop(self, how):
+        """Tell every thread to close or abort its writer, and wait for
+        them.
+        """
+        if self._stopped:
+            return
+        self._stopped = True
+        for t in self._threads:
+            t.queue.put(how)
+        for t in self._threads:
+            t.join()
+
+
+    def close(self):
+        """Flush the records and wait for the writers to finish. Returns
+        the list of what each writer's close returned.
+        """
+        try:
+            if self._batch:
+                self._send()
+            # Only close the writers once they've all written everything.
+            for t in self._threads:
+                t.queue.join()
+            self._raise_error()
+        except BaseException:
+            self.abort()
+            raise
+        self._stop(_CLOSE)
+        self._raise_error()
+        return [t.result for t in self._threads]
+
+
+    def abort(self):
+        """Drop any records not yet sent, and stop the threads, aborting
+        the writers that haven't failed. Does nothing after close.
+        """
+        self._batch = []
+        self._stop(_ABORT)
@@ -0,0 +1,358 @@
+# Readers for the CSV data file.
+#
+# Both readers have the same interface: a header attribute with the
+# column names, and iteration that yields ({header: cell}, line_num)
+# tuples, where line_num is the physical line the record ended on, the
+# same as csv.reader's line_num.
+#
+# CSVModuleReader is the plain text-mode open() plus csv.reader, and
+# decodes every cell of every row. MmapReader memory-maps the file and
+# finds record boundaries with bulk byte searches, then decodes only
+# the cells for the columns the key file actually uses. It needs an
+# encoding where commas, quotes and newlines are always single bytes,
+# like UTF-8 or Latin-1.
+
+import io
+import os
+import csv
+import mmap
+import codecs
+import hashlib
+
+
+# Encodings where ',', '"', '\r' and '\n' can't be part of a multi-byte
+# character, so the raw bytes can be split before decoding.
+MMAP_ENCODINGS = set(['utf-8', 'utf-8-sig', 'ascii', 'latin-1', 'cp1252',
+                      'cp1250', 'cp1251', 'mac-roman'] +
+                     ['iso8859-{n}'.format(n=n) for n in range(1, 17)])
+
+# Approximate number of bytes handled at a time by MmapReader.
+BLOCK_SIZE = 1 << 20
+
+
+def mmap_encoding_ok(encoding):
+    """Return True if MmapReader can read files in this encoding."""
+    try:
+        return codecs.lookup(encoding).name in MMAP_ENCODINGS
+    except LookupError:
+        return False
+
+
+class CSVModuleReader(object):
+    """Reads the data file with csv.reader, keeping every column."""
+    def __init__(self, filename, encoding, wanted=None):
+        self._fp = open(filename, encoding=encoding, newline='')
+        self._reader = csv.reader(self._fp)
+        try:
+            self.header = next(self._reader)
+        except StopIteration:
+            self._fp.close()
+            raise ValueError("The data file '{f}' is empty".format(f=filename))
+
+
+    def __iter__(self):
+        header = self.header
+        reader = self._reader
+        for row in reader:
+            yield (dict(zip(header, row)), reader.line_num)
+
+
+    def close(self):
+        self._fp.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MmapReader(object):
+    """Reads the data file through mmap, decoding only the wanted
+    columns.
+
+    The file is handled in blocks of about BLOCK_SIZE bytes that end on
+    a record boundary. Blocks without any quotes are split into lines
+    and cells with bytes.split; blocks with quotes are handed to the
+    csv module as Latin-1 text, which maps each byte to one character
+    without any real decoding work. Either way, only the wanted cells
+    are decoded with the file's encoding.
+
+    filename is the data file
+    encoding is the data file's encoding; see mmap_encoding_ok()
+    wanted is a collection of column headers to keep, or None for all
+    """
+    def __init__(self, filename, encoding, wanted=None):
+        if not mmap_encoding_ok(encoding):
+            msg = "The mmap reader can't read files in the {enc} encoding; use the csv reader".format(enc=encoding)
+            raise ValueError(msg)
+        self.encoding = encoding
+        self._latin1 = codecs.lookup(encoding).name == 'iso8859-1'
+        self.line_num = 0
+        self.offset = 0
+        self._fp = open(filename, 'rb')
+        if os.fstat(self._fp.fileno()).st_size > 0:
+            self._data = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._data = b''
+
+        fields = self._header_fields()
+        if fields is None:
+            self.close()
+            raise ValueError("The data file '{f}' is empty".format(f=filename))
+        self.header = [f.decode(encoding) for f in fields]
+        self._columns = [(j, h) for (j, h) in enumerate(self.header)
+                         if wanted is None or h in wanted]
+
+
+    def _header_fields(self):
+        """Split the first record of the file into raw byte cells."""
+        end = self._block_end(self.offset, 1)
+        if end <= self.offset:
+            return None
+        block = self._data[self.offset:end]
+        self.offset = end
+        self.line_num = block.count(b'\n') or 1
+        row = next(csv.reader(io.StringIO(block.decode('latin-1'), newline='')), [])
+        return [f.encode('latin-1') for f in row]
+
+
+    def _block_end(self, start, size_hint=None):
+        """Return the offset just past the last record boundary in the
+        block starting at start, looking at about size_hint bytes.
+        """
+        if size_hint is None:
+            size_hint = BLOCK_SIZE
+        data = self._data
+        size = len(data)
+        if start >= size:
+            return start
+
+        # A newline ends a record if there are an even number of quotes
+        # before it in the block, since newlines in quoted cells are part
+        # of the cell. The rest of the file is all whole records, so a
+        # block that reaches the end takes all of it. Otherwise look back
+        # from the end of the block first.
+        end = min(start + size_hint, size)
+        if end == size:
+            return size
+        block = data[start:end]
+        nl = block.rfind(b'\n')
+        while nl >= 0:
+            if block.count(b'"', 0, nl) % 2 == 0:
+                return start + nl + 1
+            nl = block.rfind(b'\n', 0, nl)
+
+        # The block is one long record, so look forward instead.
+        quotes = 0
+        pos = start
+        while True:
+            nl = data.find(b'\n', pos)
+            if nl < 0:
+                return size
+            quotes += data[pos:nl].count(b'"')
+            if quotes % 2 == 0:
+                return nl + 1
+            pos = nl + 1
+
+
+    def blocks(self):
+        """Yield (start_offset, end_offset, rows) for each block of the
+        file, where rows is a list of ({header: cell}, line_num).
+        """
+        while True:
+            start = self.offset
+            end = self._block_end(start)
+            if end <= start:
+                return
+            block = self._data[start:end]
+            if b'"' in block:
+                rows = self._quoted_rows(block)
+            else:
+                rows = self._plain_rows(block)
+            self.offset = end
+            yield (start, end, rows)
+
+
+    def _plain_rows(self, block):
+        encoding = self.encoding
+        columns = self._columns
+        base = self.line_num
+        if b'\r' in block:
+            block = block.replace(b'\r\n', b'\n')
+        lines = block.split(b'\n')
+        if lines[-1] == b'':
+            lines.pop()
+        rows = []
+        for (i, line) in enumerate(lines, base+1):
+            fields = line.split(b',') if line else []
+            nfields = len(fields)
+            rows.append(({h: fields[j].decode(encoding) for (j, h) in columns if j < nfields}, i))
+        self.line_num = base + len(lines)
+        return rows
+
+
+    def _quoted_rows(self, block):
+        encoding = self.encoding
+        columns = self._columns
+        base = self.line_num
+        reader = csv.reader(io.StringIO(block.decode('latin-1'), newline=''))
+        # Pure ASCII decodes the same in every encoding allowed here.
+        transcode = not (self._latin1 or block.isascii())
+        rows = []
+        for row in reader:
+            nfields = len(row)
+            if not transcode:
+                raw_record = {h: row[j] for (j, h) in columns if j < nfields}
+            else:
+                raw_record = {h: row[j].encode('latin-1').decode(encoding) for (j, h) in columns if j < nfields}
+            rows.append((raw_record, base + reader.line_num))
+        self.line_num = base + reader.line_num
+        return rows
+
+
+    def __iter__(self):
+        for (start, end, rows) in self.blocks():
+            for row in rows:
+                yield row
+
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._fp.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ResumableReader(CSVModuleReader):
+    """A CSVModuleReader that can say where in the file it is, and
+    start again from there, for checkpoints.
+
+    The file is read in binary and decoded a line at a time, so the
+    byte offset after each record is known. A SHA-1 of the bytes read is
+    kept, so a resumed run can check that the part of the file already
+    converted hasn't changed since.
+
+    The lines are split on b'\n' before decoding, so the encoding must be
+    one of those that mmap_encoding_ok() allows.
+
+    start is a position() from an earlier reader of the same file
+    """
+    def __init__(self, filename, encoding, wanted=None, start=None):
+        if not mmap_encoding_ok(encoding):
+            msg = "Checkpoints can't be kept for files in the {enc} encoding; leave out --checkpoint".format(enc=encoding)
+            raise ValueError(msg)
+        self._fp = open(filename, 'rb')
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self.offset = 0
+        self._digest = hashlib.sha1()
+        self._line_base = 0
+        self._reader = csv.reader(self._lines())
+        try:
+            self.header = next(self._reader)
+        except StopIteration:
+            self._fp.close()
+            raise ValueError("The data file '{f}' is empty".format(f=filename))
+        if start is not None:
+            self._seek(filename, start)
+
+
+    def _lines(self):
+        for line in self._fp:
+            self.offset += len(line)
+            self._digest.update(line)
+            yield self._decoder.decode(line)
+
+
+    def _seek(self, filename, start):
+        self._fp.seek(0)
+        digest = hashlib.sha1()
+        left = start['offset']
+        while left > 0:
+            data = self._fp.read(min(left, 1 << 20))
+            if not data:
+                break
+            digest.update(data)
+            left -= len(data)
+        if left > 0 or digest.hexdigest() != start['sha1']:
+            self._fp.close()
+            msg = "The data file '{f}' has changed before line {n}, where the checkpoint was made".format(
+                f=filename, n=start['line_num'])
+            raise ValueError(msg)
+        self.offset = start['offset']
+        self._digest = digest
+        self._decoder.reset()
+        self._line_base = start['line_num'] - self._reader.line_num
+
+
+    def __iter__(self):
+        header = self.header
+        reader = self._reader
+        for row in reader:
+            yield (dict(zip(header, row)), reader.line_num + self._line_base)
+
+
+    def position(self):
+        """Return the position after the last record read, as a
+        JSON-ready dictionary to pass as start to a new reader.
+        """
+        return {'offset': self.offset, 'line_num': self._reader.line_num + self._line_base,
+                'sha1': self._digest.hexdigest()}
+
+
+class ShardReader(object):
+    """Reads several data files one after the other, as if they were
+    one. The header is the first file's, and the line numbers are each
+    file's own.
+
+    filenames is the list of data files
+    engine is the name of the reader to read each one with
+    """
+    def __init__(self, filenames, encoding, wanted=None, engine='csv'):
+        self.filenames = filenames
+        self.encoding = encoding
+        self.wanted = wanted
+        self.engine = engine
+        self.filename = filenames[0]
+        self._reader = open_reader(filenames[0], encoding, wanted, engine)
+        self.header = self._reader.header
+
+
+    def __iter__(self):
+        for (i, filename) in enumerate(self.filenames):
+            if i > 0:
+                self._reader.close()
+                self.filename = filename
+                self._reader = open_reader(filename, self.encoding, self.wanted, self.engine)
+            for row in self._reader:
+                yield row
+
+
+    def close(self):
+        self._reader.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+READERS = {'csv': CSVModuleReader,
+           'mmap': MmapReader}
+
+
+def open_reader(filename, encoding, wanted=None, engine='csv'):
+    """Open the data file with the named reader engine."""
+    return READERS[engine](filename, encoding, wanted)
@@ -0,0 +1,230 @@
+# Offline geocoding of addresses against a local gazetteer file.
+#
+# Some feeds give an address but no coordinates for a few rows. If the
+# key file's dllre has an 'address' group, those rows can be placed by
+# looking the address up in a gazetteer: a CSV file with address, lat
+# and lon columns, or an OGR point layer (like a GeoPackage of address
+# points) with an address field.
+#
+# Addresses are normalized (upper case, no punctuation, standard street
+# suffix abbreviations) and looked up in an in-memory index of the
+# gazetteer. Every result, found or not, is kept in a SQLite cache file,
+# so an address seen in an earlier run costs one cache lookup, and the
+# gazetteer isn't even loaded if every address is already cached.
+
+import os
+import re
+import csv
+import time
+import sqlite3
+import logging
+import threading
+
+import osgeo.ogr, osgeo.osr
+
+
+ABBREVIATIONS = {
+    'AVENUE': 'AVE', 'BOULEVARD': 'BLVD', 'CIRCLE': 'CIR', 'COURT': 'CT',
+    'DRIVE': 'DR', 'EXPRESSWAY': 'EXPY', 'HIGHWAY': 'HWY', 'LANE': 'LN',
+    'PARKWAY': 'PKWY', 'PLACE': 'PL', 'ROAD': 'RD', 'STREET': 'ST',
+    'TERRACE': 'TER', 'WAY': 'WAY',
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    }
+
+# Unit designators, and everything after them, are dropped for a
+# second try at an address that isn't found as given.
+_unit_re = re.compile(r'\s+(?:APT|UNIT|STE|SUITE|RM|ROOM|BLDG|#)\s*\S*.*$')
+_punct_re = re.compile(r'[^A-Z0-9#]+')
+
+# Cache rows written between commits.
+COMMIT_EVERY = 1000
+
+
+def normalize_address(address):
+    """Return address in the form used for lookups, or '' if blank."""
+    words = _punct_re.sub(' ', address.upper()).split()
+    return ' '.join(ABBREVIATIONS.get(w, w) for w in words)
+
+
+def _gazetteer_signature(filename, fields, epsg_code):
+    """Return a string that changes when the gazetteer file does, or
+    the columns or EPSG code its points are read with.
+    """
+    st = os.stat(filename)
+    return '{f}|{size}|{mtime}|{fields}|{epsg}'.format(f=os.path.abspath(filename), size=st.st_size,
+                                                     mtime=st.st_mtime, fields=','.join(fields), epsg=epsg_code)
+
+
+class Uncounted(object):
+    """A Geocoder whose lookups aren't added to its stats."""
+    def __init__(self, geocoder):
+        self.geocoder = geocoder
+
+
+    def geocode(self, address):
+        return self.geocoder.geocode(address, count=False)
+
+
+class Geocoder(object):
+    """Looks up addresses in a gazetteer, through a persistent cache.
+
+    gazetteer is a .csv file, or any point data source OGR can read
+    fields is the (address, lat, lon) column names for a .csv
+      gazetteer; only the address field is used for other formats
+    epsg_code is the EPSG code of the data file; points in an OGR
+      gazetteer are transformed to it, and .csv coordinates are
+      assumed to be in it already
+    cache_file is the SQLite cache filename
+    """
+    def __init__(self, gazetteer, fields, epsg_code, cache_file):
+        if not os.path.exists(gazetteer):
+            raise ValueError("The gazetteer '{f}' does not exist".format(f=gazetteer))
+        if len(fields) != 3:
+            msg = "The gazetteer fields must be address,lat,lon; got {fields}".format(fields=','.join(fields))
+            raise ValueError(msg)
+        self.gazetteer = gazetteer
+        self.fields = fields
+        self.epsg_code = epsg_code
+        self.cache_file = cache_file
+        self._index = None
+        self._memo = {}
+        self._pending = 0
+        # Conversions running in parallel (see watcher.py) share a
+        # geocoder, and so its cache connection.
+        self._lock = threading.Lock()
+        self.stats = {'rows': 0, 'memory_hits': 0, 'cache_hits': 0,
+                      'lookups': 0, 'not_found': 0, 'secs': 0.0}
+
+        self._db = sqlite3.connect(cache_file, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS geocodes (address TEXT PRIMARY KEY, dlat REAL, dlon REAL)")
+        # Results from a different gazetteer, or read from different
+        # columns or in a different EPSG code, can't be trusted.
+        signature = _gazetteer_signature(gazetteer, fields, epsg_code)
+        row = self._db.execute("SELECT value FROM metadata WHERE name = 'gazetteer'").fetchone()
+        if row is None or row[0] != signature:
+            if row is not None:
+                logging.info("Gazetteer {f}, its fields or the EPSG code changed; clearing the geocode cache {c}".format(
+                    f=gazetteer, c=cache_file))
+            self._db.execute("DELETE FROM geocodes")
+            self._db.execute("INSERT OR REPLACE INTO metadata VALUES ('gazetteer', ?)", (signature,))
+            self._db.commit()
+
+
+    def _load_index(self):
+        """Read the gazetteer into a {normalized address: (lat, lon)} map."""
+        start = time.time()
+        index = {}
+        if os.path.splitext(self.gazetteer)[1].lower() == '.csv':
+            (addr_col, lat_col, lon_col) = self.fields
+            with open(self.gazetteer, encoding='utf-8', newline='') as fp:
+                reader = csv.DictReader(fp)
+                missing = [c for c in self.fields if c not in (reader.fieldnames or [])]
+                if missing:
+                    msg = "The gazetteer '{f}' has no {cols} column".format(f=self.gazetteer, cols=', '.join(missing))
+                    raise ValueError(msg)
+                for row in reader:
+                    try:
+                        point = (float(row[lat_col]), float(row[lon_col]))
+                    except ValueError:
+                        continue
+                    index.setdefault(normalize_address(row[addr_col]), point)
+        else:
+            ds = osgeo.ogr.Open(self.gazetteer)
+            if ds is None:
+                raise ValueError("Could not open the gazetteer '{f}'".format(f=self.gazetteer))
+            layer = ds.GetLayer(0)
+            transform = None
+            src = layer.GetSpatialRef()
+            if src is not None:
+                dest = osgeo.osr.SpatialReference()
+                dest.ImportFromEPSG(self.epsg_code)
+                for srs in (src, dest):
+                    if hasattr(srs, 'SetAxisMappingStrategy'):
+                        srs.SetAxisMappingStrategy(osgeo.osr.OAMS_TRADITIONAL_GIS_ORDER)
+                if not src.IsSame(dest):
+                    transform = osgeo.osr.CoordinateTransformation(src, dest)
+            for feature in layer:
+                address = feature.GetField(self.fields[0])
+                geom = feature.GetGeometryRef()
+                if address is None or geom is None:
+                    continue
+                (x, y) = (geom.GetX(), geom.GetY())
+                if transform is not None:
+                    (x, y) = transform.TransformPoint(x, y)[:2]
+                index.setdefault(normalize_address(address), (y, x))
+            ds.Destroy()
+        index.pop('', None)
+        logging.info("Loaded {n} addresses from the gazetteer {f} in {secs:.2f}s".format(
+            n=len(index), f=self.gazetteer, secs=time.time()-start))
+        return index
+
+
+    def _lookup(self, key):
+        if self._index is None:
+            self._index = self._load_index()
+        point = self._index.get(key)
+        if point is None:
+            point = self._index.get(_unit_re.sub('', key))
+        return point
+
+
+    def geocode(self, address, count=True):
+        """Return the (dlat, dlon) for address, or None if it can't be
+        found. If count is False, the lookup isn't added to the stats,
+        for a second pass over rows that have been counted already.
+        """
+        start = time.perf_counter()
+        key = normalize_address(address)
+        with self._lock:
+            (point, source) = self._geocode(key)
+            if count:
+                stats = self.stats
+                stats['rows'] += 1
+                stats[source] += 1
+                if point is None:
+                    stats['not_found'] += 1
+                stats['secs'] += time.perf_counter() - start
+            return point
+
+
+    def _geocode(self, key):
+        """Return the point for key, and which of the stats it came from."""
+        if key in self._memo:
+            return (self._memo[key], 'memory_hits')
+        row = self._db.execute("SELECT dlat, dlon FROM geocodes WHERE address = ?", (key,)).fetchone()
+        if row is not None:
+            source = 'cache_hits'
+            point = None if row[0] is None else (row[0], row[1])
+        else:
+            source = 'lookups'
+            point = self._lookup(key) if key else None
+            (dlat, dlon) = point if point is not None else (None, None)
+            self._db.execute("INSERT OR REPLACE INTO geocodes VALUES (?, ?, ?)", (key, dlat, dlon))
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self._db.commit()
+                self._pending = 0
+        self._memo[key] = point
+        return (point, source)
+
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def report_stats(stats):
+    """Log and print a summary of the geocoding."""
+    rows = stats['rows']
+    if rows == 0:
+        return
+    cached = stats['memory_hits'] + stats['cache_hits']
+    lines = ["Geocoded {rows} rows: {pct:.0f}% cache hits ({mem} in memory, {db} from the cache file), {lookups} gazetteer lookups, {nf} not found.".format(
+                 rows=rows, pct=100.0*cached/rows, mem=stats['memory_hits'],
+                 db=stats['cache_hits'], lookups=stats['lookups'], nf=stats['not_found']),
+             "  Geocoding took {ms:.3f}ms per row on average.".format(ms=1000.0*stats['secs']/rows)]
+    for line in lines:
+        print(line)
+        logging.info(line)
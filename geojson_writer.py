@@ -0,0 +1,298 @@
+# Writes GeoJSON point data directly, without going through OGR.
+#
+# OGR's GeoJSON driver pretty-prints every feature and writes
+# coordinates at full precision. That's fine for looking at, but web
+# maps have to download the whole file, so size turns into latency.
+# This writer can round coordinates, use compact separators, drop
+# null properties, and write a pre-compressed sibling (.gz or .br)
+# in the same pass over the records.
+
+import os
+import json
+import math
+import gzip
+import time
+import logging
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+import records
+
+
+COMPRESS_EXTS = {'gzip': '.gz', 'brotli': '.br'}
+COMPACT_SEPARATORS = (',', ':')
+DEFAULT_SEPARATORS = (', ', ': ')
+
+# Number of features kept to estimate the savings compared to a
+# default (full precision, nulls kept, pretty separators) layout.
+SAMPLE_SIZE = 1000
+
+
+def crs_member(epsg_code):
+    """Return the 'crs' member for a FeatureCollection, or None.
+
+    WGS84 (EPSG 4326) is the GeoJSON default, so it needs no crs.
+    """
+    if epsg_code == 4326:
+        return None
+    return {'type': 'name',
+            'properties': {'name': 'urn:ogc:def:crs:EPSG::{code}'.format(code=epsg_code)}}
+
+
+def _finite(val):
+    if isinstance(val, float) and not math.isfinite(val):
+        return None
+    return val
+
+
+class CompactGeoJSONWriter(object):
+    """Streams point records into a GeoJSON FeatureCollection.
+
+    filename is the output .geojson filename
+    ids is the key file's {identifier: {name: value}} map
+    epsg_code is the integer EPSG projection code
+    precision is the number of decimal places for coordinates, or None for all
+    compact uses compact separators and one feature per line
+    dropnulls leaves null properties out of each feature
+    compress is None, 'gzip' or 'brotli', for a sibling file with that compression
+    bbox is an optional [minx, miny, maxx, maxy] extent of the records,
+      written as the collection's bbox member
+    """
+    def __init__(self, filename, ids, epsg_code, precision=None,
+                 compact=True, dropnulls=False, compress=None, bbox=None):
+        if compress is not None and compress not in COMPRESS_EXTS:
+            msg = "Unrecognized compression {c}, must be one of {opts}".format(
+                c=compress, opts=repr(sorted(COMPRESS_EXTS)))
+            raise ValueError(msg)
+        if compress == 'brotli' and brotli is None:
+            raise ValueError("Brotli compression needs the 'brotli' package")
+
+        self.filename = filename
+        self.ids = list(ids)
+        index = records.field_index(ids)
+        self._props = [(c, index[c]) for c in self.ids]
+        self.epsg_code = epsg_code
+        self.precision = precision
+        self.separators = COMPACT_SEPARATORS if compact else DEFAULT_SEPARATORS
+        self.dropnulls = dropnulls
+        self.compress = compress
+        self.bbox = bbox
+
+        self.feature_count = 0
+        self.bytes_written = 0
+        self.compressed_bytes = 0
+        self.sample = []
+        self.sample_baseline = []
+
+        self._fp = self._open_output()
+        self._zfp = None
+        self._compressor = None
+        if compress == 'gzip':
+            self._zfp = open(filename + COMPRESS_EXTS[compress], 'wb')
+            self._compressor = gzip.GzipFile(fileobj=self._zfp, mode='wb', compresslevel=9)
+        elif compress == 'brotli':
+            self._zfp = open(filename + COMPRESS_EXTS[compress], 'wb')
+            self._compressor = brotli.Compressor()
+        self._write_header()
+
+
+    def _open_output(self):
+        return open(self.filename, 'wb')
+
+
+    def _write(self, data):
+        self._fp.write(data)
+        self.bytes_written += len(data)
+        if self.compress == 'gzip':
+            self._compressor.write(data)
+        elif self.compress == 'brotli':
+            self._zfp.write(self._compressor.process(data))
+
+
+    def _write_header(self):
+        header = {'type': 'FeatureCollection'}
+        crs = crs_member(self.epsg_code)
+        if crs is not None:
+            header['crs'] = crs
+        if self.bbox is not None:
+            # Rounded like the coordinates, so it still holds them all.
+            if self.precision is not None:
+                header['bbox'] = [round(v, self.precision) for v in self.bbox]
+            else:
+                header['bbox'] = list(self.bbox)
+        text = json.dumps(header, separators=self.separators, ensure_ascii=False)
+        # Leave the collection open so features can be streamed into it.
+        self._write((text[:-1] + self.separators[0] + '"features"' +
+                     self.separators[1] + '[\n').encode('utf-8'))
+
+
+    def _feature(self, record, precision, dropnulls):
+        # JSON has no NaN or Infinity, so those properties are null.
+        props = {c: _finite(record[pos]) for (c, pos) in self._props}
+        if dropnulls:
+            props = {c: v for (c, v) in props.items() if v is not None}
+        x = record[records.DLON] # Note it's lon,lat not lat,lon
+        y = record[records.DLAT]
+        if not (math.isfinite(x) and math.isfinite(y)):
+            geometry = None
+        else:
+            if precision is not None:
+                x = round(x, precision)
+                y = round(y, precision)
+            geometry = {'type': 'Point', 'coordinates': [x, y]}
+        return {'type': 'Feature',
+                'properties': props,
+                'geometry': geometry}
+
+
+    def add_record(self, record):
+        text = json.dumps(self._feature(record, self.precision, self.dropnulls),
+                          separators=self.separators, ensure_ascii=False, allow_nan=False)
+        if self.feature_count > 0:
+            self._write((',\n' + text).encode('utf-8'))
+        else:
+            self._write(text.encode('utf-8'))
+        self.feature_count += 1
+        self._sample(record, text)
+
+
+    def _sample(self, record, text):
+        if len(self.sample) < SAMPLE_SIZE:
+            self.sample.append(text)
+            self.sample_baseline.append(json.dumps(
+                self._feature(record, None, False), separators=DEFAULT_SEPARATORS,
+                ensure_ascii=False, allow_nan=False))
+
+
+    def close(self):
+        """Finish the output file(s) and return a dictionary of stats."""
+        self._write(b'\n]}\n')
+        self._fp.close()
+        if self.compress == 'gzip':
+            self._compressor.close()
+        elif self.compress == 'brotli':
+            self._zfp.write(self._compressor.finish())
+        if self._zfp is not None:
+            self._zfp.close()
+            self.compressed_bytes = os.path.getsize(self._zfp.name)
+        return self.stats()
+
+
+    def abort(self):
+        """Stop without finishing the output, and remove what's been
+        written.
+        """
+        self._fp.close()
+        filenames = [self.filename]
+        if self._zfp is not None:
+            self._zfp.close()
+            filenames.append(self._zfp.name)
+        for filename in filenames:
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+
+    def stats(self):
+        """Compare the output to an estimate of the default layout.
+
+        The default layout's size is extrapolated from the sampled
+        features, and parse times are measured on the sample alone,
+        so these are estimates rather than exact figures.
+        """
+        retval = {'filename': self.filename,
+                  'features': self.feature_count,
+                  'bytes': self.bytes_written,
+                  'compressed_bytes': self.compressed_bytes,
+                  'baseline_bytes': self.bytes_written,
+                  'parse_secs': 0.0,
+                  'baseline_parse_secs': 0.0}
+        if not self.sample:
+            return retval
+
+        sample_bytes = sum(len(s.encode('utf-8')) for s in self.sample)
+        baseline_bytes = sum(len(s.encode('utf-8')) for s in self.sample_baseline)
+        retval['baseline_bytes'] = int(self.bytes_written * baseline_bytes / sample_bytes)
+
+        for (key, texts) in [('parse_secs', self.sample), ('baseline_parse_secs', self.sample_baseline)]:
+            text = '[' + ','.join(texts) + ']'
+            start = time.perf_counter()
+            json.loads(text)
+            retval[key] = time.perf_counter() - start
+        return retval
+
+
+class GeoJSONSeqWriter(CompactGeoJSONWriter):
+    """Streams point records as newline-delimited GeoJSON (GeoJSONSeq):
+    one compact Feature per line, with no enclosing FeatureCollection.
+    Unlike a FeatureCollection, the file can be added to later, so a
+    conversion can be resumed into it. GeoJSONSeq has nowhere to say
+    what the projection is, so it's best kept to WGS84 data.
+
+    resume is what commit() returned for an existing file, which is
+      cut back to that size and added to, or None to start a new file
+    The other arguments are as for CompactGeoJSONWriter.
+    """
+    def __init__(self, filename, ids, epsg_code, precision=None, dropnulls=False, resume=None):
+        self.resume = resume
+        CompactGeoJSONWriter.__init__(self, filename, ids, epsg_code, precision=precision,
+                                      compact=True, dropnulls=dropnulls)
+        if resume is not None:
+            self.bytes_written = resume['bytes']
+            self.feature_count = resume['features']
+
+
+    def _open_output(self):
+        if self.resume is None:
+            return open(self.filename, 'wb')
+        fp = open(self.filename, 'r+b')
+        fp.truncate(self.resume['bytes'])
+        fp.seek(self.resume['bytes'])
+        return fp
+
+
+    def _write_header(self):
+        pass
+
+
+    def add_record(self, record):
+        text = json.dumps(self._feature(record, self.precision, self.dropnulls),
+                          separators=self.separators, ensure_ascii=False, allow_nan=False)
+        self._write((text + '\n').encode('utf-8'))
+        self.feature_count += 1
+        self._sample(record, text)
+
+
+    def commit(self):
+        """Make sure what's been written is on disk, and return the
+        state to resume from, as a JSON-ready dictionary.
+        """
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        return {'bytes': self.bytes_written, 'features': self.feature_count}
+
+
+    def close(self):
+        """Finish the output file and return a dictionary of stats."""
+        self._fp.close()
+        return self.stats()
+
+
+def report_stats(stats):
+    """Log and print a summary of the savings from the compact output."""
+    lines = ["Wrote {n} features to {f}: {b} bytes, about {pct:.0f}% smaller than the default layout ({bb} bytes).".format(
+        n=stats['features'], f=stats['filename'], b=stats['bytes'], bb=stats['baseline_bytes'],
+        pct=100.0*(1.0 - stats['bytes']/max(stats['baseline_bytes'], 1)))]
+    if stats['compressed_bytes']:
+        lines.append("  Pre-compressed sibling is {cb} bytes.".format(cb=stats['compressed_bytes']))
+    if stats['baseline_parse_secs'] > 0:
+        lines.append("  Parsing sampled features took {t:.4f}s, versus {bt:.4f}s for the default layout.".format(
+            t=stats['parse_secs'], bt=stats['baseline_parse_secs']))
+    for line in lines:
+        print(line)
+        logging.info(line)
@@ -0,0 +1,146 @@
+# Writes point records as GeoParquet, for analytics tools that load the
+# output into dataframes.
+#
+# GeoJSON has to be parsed back into numbers, and its column types
+# guessed again, on every load. Parquet keeps each column's values
+# together with their type, so a reader can load just the columns it
+# wants without parsing anything. The key file datatypes map straight
+# onto Arrow types, and the points are stored as WKB in a 'geometry'
+# column described by the GeoParquet 'geo' metadata.
+#
+# Records are buffered a row group at a time, then turned into Arrow
+# columns in one go. This needs the 'pyarrow' package.
+
+import os
+import json
+import struct
+import logging
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import records
+
+
+GEOPARQUET_VERSION = '1.0.0'
+GEOMETRY_COLUMN = 'geometry'
+DEFAULT_ROW_GROUP_SIZE = 65536
+COMPRESSIONS = ['brotli', 'gzip', 'lz4', 'none', 'snappy', 'zstd']
+
+# Little-endian WKB point: byte order, geometry type 1, x, y.
+_wkb_point = struct.Struct('<BIdd')
+
+
+def arrow_type(datatype):
+    """Return the Arrow type for a key file datatype."""
+    return {'integer': pyarrow.int64(),
+            'real': pyarrow.float64(),
+            'string': pyarrow.string()}[datatype]
+
+
+def crs_projjson(epsg_code):
+    """Return the PROJJSON crs for the geo metadata, or None.
+
+    GeoParquet coordinates default to longitude, latitude on WGS84
+    (OGC:CRS84), so EPSG 4326 needs no crs.
+    """
+    if epsg_code == 4326:
+        return None
+    # Only needed here, so WGS84 output works without GDAL.
+    import osgeo.osr
+    srs = osgeo.osr.SpatialReference()
+    srs.ImportFromEPSG(epsg_code)
+    return json.loads(srs.ExportToPROJJSON())
+
+
+class GeoParquetWriter(object):
+    """Streams point records into a GeoParquet file.
+
+    filename is the output .parquet filename
+    ids is the key file's {identifier: {name: value}} map
+    epsg_code is the integer EPSG projection code
+    row_group_size is the number of rows in each Parquet row group
+    compression is one of COMPRESSIONS
+    bbox is an optional [minx, miny, maxx, maxy] extent of the records,
+      written in the geo metadata
+    """
+    def __init__(self, filename, ids, epsg_code, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                 compression='snappy', bbox=None):
+        if pyarrow is None:
+            raise ValueError("GeoParquet output needs the 'pyarrow' package")
+        if compression not in COMPRESSIONS:
+            msg = "Unrecognized compression {c}, must be one of {opts}".format(
+                c=compression, opts=repr(COMPRESSIONS))
+            raise ValueError(msg)
+        if row_group_size < 1:
+            raise ValueError("The row group size must be at least 1")
+
+        self.filename = filename
+        self.row_group_size = row_group_size
+        index = records.field_index(ids)
+        self.ids = list(ids)
+        self._positions = [index[c] for c in self.ids]
+
+        column = {'encoding': 'WKB', 'geometry_types': ['Point']}
+        crs = crs_projjson(epsg_code)
+        if crs is not None:
+            column['crs'] = crs
+        if bbox is not None:
+            column['bbox'] = list(bbox)
+        geo = {'version': GEOPARQUET_VERSION, 'primary_column': GEOMETRY_COLUMN,
+               'columns': {GEOMETRY_COLUMN: column}}
+
+        fields = [pyarrow.field(c, arrow_type(ids[c]['datatype'])) for c in self.ids]
+        fields.append(pyarrow.field(GEOMETRY_COLUMN, pyarrow.binary()))
+        self.schema = pyarrow.schema(fields, metadata={b'geo': json.dumps(geo).encode('utf-8')})
+        self._writer = pyarrow.parquet.ParquetWriter(filename, self.schema, compression=compression)
+
+        self._batch = []
+        self.row_count = 0
+        self.row_groups = 0
+
+
+    def add_record(self, record):
+        self._batch.append(record)
+        if len(self._batch) >= self.row_group_size:
+            self._flush()
+
+
+    def _flush(self):
+        if not self._batch:
+            return
+        columns = list(zip(*self._batch))
+        arrays = [pyarrow.array(columns[pos], type=field.type)
+                  for (pos, field) in zip(self._positions, self.schema)]
+        arrays.append(pyarrow.array(
+            [_wkb_point.pack(1, 1, x, y) for (x, y) in zip(columns[records.DLON], columns[records.DLAT])],
+            type=pyarrow.binary()))
+        self._writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema),
+                                 row_group_size=self.row_group_size)
+        self.row_count += len(self._batch)
+        self.row_groups += 1
+        self._batch = []
+
+
+    def close(self):
+        """Finish the file and return a dictionary of stats."""
+        self._flush()
+        self._writer.close()
+        return {'filename': self.filename, 'rows': self.row_count, 'row_groups': self.row_groups}
+
+
+    def abort(self):
+        """Stop without finishing the file, and remove it."""
+        self._batch = []
+        self._writer.close()
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+
+def report_stats(stats):
+    """Log a summary of the GeoParquet output."""
+    logging.info("Wrote {rows} rows in {groups} row groups to {f}".format(
+        rows=stats['rows'], groups=stats['row_groups'], f=stats['filename']))
@@ -0,0 +1,315 @@
+# Makes a draft key file for a CSV data file.
+#
+# Writing a key file by hand is slow, and a wrong data type (like
+# 'integer' for a zipcode column with one bad value) only shows up
+# late in a conversion. This tool reads a random sample of the rows,
+# spread over the whole file, and proposes:
+#
+# * a data type for each column, following the same NA rules as the
+#   conversion, so anything it calls an integer or real will parse
+# * the location columns: either dlatcol and dloncol, or a Socrata-
+#   style dllcol with a matching dllre
+# * an identifier for each column, and a maxskippct that allows for
+#   the rows in the sample without a location
+#
+# The result is a starting point in the format read_key.KeyFile reads.
+# Look it over before using it: drop columns you don't need, and fix
+# up identifiers and short names.
+#
+# Run like this:
+#
+#   python3 make_key.py --datafile Solid_Waste_Centers.csv
+#
+# which writes Solid_Waste_Centers.gen.key.csv. Once it's been checked,
+# rename it to Solid_Waste_Centers.key.csv; until then, the --watch mode
+# of CSVToGeo.py leaves it alone.
+
+import os
+import re
+import csv
+import math
+import random
+import argparse
+
+import parse_datatypes
+import fast_reader
+
+
+DATA_PARSE = parse_datatypes.ParseDatatype(number_NA=[''])
+
+# Draft key files are named NAME.gen.key.csv, so they aren't mistaken
+# for checked ones.
+DRAFT_KEY_EXT = '.gen.key.csv'
+
+INTEGER_PAT = re.compile(r'^[-+]?[0-9]+$')
+REAL_PAT = re.compile(r'^[-+]?([0-9]+[.]?[0-9]*|[.][0-9]+)([eE][-+]?[0-9]+)?$')
+
+LAT_NAMES = ['lat', 'latitude', 'y', 'dlat']
+LON_NAMES = ['lon', 'long', 'lng', 'longitude', 'x', 'dlon']
+
+# Socrata-style location cells end with "(lat, lon)".
+DLL_PAT = re.compile(r'[(]\s*([-0-9.]+)\s*,\s*([-0-9.]+)\s*[)]\s*$')
+DLLRE_ADDRESS = r'^(?P<address>.*)\n[(](?P<dlat>[-0-9.]+), ?(?P<dlon>[-0-9.]+)[)]$'
+DLLRE_PLAIN = r'^.*[(](?P<dlat>[-0-9.]+), ?(?P<dlon>[-0-9.]+)[)]$'
+
+# Fraction of a column's non-blank sample values that must look like
+# a location for the column to be proposed as the dllcol.
+DLL_MIN_FRACTION = 0.5
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Make a draft key file for a CSV data file')
+    parser.add_argument('--datafile', metavar='datafile', help='Name of the data CSV file')
+    parser.add_argument('--keyfile', metavar='keyfile', default=None, help='Name of the key file to write; defaults to the data file name with {ext}'.format(ext=DRAFT_KEY_EXT))
+    parser.add_argument('--encoding', dest='encoding', default='utf-8', help="Name of the data file's encoding, if not utf-8")
+    parser.add_argument('--epsg', dest='epsg', type=int, default=4326, help='EPSG code of the data coordinates; defaults to 4326 (WGS84)')
+    parser.add_argument('--source', dest='source', default='', help='URL the data came from')
+    parser.add_argument('--samplesize', dest='samplesize', type=int, default=10000, help='Number of rows to sample')
+    parser.add_argument('--seed', dest='seed', type=int, default=None, help='Random seed, for repeatable samples')
+    parser.add_argument('--reader', dest='reader', choices=sorted(fast_reader.READERS), default='csv', help="How to read the data file")
+    parser.add_argument('--force', dest='force', action='store_true', help='Overwrite an existing key file')
+
+    args = parser.parse_args(argv)
+    return args
+
+
+def reservoir_sample(iterable, k, rng=None):
+    """Return (sample, count): a uniform random sample of up to k items
+    from iterable, and the total number of items, in one pass.
+    """
+    if rng is None:
+        rng = random.Random()
+    sample = []
+    count = 0
+    for item in iterable:
+        count += 1
+        if len(sample) < k:
+            sample.append(item)
+        else:
+            j = rng.randrange(count)
+            if j < k:
+                sample[j] = item
+    return (sample, count)
+
+
+def infer_datatype(values):
+    """Return 'integer', 'real' or 'string' for a list of cell values.
+
+    Blank values are NA for numbers, as in the conversion. Integers
+    with leading zeros, like zipcodes 01234, are kept as strings so the
+    zeros aren't lost.
+    """
+    values = [v.strip() for v in values]
+    values = [v for v in values if v not in DATA_PARSE.number_NA]
+    if not values:
+        return 'string'
+    if all(INTEGER_PAT.match(v) for v in values):
+        if any(len(v.lstrip('+-')) > 1 and v.lstrip('+-').startswith('0') for v in values):
+            return 'string'
+        return 'integer'
+    if all(REAL_PAT.match(v) for v in values):
+        return 'real'
+    return 'string'
+
+
+def make_identifier(header, used):
+    """Make a valid identifier of up to 10 characters from a column
+    header, different from any in the set used.
+    """
+    ident = re.sub('[^a-z0-9]+', '_', header.lower().replace('\ufeff', '')).strip('_')
+    if not ident or not ident[0].isalpha():
+        ident = 'c_' + ident
+    ident = ident[:10].rstrip('_')
+    if len(ident) < 2:
+        ident = ident + '_1'
+    base = ident
+    n = 1
+    while ident in used or ident in ['dlat', 'dlon']:
+        n += 1
+        suffix = '_{n}'.format(n=n)
+        ident = base[:10-len(suffix)] + suffix
+    used.add(ident)
+    return ident
+
+
+def _in_range(val, limit):
+    try:
+        return abs(float(val)) <= limit
+    except ValueError:
+        return False
+
+
+def find_latlon_cols(header, columns, datatypes):
+    """Return (dlatcol, dloncol) headers, or (None, None)."""
+    def pick(names, limit):
+        for h in header:
+            if h.strip().lower() in names and datatypes[h] in ['real', 'integer']:
+                if all(_in_range(v, limit) for v in columns[h] if v.strip() != ''):
+                    return h
+        return None
+    dlatcol = pick(LAT_NAMES, 90)
+    dloncol = pick(LON_NAMES, 180)
+    if dlatcol is None or dloncol is None:
+        return (None, None)
+    return (dlatcol, dloncol)
+
+
+def find_dll_col(header, columns):
+    """Return (dllcol, dllre pattern, has_address), or (None, None, False).
+
+    Picks the column where the most sample values end with a
+    (lat, lon) pair, then the most specific dllre that matches them.
+    """
+    best = (None, 0)
+    for h in header:
+        values = [v for v in columns[h] if v.strip() != '']
+        if not values:
+            continue
+        matches = 0
+        for v in values:
+            m = DLL_PAT.search(v)
+            if m and _in_range(m.group(1), 90) and _in_range(m.group(2), 180):
+                matches += 1
+        if matches >= DLL_MIN_FRACTION*len(values) and matches > best[1]:
+            best = (h, matches)
+    dllcol = best[0]
+    if dllcol is None:
+        return (None, None, False)
+
+    values = [v.strip() for v in columns[dllcol] if v.strip() != '']
+    plain = re.compile(DLLRE_PLAIN, flags=re.DOTALL)
+    address = re.compile(DLLRE_ADDRESS, flags=re.DOTALL)
+    plain_count = sum(1 for v in values if plain.match(v))
+    address_count = sum(1 for v in values if address.match(v))
+    if address_count >= plain_count:
+        return (dllcol, DLLRE_ADDRESS, True)
+    return (dllcol, DLLRE_PLAIN, False)
+
+
+def location_count(sample, dlatcol=None, dloncol=None, dllcol=None, dllre=None):
+    """Count the sample rows that would have a usable location."""
+    count = 0
+    pat = re.compile(dllre, flags=re.DOTALL) if dllre else None
+    for raw_record in sample:
+        try:
+            if pat is not None:
+                m = pat.match(raw_record.get(dllcol, '').strip())
+                if m and DATA_PARSE.real(m.group('dlat')) is not None and DATA_PARSE.real(m.group('dlon')) is not None:
+                    count += 1
+            elif DATA_PARSE.real(raw_record.get(dlatcol, '').strip()) is not None and \
+                 DATA_PARSE.real(raw_record.get(dloncol, '').strip()) is not None:
+                count += 1
+        except ValueError:
+            pass
+    return count
+
+
+def propose_key(header, sample):
+    """Work out the key file settings from the sampled rows.
+
+    Returns (settings, cols): a list of (name, value) global settings and
+    a list of {'csv_header', 'identifier', 'datatype', 'shortname'}
+    column settings.
+    """
+    columns = {h: [r.get(h, '') for r in sample] for h in header}
+    datatypes = {h: infer_datatype(columns[h]) for h in header}
+
+    cols = []
+    used = set()
+    (dlatcol, dloncol) = find_latlon_cols(header, columns, datatypes)
+    (dllcol, dllre, has_address) = (None, None, False)
+    if dlatcol is None:
+        (dllcol, dllre, has_address) = find_dll_col(header, columns)
+    if has_address:
+        # The dllre's address group only fills an identifier named
+        # exactly 'address', so a CSV column of that name gives way.
+        used.add('address')
+
+    for h in header:
+        if h == dllcol:
+            # The location column itself isn't copied; its parts are.
+            cols.append({'csv_header': h, 'identifier': '', 'datatype': '', 'shortname': h})
+        elif h == dlatcol:
+            cols.append({'csv_header': h, 'identifier': 'dlat', 'datatype': 'real', 'shortname': 'Latitude'})
+        elif h == dloncol:
+            cols.append({'csv_header': h, 'identifier': 'dlon', 'datatype': 'real', 'shortname': 'Longitude'})
+        else:
+            cols.append({'csv_header': h, 'identifier': make_identifier(h, used),
+                         'datatype': datatypes[h], 'shortname': h.replace('\ufeff', '')})
+    if dllcol is not None:
+        cols.append({'csv_header': '', 'identifier': 'dlat', 'datatype': 'real', 'shortname': 'Latitude'})
+        cols.append({'csv_header': '', 'identifier': 'dlon', 'datatype': 'real', 'shortname': 'Longitude'})
+        if has_address:
+            cols.append({'csv_header': '', 'identifier': 'address',
+                         'datatype': 'string', 'shortname': 'Complete Address'})
+
+    if dllcol is not None:
+        located = location_count(sample, dllcol=dllcol, dllre=dllre)
+    elif dlatcol is not None:
+        located = location_count(sample, dlatcol=dlatcol, dloncol=dloncol)
+    else:
+        located = 0
+    skippct = 0
+    if sample and located < len(sample):
+        skippct = min(99, int(math.ceil(100.0*(len(sample) - located)/len(sample))) + 1)
+
+    settings = [('dlatcol', dlatcol or ''),
+                ('dloncol', dloncol or ''),
+                ('dllcol', dllcol or ''),
+                ('dllre', dllre or ''),
+                ('maxskippct', skippct)]
+    return (settings, cols)
+
+
+def write_key(filename, source, epsg_code, encoding, settings, cols):
+    """Write a key file in the format read_key.KeyFile reads."""
+    with open(filename, 'w', encoding='utf-8', newline='') as fp:
+        writer = csv.writer(fp, quoting=csv.QUOTE_NONNUMERIC)
+        writer.writerow(['source', source])
+        writer.writerow(['epsg_code', epsg_code])
+        for (name, value) in settings:
+            if name == 'maxskippct':
+                writer.writerow(['encoding', encoding])
+            writer.writerow([name, value])
+        writer.writerow([])
+        for row in ['csv_header', 'identifier', 'datatype']:
+            writer.writerow([row] + [c[row] for c in cols])
+        writer.writerow(['shortname:English'] + [c['shortname'] for c in cols])
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.datafile is None:
+        raise ValueError("Must supply a --datafile")
+    if not os.path.exists(args.datafile):
+        raise ValueError("The --datafile '{filename}' does not exist".format(filename=args.datafile))
+    if args.samplesize < 1:
+        raise ValueError("The --samplesize must be at least 1")
+    keyfile = args.keyfile
+    if keyfile is None:
+        keyfile = os.path.splitext(args.datafile)[0] + DRAFT_KEY_EXT
+    if os.path.exists(keyfile) and not args.force:
+        raise ValueError("The key file '{filename}' already exists; use --force to overwrite it".format(filename=keyfile))
+
+    with fast_reader.open_reader(args.datafile, args.encoding, None, args.reader) as reader:
+        header = reader.header
+        (sample, row_count) = reservoir_sample((raw_record for (raw_record, line_num) in reader),
+                                               args.samplesize, random.Random(args.seed))
+
+    encoding = args.encoding
+    if header and header[0].startswith('\ufeff') and encoding.lower().replace('_', '-') in ['utf-8', 'utf8']:
+        # A byte order mark ("CSV for Excel") would end up in the first header.
+        encoding = 'utf-8-sig'
+        header = [header[0][1:]] + header[1:]
+        sample = [{(h[1:] if h.startswith('\ufeff') else h): v for (h, v) in r.items()} for r in sample]
+
+    (settings, cols) = propose_key(header, sample)
+    write_key(keyfile, args.source, args.epsg, encoding, settings, cols)
+    print("Sampled {n} of {rows} rows; wrote draft key file {kf}. Please review it before use.".format(
+        n=len(sample), rows=row_count, kf=keyfile))
+    return keyfile
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# Routes records into one output data source per partition, in a
+# single pass over the data.
+#
+# Records can be partitioned by the value of one identifier (like a
+# service type), by a square grid over their coordinates, or both. The
+# partitions are spread over a few writer threads, each with its own
+# queue, so a partition's data source is only ever touched by one
+# thread and GDAL can write several partitions at once. Each thread
+# keeps only a few data sources open, closing the least recently used
+# one when it needs another and reopening it to append if more records
+# turn up later.
+#
+# Batches waiting in the queues can be dictionary encoded with a
+# string_dict.RecordEncoder, so repeated strings are only kept once.
+
+import os
+import re
+import csv
+import math
+import zlib
+import queue
+import threading
+import collections
+
+import records
+
+
+# Records are handed to the writer threads in batches of this size.
+BATCH_SIZE = 512
+
+# Batches each writer thread may have waiting in its queue.
+QUEUE_BATCHES = 16
+
+_unsafe_chars = re.compile('[^-_a-zA-Z0-9]+')
+
+
+def partition_key(record, partition_pos=None, grid_size=None):
+    """Return the partition key for a record, as a string.
+
+    partition_pos is the record position of the identifier to partition
+    by, or None
+    """
+    parts = []
+    if partition_pos is not None:
+        val = record[partition_pos]
+        parts.append('null' if val is None or val == '' else str(val))
+    if grid_size is not None:
+        parts.append('x{x}_y{y}'.format(x=int(math.floor(record[records.DLON]/grid_size)),
+                                        y=int(math.floor(record[records.DLAT]/grid_size))))
+    return '_'.join(parts)
+
+
+def batch_records(batch):
+    """Yield the records in a batch, which is either a list of records
+    or a string_dict.RecordBatch of them.
+    """
+    if isinstance(batch, list):
+        return iter(batch)
+    return batch.rows()
+
+
+class _WriterThread(threading.Thread):
+    """Writes the batches from its queue, keeping at most max_open
+    writers open at once.
+    """
+    def __init__(self, open_writer, max_open):
+        threading.Thread.__init__(self, daemon=True)
+        self.open_writer = open_writer
+        self.max_open = max_open
+        self.queue = queue.Queue(maxsize=QUEUE_BATCHES)
+        self.writers = collections.OrderedDict()
+        self.created = set()
+        self.error = None
+
+
+    def run(self):
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                (filename, batch) = item
+                writer = self._writer(filename)
+                for record in batch_records(batch):
+                    writer.add_record(record)
+        except Exception as e:
+            self.error = e
+            # Keep draining so the router never blocks on a full queue.
+            while self.queue.get() is not None:
+                pass
+        finally:
+            for writer in self.writers.values():
+                writer.close()
+            self.writers.clear()
+
+
+    def _writer(self, filename):
+        if filename in self.writers:
+            self.writers.move_to_end(filename)
+            return self.writers[filename]
+        if len(self.writers) >= self.max_open:
+            (old_filename, old_writer) = self.writers.popitem(last=False)
+            old_writer.close()
+        writer = self.open_writer(filename, filename in self.created)
+        self.created.add(filename)
+        self.writers[filename] = writer
+        return writer
+
+
+class PartitionRouter(object):
+    """Sends each record to the writer for its partition.
+
+    fileroot is the output filename without the extension
+    outext is the output format extension
+    open_writer(filename, append) returns an object with add_record
+      and close methods, appending to filename if append is true
+    fields is the list of record field names, from records.record_fields()
+    partition_by is the identifier to partition by, or None
+    grid_size is the grid cell size in coordinate units, or None
+    threads is the number of writer threads
+    max_open is the most data sources open at once, over all threads
+    encoder is an optional string_dict.RecordEncoder for the batches,
+      with keys in the same order as fields
+    """
+    def __init__(self, fileroot, outext, open_writer, fields, partition_by=None,
+                 grid_size=None, threads=4, max_open=64, encoder=None):
+        if partition_by is None and grid_size is None:
+            raise ValueError("Need an identifier or a grid size to partition by")
+        if grid_size is not None and grid_size <= 0:
+            raise ValueError("The partition grid size must be greater than zero")
+        threads = max(1, min(threads, max_open))
+
+        self.fileroot = fileroot
+        self.outext = outext
+        self.partition_by = partition_by
+        self.partition_pos = None if partition_by is None else list(fields).index(partition_by)
+        self.grid_size = grid_size
+        self.encoder = encoder
+        self.partitions = collections.OrderedDict()
+        self._filenames = set()
+        self._batches = {}
+        self._stopped = False
+        self._threads = [_WriterThread(open_writer, max(1, max_open // threads))
+                         for i in range(threads)]
+        for t in self._threads:
+            t.start()
+
+
+    def _partition(self, key):
+        """Return the stats for partition key, making it if it's new."""
+        part = self.partitions.get(key)
+        if part is None:
+            safe = _unsafe_chars.sub('_', key) or '_'
+            filename = '{root}.{safe}{ext}'.format(root=self.fileroot, safe=safe, ext=self.outext)
+            n = 1
+            while filename in self._filenames:
+                n += 1
+                filename = '{root}.{safe}_{n}{ext}'.format(root=self.fileroot, safe=safe, n=n, ext=self.outext)
+            self._filenames.add(filename)
+            thread = self._threads[zlib.crc32(filename.encode('utf-8')) % len(self._threads)]
+            part = {'filename': filename, 'thread': thread, 'count': 0, 'extent': None}
+            self.partitions[key] = part
+        return part
+
+
+    def add_record(self, record):
+        key = partition_key(record, self.partition_pos, self.grid_size)
+        part = self._partition(key)
+        (x, y) = (record[records.DLON], record[records.DLAT])
+        part['count'] += 1
+        if part['extent'] is None:
+            part['extent'] = [x, y, x, y]
+        else:
+            e = part['extent']
+            part['extent'] = [min(e[0], x), min(e[1], y), max(e[2], x), max(e[3], y)]
+
+        batch = self._batches.get(key)
+        if batch is None:
+            batch = [] if self.encoder is None else self.encoder.new_batch()
+            self._batches[key] = batch
+        batch.append(record)
+        if len(batch) >= BATCH_SIZE:
+            self._send(key)
+
+
+    def _send(self, key):
+        part = self.partitions[key]
+        thread = part['thread']
+        if thread.error is not None:
+            raise thread.error
+        thread.queue.put((part['filename'], self._batches.pop(key)))
+
+
+    def _stop(self):
+        """Tell every thread there are no more records, and wait for
+        them to close their writers.
+        """
+        if self._stopped:
+            return
+        self._stopped = True
+        for t in self._threads:
+            t.queue.put(None)
+        for t in self._threads:
+            t.join()
+
+
+    def close(self):
+        """Flush all the partitions and wait for the writers. Returns
+        the {key: stats} for the partitions.
+        """
+        try:
+            for key in list(self._batches):
+                self._send(key)
+        finally:
+            self._stop()
+        for t in self._threads:
+            if t.error is not None:
+                raise t.error
+        return self.partitions
+
+
+    def abort(self):
+        """Drop any records not yet sent, and stop the threads, closing
+        their writers. Does nothing after close.
+        """
+        self._batches = {}
+        self._stop()
+
+
+    def write_index(self, filename):
+        """Write a CSV index listing each partition's file, feature
+        count and extent.
+        """
+        with open(filename, 'w', encoding='utf-8', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['partition', 'filename', 'count', 'xmin', 'ymin', 'xmax', 'ymax'])
+            for (key, part) in self.partitions.items():
+                writer.writerow([key, os.path.basename(part['filename']), part['count']] + part['extent'])
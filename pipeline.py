@@ -0,0 +1,192 @@
+# Runs the conversion pass as three stages connected by bounded queues,
+# so reading, parsing and writing overlap instead of taking turns.
+#
+# A reader thread reads the data file into blocks of rows, the calling
+# thread parses each block into records, and a writer thread hands the
+# records to the output. The csv module and GDAL both release the GIL
+# for part of their work, so the parsing keeps going while the other
+# two stages wait on the disk or on GDAL.
+#
+# The queues hold a number of blocks worked out from the size of the
+# first block, so the blocks waiting between stages take up about
+# memory_mb at most. If any stage fails, the others are stopped and the
+# error is raised from run().
+
+import time
+import queue
+import itertools
+import threading
+import logging
+
+
+# Rows per block.
+BLOCK_ROWS = 1024
+
+# Default ceiling, in megabytes, on the blocks waiting in the queues.
+DEFAULT_MEMORY_MB = 64
+
+# Rough Python overhead, in bytes, of a row dictionary and of each of
+# its cells, for estimating the size of a block.
+ROW_OVERHEAD = 240
+CELL_OVERHEAD = 110
+
+# How often, in seconds, a stage blocked on a queue checks whether the
+# run was cancelled.
+CANCEL_POLL_SECS = 0.1
+
+
+def block_bytes(rows):
+    """Estimate the memory taken by a block of ({header: cell},
+    line_num) rows.
+    """
+    return sum(ROW_OVERHEAD + sum(CELL_OVERHEAD + len(c or '') for c in raw.values())
+               for (raw, line_num) in rows)
+
+
+def _put(q, item, cancel):
+    """Put item on q, giving up and returning False if cancel is set
+    while waiting for room.
+    """
+    while True:
+        try:
+            q.put(item, timeout=CANCEL_POLL_SECS)
+            return True
+        except queue.Full:
+            if cancel.is_set():
+                return False
+
+
+class _ReaderThread(threading.Thread):
+    """Reads the rows into blocks on the parse queue, then a None."""
+    def __init__(self, rows, block_rows, out_queue, cancel):
+        threading.Thread.__init__(self, daemon=True)
+        self.rows = rows
+        self.block_rows = block_rows
+        self.queue = out_queue
+        self.cancel = cancel
+        self.error = None
+        self.wait_secs = 0.0
+
+
+    def run(self):
+        try:
+            while not self.cancel.is_set():
+                block = list(itertools.islice(self.rows, self.block_rows))
+                if not block:
+                    break
+                start = time.perf_counter()
+                if not _put(self.queue, block, self.cancel):
+                    return
+                self.wait_secs += time.perf_counter() - start
+        except Exception as e:
+            self.error = e
+        _put(self.queue, None, self.cancel)
+
+
+class _WriterThread(threading.Thread):
+    """Writes the record blocks from its queue until it gets a None."""
+    def __init__(self, write_block, in_queue, cancel):
+        threading.Thread.__init__(self, daemon=True)
+        self.write_block = write_block
+        self.queue = in_queue
+        self.cancel = cancel
+        self.error = None
+        self.wait_secs = 0.0
+
+
+    def run(self):
+        try:
+            while True:
+                start = time.perf_counter()
+                records = self.queue.get()
+                self.wait_secs += time.perf_counter() - start
+                if records is None or self.cancel.is_set():
+                    break
+                self.write_block(records)
+        except Exception as e:
+            self.error = e
+            self.cancel.set()
+
+
+def run(rows, parse_block, write_block, memory_mb=DEFAULT_MEMORY_MB, block_rows=BLOCK_ROWS):
+    """Read, parse and write, each stage in its own thread. Returns a
+    dictionary of stats.
+
+    rows is an iterator of ({header: cell}, line_num) rows; it's read
+      by the reader thread
+    parse_block is called in this thread with a list of rows, and
+      returns the list of records to write
+    write_block is called in the writer thread with each list of records
+    memory_mb is the ceiling on the blocks waiting in the queues
+    """
+    start = time.time()
+    rows = iter(rows)
+    stats = {'rows': 0, 'records': 0, 'blocks': 0, 'queue_blocks': 0,
+             'read_wait': 0.0, 'parse_wait': 0.0, 'write_wait': 0.0, 'secs': 0.0}
+
+    # Size the queues from the first block.
+    first = list(itertools.islice(rows, block_rows))
+    if first:
+        per_block = max(1, block_bytes(first))
+        stats['queue_blocks'] = max(1, int(memory_mb * 1024 * 1024 / 2 / per_block))
+    else:
+        stats['queue_blocks'] = 1
+    parse_queue = queue.Queue(maxsize=stats['queue_blocks'])
+    write_queue = queue.Queue(maxsize=stats['queue_blocks'])
+    cancel = threading.Event()
+    reader = _ReaderThread(rows, block_rows, parse_queue, cancel)
+    writer = _WriterThread(write_block, write_queue, cancel)
+    reader.start()
+    writer.start()
+
+    try:
+        block = first
+        while block:
+            # Once the writer has failed, anything parsed is thrown away.
+            if cancel.is_set():
+                break
+            stats['rows'] += len(block)
+            stats['blocks'] += 1
+            records = parse_block(block)
+            stats['records'] += len(records)
+            wait = time.perf_counter()
+            if not _put(write_queue, records, cancel):
+                break
+            block = parse_queue.get()
+            stats['parse_wait'] += time.perf_counter() - wait
+    except BaseException:
+        cancel.set()
+        raise
+    finally:
+        # Stop the reader, let the writer finish what it was given (or
+        # notice the cancel), and wait for both.
+        if cancel.is_set():
+            while reader.is_alive():
+                try:
+                    parse_queue.get(timeout=CANCEL_POLL_SECS)
+                except queue.Empty:
+                    pass
+        reader.join()
+        while writer.is_alive():
+            try:
+                write_queue.put(None, timeout=CANCEL_POLL_SECS)
+                break
+            except queue.Full:
+                pass
+        writer.join()
+
+    for stage in (writer, reader):
+        if stage.error is not None:
+            raise stage.error
+    stats['read_wait'] = reader.wait_secs
+    stats['write_wait'] = writer.wait_secs
+    stats['secs'] = time.time() - start
+    return stats
+
+
+def report_stats(stats):
+    """Log a summary of where the pipeline's stages waited."""
+    logging.info("Pipeline moved {rows} rows in {blocks} blocks of up to {size} rows, with up to {qb} blocks queued between stages.".format(
+        rows=stats['rows'], blocks=stats['blocks'], size=BLOCK_ROWS, qb=stats['queue_blocks']))
+    logging.info("  In {secs:.2f}s, the reader waited {rw:.2f}s for the parser, the parser {pw:.2f}s for the reader or writer, and the writer {ww:.2f}s for the parser.".format(
+        secs=stats['secs'], rw=stats['read_wait'], pw=stats['parse_wait'], ww=stats['write_wait']))
@@ -134,6 +134,8 @@ import copy
 
 import osgeo.osr
 
+import records
+
 
 class KeyFile(object):
     def __init__(self):
@@ -141,10 +143,14 @@ class KeyFile(object):
         self.globals = {}
         self.hdr_to_id = {}
         self.ids = {}
+        self.added_ids = []
+        self._record_type = None
 
 
     def read(self, filename, encoding='utf-8'):
         self.filename = filename
+        self.added_ids = []
+        self._record_type = None
 
         with open(filename, encoding=encoding, newline='') as fp:
             reader = csv.reader(fp)
@@ -153,6 +159,39 @@ class KeyFile(object):
             (self.hdr_to_id, self.ids) = self._read_cols(reader)
 
 
+    def add_id(self, id, datatype):
+        """Add an identifier that doesn't come from the data file, like
+        one filled in by a spatial join.
+        """
+        if id in self.ids:
+            msg = "The identifier {id} is already in the key file".format(id=id)
+            raise ValueError(msg)
+        self.ids[id] = {'csv_header': '', 'identifier': id, 'datatype': datatype}
+        self.added_ids.append(id)
+        self._record_type = None
+
+
+    def copy(self):
+        """Return a copy that identifiers can be added to without
+        changing this one.
+        """
+        kf = KeyFile()
+        kf.filename = self.filename
+        kf.globals = self.globals
+        kf.hdr_to_id = self.hdr_to_id
+        kf.ids = dict(self.ids)
+        kf.added_ids = list(self.added_ids)
+        kf._record_type = self._record_type
+        return kf
+
+
+    def record_type(self):
+        """Return the record type for parsed rows; see records.py."""
+        if self._record_type is None:
+            self._record_type = records.record_type(self.ids)
+        return self._record_type
+
+
     def _read_globals(self, reader):
         expected_keys = 'source epsg_code dlatcol dloncol dllcol dllre encoding maxskippct'.split()
         retval = {}
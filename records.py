@@ -0,0 +1,47 @@
+# Compact records for the parsed rows of a data file.
+#
+# Every parsed row has the same fields: dlat, dlon, then the key file's
+# other identifiers. Rather than a new dict per row, each key file gets
+# a record type, a namedtuple subclass with those fields in that order.
+# Records are tuples, so they are small and quick to make, and the
+# writers look values up by position, working out the positions once
+# from the key file's identifiers with field_index().
+#
+# Identifiers that aren't allowed as namedtuple attributes (like 'in')
+# get positional attribute names instead, but keep their place and
+# their name in _names. Code that still wants a dict can use _asdict().
+
+import collections
+
+
+DLAT = 0
+DLON = 1
+
+
+def record_fields(ids):
+    """Return the field names of the records for the key file ids, in
+    order.
+    """
+    return ('dlat', 'dlon') + tuple(c for c in ids if c not in ['dlat', 'dlon'])
+
+
+def field_index(ids):
+    """Return the {identifier: position} map for records of ids."""
+    return {name: i for (i, name) in enumerate(record_fields(ids))}
+
+
+def record_type(ids):
+    """Make the record type for the key file ids."""
+    names = record_fields(ids)
+    base = collections.namedtuple('Record', names, rename=True)
+
+    class Record(base):
+        __slots__ = ()
+        _names = names
+        _index = {name: i for (i, name) in enumerate(names)}
+
+        def _asdict(self):
+            """Return the record as an {identifier: value} dict."""
+            return dict(zip(self._names, self))
+
+    return Record
@@ -0,0 +1,113 @@
+# Filters that pick out which rows of the data file to convert.
+#
+# A RowFilter is checked while a row is being parsed, as early as it
+# can be: the --where conditions look at just their own cells before
+# anything else in the row is touched, and the --bbox test runs right
+# after the location is parsed. Rows that fail are dropped before the
+# rest of their cells are stripped and converted.
+
+import re
+import operator
+
+
+OPERATORS = {'=': operator.eq,
+             '!=': operator.ne,
+             '<': operator.lt,
+             '<=': operator.le,
+             '>': operator.gt,
+             '>=': operator.ge}
+
+_where_re = re.compile(r'^\s*(?P<id>[a-zA-Z][_a-zA-Z0-9]*)\s*(?P<op><=|>=|!=|=|<|>)\s*(?P<val>.*?)\s*$')
+
+
+def parse_bbox(text):
+    """Parse a 'minlon,minlat,maxlon,maxlat' string into a list of
+    four floats.
+    """
+    try:
+        bbox = [float(v) for v in text.split(',')]
+    except ValueError:
+        bbox = []
+    if len(bbox) != 4:
+        msg = "The --bbox '{text}' must be four numbers, minlon,minlat,maxlon,maxlat".format(text=text)
+        raise ValueError(msg)
+    if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        msg = "The --bbox '{text}' has a minimum larger than its maximum".format(text=text)
+        raise ValueError(msg)
+    return bbox
+
+
+def parse_where(text, kf, parse):
+    """Parse an 'identifier<op>value' string into a tuple of
+    (csv_header, datatype, compare function, typed value).
+
+    kf is the KeyFile
+    parse is the parse_datatypes.ParseDatatype for the data file
+    """
+    m = _where_re.match(text)
+    if m is None:
+        msg = "The --where '{text}' must look like identifier=value, using one of {ops}".format(
+            text=text, ops=' '.join(sorted(OPERATORS)))
+        raise ValueError(msg)
+    id = m.group('id')
+    if id not in kf.ids:
+        msg = "The --where '{text}' uses '{id}', which is not an identifier in the key file".format(text=text, id=id)
+        raise ValueError(msg)
+    hdr = kf.ids[id]['csv_header']
+    if hdr == '':
+        msg = "The --where '{text}' uses '{id}', which does not come straight from a data file column".format(text=text, id=id)
+        raise ValueError(msg)
+    datatype = kf.ids[id]['datatype']
+    try:
+        val = parse.typed_val(datatype, m.group('val'))
+    except ValueError:
+        msg = "The --where '{text}' compares '{id}' with '{val}', which is not a valid {datatype}".format(
+            text=text, id=id, val=m.group('val'), datatype=datatype)
+        raise ValueError(msg)
+    return (hdr, datatype, OPERATORS[m.group('op')], val)
+
+
+class RowFilter(object):
+    """Decides which rows to keep.
+
+    kf is the KeyFile
+    parse is the parse_datatypes.ParseDatatype for the data file
+    bbox is an optional [minlon, minlat, maxlon, maxlat], in the
+      coordinates of the data file
+    where is an optional list of 'identifier<op>value' strings, which
+      must all hold for a row to be kept
+    """
+    def __init__(self, kf, parse, bbox=None, where=None):
+        self.parse = parse
+        self.bbox = bbox
+        self.where = [parse_where(w, kf, parse) for w in (where or [])]
+
+
+    def match_cells(self, raw_record):
+        """Return True if the {header: cell} record passes the --where
+        conditions. Only the cells for those conditions are read, and a
+        cell that isn't a valid value of its datatype doesn't pass.
+        """
+        for (hdr, datatype, compare, val) in self.where:
+            cell = raw_record.get(hdr)
+            if cell is not None:
+                cell = cell.strip()
+            try:
+                cell_val = self.parse.typed_val(datatype, cell)
+            except ValueError:
+                return False
+            if cell_val is None or val is None:
+                # Nulls only compare with = and !=.
+                if compare not in (operator.eq, operator.ne) or not compare(cell_val, val):
+                    return False
+            elif not compare(cell_val, val):
+                return False
+        return True
+
+
+    def match_location(self, dlat, dlon):
+        """Return True if the location is inside the --bbox."""
+        bbox = self.bbox
+        if bbox is None:
+            return True
+        return bbox[0] <= dlon <= bbox[2] and bbox[1] <= dlat <= bbox[3]
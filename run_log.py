@@ -0,0 +1,177 @@
+# Logging for a conversion run, kept cheap enough not to slow it down.
+#
+# Log records go onto a queue, and a background thread formats them and
+# writes them to the log file, so the conversion never waits on the
+# disk. Rows skipped for having no position are counted by reason, and
+# only the first few of each reason are kept as examples; their
+# messages are formatted when they're logged, not when the row is read,
+# so a file with a million bad rows costs a million counts rather than a
+# million formatted lines.
+#
+# Worker processes are spawned rather than forked, so they don't
+# inherit the background thread, and send their records back to this
+# process's log through a multiprocessing queue.
+
+import os
+import sys
+import queue
+import logging
+import contextlib
+import logging.handlers
+import multiprocessing
+import concurrent.futures
+
+
+LOG_FORMAT = '%(asctime)s|%(levelno)d|%(levelname)s|%(filename)s|%(lineno)d|%(message)s'
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+DEFAULT_EXAMPLES = 10
+
+_listener = None
+_queue_handler = None
+
+
+def start(filename, level='INFO'):
+    """Send the root logger's records through a queue to a background
+    thread that writes them to filename, or to stderr if filename is
+    '-'. Any earlier start() is stopped first.
+    """
+    stop()
+    if filename == '-':
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        if os.path.dirname(filename) and not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        handler = logging.FileHandler(filename, encoding='utf-8')
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    global _listener, _queue_handler
+    _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(getattr(logging, level))
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, handler)
+    _listener.start()
+
+
+def stop():
+    """Write out whatever is still queued, and close the log."""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    (_listener, _queue_handler) = (None, None)
+
+
+class _Forward(logging.Handler):
+    """Hands records from worker processes to this process's loggers."""
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def _start_worker(log_queue, level):
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+
+
+@contextlib.contextmanager
+def process_pool(max_workers=None):
+    """Yield a concurrent.futures.ProcessPoolExecutor of spawned workers,
+    whose log records go to this process's log.
+    """
+    context = multiprocessing.get_context('spawn')
+    log_queue = context.Queue()
+    listener = logging.handlers.QueueListener(log_queue, _Forward())
+    listener.start()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=context, initializer=_start_worker,
+                initargs=(log_queue, logging.getLogger().level)) as pool:
+            yield pool
+    finally:
+        listener.stop()
+
+
+class Skip(object):
+    """Why a row was skipped. The message is only formatted if it's
+    logged.
+
+    reason is a short description shared by every row skipped for the
+      same thing
+    template is a str.format() template for this row's message
+    fields are the values for template
+    """
+    __slots__ = ['reason', 'template', 'fields']
+
+    def __init__(self, reason, template, **fields):
+        self.reason = reason
+        self.template = template
+        self.fields = fields
+
+
+    def __str__(self):
+        return self.template.format(**self.fields)
+
+
+class SkipLog(object):
+    """Counts skipped rows by reason, keeping up to examples of each for
+    the log.
+    """
+    def __init__(self, examples=DEFAULT_EXAMPLES):
+        self.examples = examples
+        self.counts = {}
+        self.kept = {}
+
+
+    def add(self, skip):
+        n = self.counts.get(skip.reason, 0)
+        self.counts[skip.reason] = n + 1
+        if n < self.examples:
+            self.kept.setdefault(skip.reason, []).append(skip)
+
+
+    def count(self):
+        return sum(self.counts.values())
+
+
+    def state(self):
+        """Return the counts and examples as a JSON-ready dictionary."""
+        return {reason: {'count': self.counts[reason],
+                         'examples': [str(s) for s in self.kept.get(reason, [])]}
+                for reason in self.counts}
+
+
+    def restore(self, state):
+        """Carry on from what state() returned."""
+        for (reason, saved) in state.items():
+            self.counts[reason] = saved['count']
+            self.kept[reason] = list(saved['examples'])
+
+
+    def merge(self, state, prefix=''):
+        """Add in what another SkipLog's state() returned, putting
+        prefix in front of its examples.
+        """
+        for (reason, saved) in state.items():
+            self.counts[reason] = self.counts.get(reason, 0) + saved['count']
+            kept = self.kept.setdefault(reason, [])
+            for example in saved['examples'][:max(self.examples - len(kept), 0)]:
+                kept.append(prefix + example)
+
+
+    def report(self):
+        """Log the count for each reason, and its examples."""
+        if not logging.getLogger().isEnabledFor(logging.INFO):
+            return
+        for reason in sorted(self.counts, key=lambda r: -self.counts[r]):
+            logging.info("  {n} rows skipped because the {reason}".format(n=self.counts[reason], reason=reason))
+            for skip in self.kept.get(reason, []):
+                logging.info("    " + str(skip))
+            left = self.counts[reason] - len(self.kept.get(reason, []))
+            if left > 0:
+                logging.info("    ... and {n} more like these".format(n=left))
@@ -0,0 +1,233 @@
+# Writes point shapefiles directly, without going through OGR.
+#
+# A point shapefile is three fixed-width files: the .shp has a 28 byte
+# record per point, the .shx has an 8 byte index record per point, and
+# the .dbf has one fixed-width attribute record per point. Since the
+# string widths are known from the check_cols pass, every record can
+# be packed with struct and written out in large blocks, rather than
+# creating an OGR feature for each row.
+#
+# The format is described in the ESRI Shapefile Technical Description,
+# https://www.esri.com/library/whitepapers/pdfs/shapefile.pdf
+# and the dBASE III file structure.
+
+import os
+import struct
+import datetime
+
+import osgeo.osr
+
+import records
+
+
+SHP_FILE_CODE = 9994
+SHP_VERSION = 1000
+SHP_POINT = 1
+SHP_HEADER_BYTES = 100
+SHP_RECORD_WORDS = 10 # shape type + x + y, in 16-bit words
+
+INTEGER_WIDTH = 11
+REAL_WIDTH = 24
+REAL_DECIMALS = 15
+MAX_STRING_WIDTH = 254
+
+SHP_RECORD_HEADER = struct.Struct('>2i')
+SHP_POINT_CONTENT = struct.Struct('<i2d')
+SHX_RECORD = struct.Struct('>2i')
+
+
+def _shp_header(file_bytes, bbox):
+    """Return the 100 byte header shared by the .shp and .shx files."""
+    return (struct.pack('>7i', SHP_FILE_CODE, 0, 0, 0, 0, 0, file_bytes//2) +
+            struct.pack('<2i', SHP_VERSION, SHP_POINT) +
+            struct.pack('<8d', bbox[0], bbox[1], bbox[2], bbox[3], 0.0, 0.0, 0.0, 0.0))
+
+
+def dbf_fields(ids, str_col_widths):
+    """Return a list of (identifier, dbf_type, width, decimals) for the
+    .dbf columns, matching the widths add_schema gives OGR.
+    """
+    fields = []
+    for c in ids:
+        if ids[c]['datatype'] == 'integer':
+            fields.append((c, b'N', INTEGER_WIDTH, 0))
+        elif ids[c]['datatype'] == 'real':
+            fields.append((c, b'N', REAL_WIDTH, REAL_DECIMALS))
+        elif ids[c]['datatype'] == 'string':
+            fields.append((c, b'C', min(str_col_widths[c]+5, MAX_STRING_WIDTH), 0)) # pad a little.
+        else:
+            msg = "Unrecognized data type {dt} for field {c}".format(
+                dt=ids[c]['datatype'], c=c)
+            raise ValueError(msg)
+    return fields
+
+
+def _integer_formatter(c, width):
+    blank = b'*' * width
+    def fmt(val):
+        if val is None:
+            return blank
+        text = b'%*d' % (width, val)
+        if len(text) > width:
+            msg = "Value {val} of field {c} is too wide for a shapefile integer".format(val=val, c=c)
+            raise ValueError(msg)
+        return text
+    return fmt
+
+
+def _real_formatter(c, width, decimals):
+    blank = b'*' * width
+    def fmt(val):
+        if val is None:
+            return blank
+        text = b'%*.*f' % (width, decimals, val)
+        if len(text) > width:
+            text = b'%*.*e' % (width, width - 8, val)
+        return text
+    return fmt
+
+
+def _string_formatter(c, width, encoding):
+    def fmt(val):
+        if val is None:
+            val = ''
+        data = val.encode(encoding)
+        if len(data) > width:
+            # Don't split a multi-byte character.
+            data = data[:width].decode(encoding, 'ignore').encode(encoding)
+        return data.ljust(width)
+    return fmt
+
+
+class ShapefileWriter(object):
+    """Writes point records to a .shp, .shx, .dbf, .prj and .cpg.
+
+    fileroot is the output filename without the .shp extension
+    ids is the key file's {identifier: {name: value}} map
+    str_col_widths is a dictionary of {identifiers: width}
+    epsg_code is the integer EPSG projection code
+    block_size is the number of records buffered before each write
+    """
+    def __init__(self, fileroot, ids, str_col_widths, epsg_code,
+                 encoding='utf-8', block_size=8192):
+        self.fileroot = fileroot
+        self.encoding = encoding
+        self.block_size = block_size
+        self.fields = dbf_fields(ids, str_col_widths)
+        self.record_count = 0
+        self.bbox = None
+
+        # (record position, formatter) for each .dbf column.
+        index = records.field_index(ids)
+        self._formatters = []
+        for (c, dbf_type, width, decimals) in self.fields:
+            if ids[c]['datatype'] == 'integer':
+                self._formatters.append((index[c], _integer_formatter(c, width)))
+            elif ids[c]['datatype'] == 'real':
+                self._formatters.append((index[c], _real_formatter(c, width, decimals)))
+            else:
+                self._formatters.append((index[c], _string_formatter(c, width, encoding)))
+        self._record_len = 1 + sum(f[2] for f in self.fields)
+
+        self._write_prj(epsg_code)
+        with open(fileroot+'.cpg', 'w') as fp:
+            fp.write(encoding.upper())
+
+        self._shp = open(fileroot+'.shp', 'wb')
+        self._shx = open(fileroot+'.shx', 'wb')
+        self._dbf = open(fileroot+'.dbf', 'wb')
+        # Headers are rewritten on close, once the counts and extent are known.
+        self._shp.write(b'\0' * SHP_HEADER_BYTES)
+        self._shx.write(b'\0' * SHP_HEADER_BYTES)
+        self._dbf.write(self._dbf_header())
+        self._shp_block = []
+        self._shx_block = []
+        self._dbf_block = []
+
+
+    def _write_prj(self, epsg_code):
+        srs = osgeo.osr.SpatialReference()
+        srs.ImportFromEPSG(epsg_code)
+        srs.MorphToESRI()
+        with open(self.fileroot+'.prj', 'w') as fp:
+            fp.write(srs.ExportToWkt())
+
+
+    def _dbf_header(self):
+        today = datetime.date.today()
+        header_len = 32 + 32*len(self.fields) + 1
+        header = struct.pack('<4BI2H20x', 3, today.year - 1900, today.month, today.day,
+                             self.record_count, header_len, self._record_len)
+        for (c, dbf_type, width, decimals) in self.fields:
+            name = c.encode('ascii')[:10]
+            header += struct.pack('<11sc4x2B14x', name, dbf_type, width, decimals)
+        return header + b'\r'
+
+
+    def add_record(self, record):
+        x = record[records.DLON] # Note it's lon,lat not lat,lon
+        y = record[records.DLAT]
+        if self.bbox is None:
+            self.bbox = [x, y, x, y]
+        else:
+            bbox = self.bbox
+            if x < bbox[0]: bbox[0] = x
+            if y < bbox[1]: bbox[1] = y
+            if x > bbox[2]: bbox[2] = x
+            if y > bbox[3]: bbox[3] = y
+
+        n = self.record_count
+        offset_words = (SHP_HEADER_BYTES//2) + n*(SHP_RECORD_WORDS + 4)
+        self._shp_block.append(SHP_RECORD_HEADER.pack(n+1, SHP_RECORD_WORDS))
+        self._shp_block.append(SHP_POINT_CONTENT.pack(SHP_POINT, x, y))
+        self._shx_block.append(SHX_RECORD.pack(offset_words, SHP_RECORD_WORDS))
+        self._dbf_block.append(b' ') # not deleted
+        self._dbf_block.extend(fmt(record[pos]) for (pos, fmt) in self._formatters)
+        self.record_count += 1
+
+        if len(self._shx_block) >= self.block_size:
+            self._flush()
+
+
+    def _flush(self):
+        self._shp.write(b''.join(self._shp_block))
+        self._shx.write(b''.join(self._shx_block))
+        self._dbf.write(b''.join(self._dbf_block))
+        self._shp_block = []
+        self._shx_block = []
+        self._dbf_block = []
+
+
+    def close(self):
+        """Flush the remaining records and fill in the headers. Returns
+        the number of records written.
+        """
+        self._flush()
+        self._dbf.write(b'\x1a') # end of file marker
+
+        bbox = self.bbox if self.bbox is not None else [0.0, 0.0, 0.0, 0.0]
+        n = self.record_count
+        shp_bytes = SHP_HEADER_BYTES + n*2*(SHP_RECORD_WORDS + 4)
+        shx_bytes = SHP_HEADER_BYTES + n*SHX_RECORD.size
+        for (fp, nbytes) in [(self._shp, shp_bytes), (self._shx, shx_bytes)]:
+            fp.seek(0)
+            fp.write(_shp_header(nbytes, bbox))
+            fp.close()
+        self._dbf.seek(0)
+        self._dbf.write(self._dbf_header())
+        self._dbf.close()
+        return n
+
+
+    def abort(self):
+        """Stop without finishing the shapefile, and remove its parts."""
+        for fp in (self._shp, self._shx, self._dbf):
+            fp.close()
+        remove_shapefile(self.fileroot)
+
+
+def remove_shapefile(fileroot):
+    """Remove any existing shapefile parts for fileroot."""
+    for ext in ['.shp', '.shx', '.dbf', '.prj', '.cpg']:
+        if os.path.exists(fileroot+ext):
+            os.unlink(fileroot+ext)
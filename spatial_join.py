@@ -0,0 +1,296 @@
+# Tags each point with the attributes of the polygon that contains it,
+# like the district or census tract a site is in.
+#
+# The polygon layer is read once, through OGR, and its polygons are
+# kept as plain lists of rings. A packed R-tree over the polygon
+# envelopes, built with Sort-Tile-Recursive (STR) packing, narrows each
+# point down to the few polygons whose envelopes hold it, and only those
+# get the exact point-in-polygon test. Points are looked up in batches,
+# walking the tree once per batch and splitting the batch as it goes
+# down, so each point costs about log(polygons) envelope tests.
+#
+# STR packing is described in Leutenegger, Lopez and Edgington, "STR: A
+# Simple and Efficient Algorithm for R-Tree Packing", ICDE 1997.
+
+import re
+import math
+import logging
+import threading
+
+import osgeo.ogr, osgeo.osr
+
+import records
+
+
+# Children per R-tree node.
+NODE_SIZE = 16
+
+# Points looked up together.
+BATCH_SIZE = 1024
+
+_idpat = re.compile('^[a-zA-Z][_a-zA-Z0-9]+$')
+
+
+def _union(boxes):
+    return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+
+def _str_order(boxes, node_size):
+    """Return the indices of boxes in Sort-Tile-Recursive order: sorted
+    into vertical slices by x, then by y within each slice.
+    """
+    n = len(boxes)
+    if n == 0:
+        return []
+    slices = int(math.ceil(math.sqrt(math.ceil(n / float(node_size)))))
+    per_slice = slices * node_size
+    by_x = sorted(range(n), key=lambda i: boxes[i][0] + boxes[i][2])
+    order = []
+    for s in range(0, n, per_slice):
+        chunk = by_x[s:s+per_slice]
+        chunk.sort(key=lambda i: boxes[i][1] + boxes[i][3])
+        order.extend(chunk)
+    return order
+
+
+class STRTree(object):
+    """A static R-tree over a list of (minx, miny, maxx, maxy)
+    envelopes, packed with Sort-Tile-Recursive.
+    """
+    def __init__(self, envelopes, node_size=NODE_SIZE):
+        self.node_size = node_size
+        self.items = _str_order(envelopes, node_size)
+        self.boxes = [envelopes[i] for i in self.items]
+        # levels[0] are the leaves. Each node is (envelope, start, end),
+        # with its children at [start:end] of the level below, or of
+        # items for a leaf.
+        self.levels = []
+        boxes = self.boxes
+        while boxes:
+            nodes = [(_union(boxes[s:s+node_size]), s, min(s+node_size, len(boxes)))
+                     for s in range(0, len(boxes), node_size)]
+            if len(nodes) > 1:
+                nodes = [nodes[i] for i in _str_order([n[0] for n in nodes], node_size)]
+            self.levels.append(nodes)
+            if len(nodes) == 1:
+                break
+            boxes = [n[0] for n in nodes]
+
+
+    def query_points(self, xs, ys):
+        """Return, for each point, the sorted list of envelope indices
+        that contain it.
+        """
+        results = [[] for x in xs]
+        if not self.levels:
+            return results
+        top = len(self.levels) - 1
+        stack = [(top, j, range(len(xs))) for j in range(len(self.levels[top]))]
+        while stack:
+            (level, j, points) = stack.pop()
+            (box, start, end) = self.levels[level][j]
+            (minx, miny, maxx, maxy) = box
+            inside = [p for p in points if minx <= xs[p] <= maxx and miny <= ys[p] <= maxy]
+            if not inside:
+                continue
+            if level > 0:
+                stack.extend((level-1, k, inside) for k in range(start, end))
+                continue
+            for k in range(start, end):
+                (minx, miny, maxx, maxy) = self.boxes[k]
+                for p in inside:
+                    if minx <= xs[p] <= maxx and miny <= ys[p] <= maxy:
+                        results[p].append(self.items[k])
+        for r in results:
+            r.sort()
+        return results
+
+
+def point_in_rings(x, y, rings):
+    """Return True if (x, y) is inside the rings, by the even-odd rule,
+    so holes and multi-part polygons work out.
+    """
+    inside = False
+    for ring in rings:
+        (x1, y1) = ring[-1]
+        for (x2, y2) in ring:
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+            (x1, y1) = (x2, y2)
+    return inside
+
+
+def _rings(geom):
+    """Return the list of [(x, y)] rings of a polygon or multipolygon."""
+    gtype = osgeo.ogr.GT_Flatten(geom.GetGeometryType())
+    if gtype == osgeo.ogr.wkbPolygon:
+        rings = [geom.GetGeometryRef(i).GetPoints() for i in range(geom.GetGeometryCount())]
+        return [[p[:2] for p in ring] for ring in rings if ring]
+    if gtype in (osgeo.ogr.wkbMultiPolygon, osgeo.ogr.wkbGeometryCollection):
+        rings = []
+        for i in range(geom.GetGeometryCount()):
+            rings.extend(_rings(geom.GetGeometryRef(i)))
+        return rings
+    return []
+
+
+def _datatype(field_type):
+    # The outputs make 'integer' fields 32 bits wide, so 64 bit ones
+    # (GEOIDs, parcel numbers) are copied as strings instead.
+    if field_type == osgeo.ogr.OFTInteger:
+        return 'integer'
+    if field_type == osgeo.ogr.OFTReal:
+        return 'real'
+    return 'string'
+
+
+def _value(val, datatype):
+    if val is not None and datatype == 'string':
+        return str(val)
+    return val
+
+
+def load_polygons(filename, fields, epsg_code):
+    """Read the first layer of an OGR data source into a SpatialJoin.
+
+    filename is the polygon data source
+    fields is a list of the polygon attributes to copy, or None for all
+    epsg_code is the EPSG code of the points; the polygons are
+      transformed to it
+    """
+    ds = osgeo.ogr.Open(filename)
+    if ds is None:
+        raise ValueError("Could not open the --join polygons '{f}'".format(f=filename))
+    layer = ds.GetLayer(0)
+    layer_def = layer.GetLayerDefn()
+    available = {}
+    for i in range(layer_def.GetFieldCount()):
+        field_def = layer_def.GetFieldDefn(i)
+        available[field_def.GetName()] = _datatype(field_def.GetType())
+    if fields is None:
+        fields = list(available)
+    for f in fields:
+        if f not in available:
+            msg = "The --join polygons '{fn}' have no field '{f}'".format(fn=filename, f=f)
+            raise ValueError(msg)
+        if _idpat.match(f) is None:
+            msg = "The --join field '{f}' is not a valid identifier; identifiers must start with a letter, and contain only letters, numbers and underscores.".format(f=f)
+            raise ValueError(msg)
+        if len(f) > 10:
+            logging.warning("The --join field '{f}' is longer than 10 characters. This is too long for a ESRI shapefile.".format(f=f))
+
+    transform = None
+    src = layer.GetSpatialRef()
+    if src is not None:
+        dest = osgeo.osr.SpatialReference()
+        dest.ImportFromEPSG(epsg_code)
+        for srs in (src, dest):
+            if hasattr(srs, 'SetAxisMappingStrategy'):
+                srs.SetAxisMappingStrategy(osgeo.osr.OAMS_TRADITIONAL_GIS_ORDER)
+        if not src.IsSame(dest):
+            transform = osgeo.osr.CoordinateTransformation(src, dest)
+
+    polygons = []
+    values = []
+    for feature in layer:
+        geom = feature.GetGeometryRef()
+        if geom is None:
+            continue
+        geom = geom.Clone()
+        if transform is not None:
+            geom.Transform(transform)
+        rings = _rings(geom)
+        if rings:
+            polygons.append(rings)
+            values.append(tuple(_value(feature.GetField(f), available[f]) for f in fields))
+    ds.Destroy()
+    logging.info("Loaded {n} polygons from {f} for the spatial join".format(n=len(polygons), f=filename))
+    return SpatialJoin(fields, {f: available[f] for f in fields}, polygons, values)
+
+
+class SpatialJoin(object):
+    """Polygons, and their attributes, for tagging points.
+
+    fields is the list of attribute names
+    datatypes is a {field: datatype} map, using the key file datatypes
+    polygons is a list of polygons, each a list of [(x, y)] rings
+    values is a list of attribute tuples, one per polygon
+    """
+    def __init__(self, fields, datatypes, polygons, values):
+        self.fields = fields
+        self.datatypes = datatypes
+        self.polygons = polygons
+        self.values = values
+        envelopes = []
+        for rings in polygons:
+            xs = [p[0] for ring in rings for p in ring]
+            ys = [p[1] for ring in rings for p in ring]
+            envelopes.append((min(xs), min(ys), max(xs), max(ys)))
+        self.tree = STRTree(envelopes)
+        self.str_widths = {f: max([len(str(v[j])) for v in values if v[j] is not None] or [0])
+                           for (j, f) in enumerate(fields) if datatypes[f] == 'string'}
+        self.stats = {'points': 0, 'tagged': 0, 'candidates': 0}
+        self._stats_lock = threading.Lock()
+
+
+    def lookup(self, xs, ys):
+        """Return, for each point, the attribute tuple of the first
+        polygon containing it, or None.
+        """
+        results = []
+        (tagged, tested) = (0, 0)
+        for (x, y, candidates) in zip(xs, ys, self.tree.query_points(xs, ys)):
+            tested += len(candidates)
+            found = None
+            for i in candidates:
+                if point_in_rings(x, y, self.polygons[i]):
+                    found = self.values[i]
+                    tagged += 1
+                    break
+            results.append(found)
+        # Conversions running in parallel may share the join.
+        with self._stats_lock:
+            self.stats['points'] += len(xs)
+            self.stats['tagged'] += tagged
+            self.stats['candidates'] += tested
+        return results
+
+
+    def tag_records(self, recs, record_type):
+        """Yield the records, with the join fields filled in, looking up
+        BATCH_SIZE points at a time.
+
+        record_type is the records' type, which has the join fields
+        """
+        positions = [record_type._index[f] for f in self.fields]
+        batch = []
+        for record in recs:
+            batch.append(record)
+            if len(batch) >= BATCH_SIZE:
+                for r in self._tag_batch(batch, record_type, positions):
+                    yield r
+                batch = []
+        for r in self._tag_batch(batch, record_type, positions):
+            yield r
+
+
+    def _tag_batch(self, batch, record_type, positions):
+        found = self.lookup([r[records.DLON] for r in batch], [r[records.DLAT] for r in batch])
+        for (record, values) in zip(batch, found):
+            if values is None:
+                yield record
+                continue
+            new = list(record)
+            for (pos, val) in zip(positions, values):
+                new[pos] = val
+            yield record_type._make(new)
+
+
+def report_stats(stats):
+    """Log and print a summary of the spatial join."""
+    points = stats['points']
+    line = "Spatial join tagged {tagged} of {points} points, testing {cand:.2f} candidate polygons per point.".format(
+        tagged=stats['tagged'], points=points, cand=stats['candidates']/float(points) if points else 0.0)
+    print(line)
+    logging.info(line)
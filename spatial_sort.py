@@ -0,0 +1,192 @@
+# Orders records along a Hilbert curve before they're written, so
+# features that are near each other on the map are near each other in
+# the output.
+#
+# In CSV row order, neighbouring features can be anywhere. Sorted, a
+# bbox query touches a few runs of the file instead of all of it, tiles
+# and row groups cover small areas, and a compressor finds more repeated
+# values close together.
+#
+# The Hilbert index of each point is worked out on a grid laid over the
+# extent of the data, which the check pass has already found. Records
+# are sorted in memory a run at a time; if there are more than fit, each
+# sorted run is spilled to a temporary file in compressed blocks, and
+# the runs are merged as they're read back. Records with the same index
+# keep their order in the data file.
+
+import os
+import sys
+import zlib
+import heapq
+import struct
+import marshal
+import logging
+import tempfile
+import operator
+
+import records
+
+
+# Bits per axis of the Hilbert grid.
+HILBERT_ORDER = 16
+
+# Default ceiling, in megabytes, on the records held in memory.
+DEFAULT_MEMORY_MB = 256
+
+# Records in each compressed block of a spilled run.
+BLOCK_RECORDS = 4096
+
+# Records sampled to estimate the size of a record in memory.
+SAMPLE_RECORDS = 1024
+
+# Used when there is no extent, for EPSG 4326 data.
+WORLD_EXTENT = [-180.0, -90.0, 180.0, 90.0]
+
+_block_header = struct.Struct('<I')
+
+
+def hilbert_index(x, y, order=HILBERT_ORDER):
+    """Return the distance along the Hilbert curve of the grid cell
+    (x, y), for integers 0 <= x, y < 2**order.
+    """
+    d = 0
+    s = 1 << (order - 1)
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            (x, y) = (y, x)
+        s >>= 1
+    return d
+
+
+def record_bytes(record):
+    """Estimate the memory taken by a record and its sort key."""
+    return sys.getsizeof(record) + 100 + sum(sys.getsizeof(v) for v in record)
+
+
+class HilbertKey(object):
+    """Works out the Hilbert index of records over a grid on extent,
+    [minx, miny, maxx, maxy]. Points outside extent go in the edge
+    cells.
+    """
+    def __init__(self, extent, order=HILBERT_ORDER):
+        (self.minx, self.miny, maxx, maxy) = extent
+        self.order = order
+        self.cells = (1 << order) - 1
+        self.xscale = self.cells / (maxx - self.minx) if maxx > self.minx else 0.0
+        self.yscale = self.cells / (maxy - self.miny) if maxy > self.miny else 0.0
+
+
+    def __call__(self, record):
+        cells = self.cells
+        x = min(max(int((record[records.DLON] - self.minx) * self.xscale), 0), cells)
+        y = min(max(int((record[records.DLAT] - self.miny) * self.yscale), 0), cells)
+        return hilbert_index(x, y, self.order)
+
+
+class _Run(object):
+    """A sorted run spilled to a file, read back a block at a time."""
+    def __init__(self, filename, items):
+        self.filename = filename
+        self.bytes = 0
+        with open(filename, 'wb') as fp:
+            for i in range(0, len(items), BLOCK_RECORDS):
+                data = zlib.compress(marshal.dumps(items[i:i+BLOCK_RECORDS]), 1)
+                fp.write(_block_header.pack(len(data)))
+                fp.write(data)
+                self.bytes += _block_header.size + len(data)
+
+
+    def __iter__(self):
+        with open(self.filename, 'rb') as fp:
+            while True:
+                header = fp.read(_block_header.size)
+                if not header:
+                    break
+                (size,) = _block_header.unpack(header)
+                for item in marshal.loads(zlib.decompress(fp.read(size))):
+                    yield item
+
+
+class SpatialSorter(object):
+    """Takes records with add_record, and passes them on to
+    add_record in Hilbert order when closed.
+
+    add_record is what to give the sorted records to
+    record_type is the records' namedtuple type, to rebuild spilled
+      records
+    extent is [minx, miny, maxx, maxy] of the records, or None for the
+      whole world in EPSG 4326
+    memory_mb is roughly the most memory the waiting records may take;
+      past it, sorted runs are spilled to temporary files
+    tmpdir is where to put the temporary files, or None for the system
+      default
+    """
+    def __init__(self, add_record, record_type, extent=None, memory_mb=DEFAULT_MEMORY_MB, tmpdir=None):
+        self.add_record_to = add_record
+        self.record_type = record_type
+        self.key = HilbertKey(extent if extent is not None else WORLD_EXTENT)
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.tmpdir = tmpdir
+        self._tmp = None
+        self._items = []
+        self._sample_bytes = 0
+        self.run_records = None
+        self.runs = []
+        self.stats = {'records': 0, 'runs': 0, 'spilled_bytes': 0}
+
+
+    def add_record(self, record):
+        self._items.append((self.key(record), tuple(record)))
+        if self.run_records is None:
+            self._sample_bytes += record_bytes(record)
+            if len(self._items) >= SAMPLE_RECORDS:
+                self.run_records = max(int(self.memory_bytes * len(self._items) / self._sample_bytes),
+                                       SAMPLE_RECORDS)
+        elif len(self._items) >= self.run_records:
+            self._spill()
+
+
+    def _spill(self):
+        if self._tmp is None:
+            self._tmp = tempfile.TemporaryDirectory(prefix='csvtogeo_sort', dir=self.tmpdir)
+        self._items.sort(key=operator.itemgetter(0))
+        run = _Run(os.path.join(self._tmp.name, 'run{n}'.format(n=len(self.runs))), self._items)
+        self.runs.append(run)
+        self.stats['spilled_bytes'] += run.bytes
+        self._items = []
+
+
+    def close(self):
+        """Pass the records on in order, remove the temporary files, and
+        return a dictionary of stats.
+        """
+        try:
+            self._items.sort(key=operator.itemgetter(0))
+            if self.runs:
+                items = heapq.merge(*(self.runs + [self._items]), key=operator.itemgetter(0))
+            else:
+                items = self._items
+            make = self.record_type._make
+            add_record = self.add_record_to
+            for (key, values) in items:
+                add_record(make(values))
+                self.stats['records'] += 1
+            self.stats['runs'] = len(self.runs) + (1 if self._items else 0)
+        finally:
+            self._items = []
+            if self._tmp is not None:
+                self._tmp.cleanup()
+                self._tmp = None
+        return self.stats
+
+
+def report_stats(stats):
+    """Log a summary of the sort."""
+    logging.info("Sorted {n} records along a Hilbert curve in {runs} runs, spilling {b} bytes to temporary files.".format(
+        n=stats['records'], runs=stats['runs'], b=stats['spilled_bytes']))
@@ -0,0 +1,159 @@
+# Dictionary encoding for string columns in buffered records.
+#
+# Columns like a service type or city repeat a handful of values over
+# many rows, but parsing makes a new string object for every cell.
+# When records are held in memory (vector tiles keep every point,
+# partitioning queues up batches), that adds up. A RecordEncoder keeps
+# one copy of each distinct value of a string column, and a RecordBatch
+# stores the column as an array of integer codes into it.
+#
+# A column is only dictionary encoded while its distinct-value count
+# stays low. Once it has too many distinct values for codes to pay
+# off, it is switched to plain storage for the rest of the run.
+
+import sys
+import array
+import logging
+
+
+# Most distinct values a column may have and stay dictionary encoded.
+MAX_DISTINCT = 65536
+
+# After MIN_ROWS rows, a column must also have no more than this
+# fraction of distinct values to stay dictionary encoded.
+MAX_DISTINCT_FRACTION = 0.5
+MIN_ROWS = 1000
+
+CODE_TYPE = 'I'
+
+
+class ColumnDictionary(object):
+    """The distinct values of one string column, and their codes.
+    Code 0 is always None.
+    """
+    def __init__(self):
+        self.codes = {None: 0}
+        self.values = [None]
+        self.active = True
+        self.rows = 0
+
+
+    def encode(self, val):
+        """Return the code for val, or None if the column has been
+        switched to plain storage.
+        """
+        self.rows += 1
+        code = self.codes.get(val)
+        if code is None:
+            if not self.active:
+                return None
+            code = len(self.values)
+            self.codes[val] = code
+            self.values.append(val)
+            if code >= MAX_DISTINCT or (self.rows >= MIN_ROWS and
+                                        len(self.values) > MAX_DISTINCT_FRACTION*self.rows):
+                self.active = False
+                return None
+        return code
+
+
+class RecordEncoder(object):
+    """Shared dictionaries for the string columns of buffered records.
+
+    keys is the list of names, in the order of the value tuples
+    datatypes is a {name: datatype} map, using the key file datatypes
+    """
+    def __init__(self, keys, datatypes):
+        self.keys = list(keys)
+        self.dictionaries = [ColumnDictionary() if datatypes.get(k) == 'string' else None
+                             for k in self.keys]
+        self.cells = 0
+        self.plain_bytes = 0
+
+
+    def new_batch(self):
+        return RecordBatch(self)
+
+
+    def stats(self):
+        """Return a dictionary with estimates of the memory used by the
+        encoded string cells, and by the same cells as plain strings.
+        """
+        encoded_bytes = 0
+        columns = {}
+        for (k, d) in zip(self.keys, self.dictionaries):
+            if d is None:
+                continue
+            columns[k] = {'distinct': len(d.values) - 1, 'encoded': d.active}
+            encoded_bytes += sum(sys.getsizeof(v) for v in d.values[1:])
+        encoded_bytes += self.cells * array.array(CODE_TYPE).itemsize
+        return {'columns': columns, 'cells': self.cells,
+                'plain_bytes': self.plain_bytes, 'encoded_bytes': encoded_bytes}
+
+
+class RecordBatch(object):
+    """Buffers value tuples column by column, with dictionary-encoded
+    string columns stored as arrays of codes.
+    """
+    def __init__(self, encoder):
+        self.encoder = encoder
+        self.columns = [array.array(CODE_TYPE) if d is not None and d.active else []
+                        for d in encoder.dictionaries]
+        self.length = 0
+
+
+    def __len__(self):
+        return self.length
+
+
+    def append(self, values):
+        encoder = self.encoder
+        for (j, val) in enumerate(values):
+            column = self.columns[j]
+            d = encoder.dictionaries[j]
+            if d is None or not isinstance(column, array.array):
+                column.append(val)
+                continue
+            code = d.encode(val)
+            if code is None:
+                # Too many distinct values; switch this column to plain.
+                column = self._plain_column(j)
+                column.append(val)
+                continue
+            column.append(code)
+            if val is not None:
+                encoder.cells += 1
+                encoder.plain_bytes += sys.getsizeof(val) + 8 # the string, and a pointer to it
+        self.length += 1
+
+
+    def _plain_column(self, j):
+        values = self.encoder.dictionaries[j].values
+        self.columns[j] = [values[code] for code in self.columns[j]]
+        return self.columns[j]
+
+
+    def row(self, i):
+        """Return the i'th value tuple."""
+        retval = []
+        for (j, column) in enumerate(self.columns):
+            if isinstance(column, array.array):
+                retval.append(self.encoder.dictionaries[j].values[column[i]])
+            else:
+                retval.append(column[i])
+        return tuple(retval)
+
+
+    def rows(self):
+        for i in range(self.length):
+            yield self.row(i)
+
+
+def report_stats(stats):
+    """Log and print a summary of the dictionary encoding savings."""
+    encoded = sorted(k for (k, c) in stats['columns'].items() if c['encoded'])
+    line = "Dictionary encoded {n} string columns ({cols}): about {eb} bytes for {cells} buffered cells, versus {pb} bytes as plain strings.".format(
+        n=len(encoded), cols=', '.join(encoded), eb=stats['encoded_bytes'],
+        cells=stats['cells'], pb=stats['plain_bytes'])
+    print(line)
+    logging.info(line)
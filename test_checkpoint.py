@@ -0,0 +1,104 @@
+import os
+import json
+import argparse
+import unittest
+import tempfile
+
+import records
+import checkpoint
+import geojson_writer
+
+
+IDS = {'city': {'datatype': 'string'},
+       'dlat': {'datatype': 'real'},
+       'dlon': {'datatype': 'real'}}
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'data.checkpoint.json')
+        keyfile = os.path.join(self.tmp.name, 'data.key.csv')
+        with open(keyfile, 'w') as fp:
+            fp.write('key\n')
+        options = {o: None for o in checkpoint.OPTIONS}
+        options['outext'] = '.gpkg'
+        self.args = argparse.Namespace(datafile=[os.path.join(self.tmp.name, 'data.csv')],
+                                       keyfile=keyfile, **options)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_resume(self):
+        ckpt = checkpoint.Checkpoint(self.filename, self.args, 10)
+        self.assertFalse(ckpt.resuming('check'))
+        self.assertIsNone(ckpt.position())
+        ckpt.save('check', {'offset': 100, 'line_num': 7, 'sha1': 'abc'}, row_count=6)
+
+        ckpt = checkpoint.Checkpoint(self.filename, self.args, 10, resume=True)
+        self.assertTrue(ckpt.resuming('check'))
+        self.assertFalse(ckpt.resuming('write'))
+        self.assertEqual(ckpt.position()['offset'], 100)
+        self.assertEqual(ckpt.state['row_count'], 6)
+        ckpt.remove()
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_no_checkpoint(self):
+        ckpt = checkpoint.Checkpoint(self.filename, self.args, 10, resume=True)
+        self.assertIsNone(ckpt.state)
+        self.assertIsNone(ckpt.position())
+
+    def test_fresh_run_removes(self):
+        checkpoint.Checkpoint(self.filename, self.args, 10).save('write', None)
+        ckpt = checkpoint.Checkpoint(self.filename, self.args, 10)
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertIsNone(ckpt.state)
+
+    def test_mismatch(self):
+        checkpoint.Checkpoint(self.filename, self.args, 10).save('write', None)
+        self.args.precision = 3
+        with self.assertRaises(ValueError):
+            checkpoint.Checkpoint(self.filename, self.args, 10, resume=True)
+        self.args.precision = None
+        with open(self.args.keyfile, 'a') as fp:
+            fp.write('changed\n')
+        with self.assertRaises(ValueError):
+            checkpoint.Checkpoint(self.filename, self.args, 10, resume=True)
+
+
+class TestGeoJSONSeqWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'sites.geojsonl')
+        Record = records.record_type(IDS)
+        self.recs = [Record._make([37.0 + i/100.0, -122.0, 'City {n}'.format(n=i)]) for i in range(6)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def read_helper(self):
+        with open(self.filename, encoding='utf-8') as fp:
+            return [json.loads(line) for line in fp]
+
+    def test_resume(self):
+        w = geojson_writer.GeoJSONSeqWriter(self.filename, IDS, 4326)
+        for r in self.recs[:2]:
+            w.add_record(r)
+        committed = w.commit()
+        w.add_record(self.recs[2]) # written after the commit, so dropped
+        w.close()
+
+        w = geojson_writer.GeoJSONSeqWriter(self.filename, IDS, 4326, resume=committed)
+        for r in self.recs[2:]:
+            w.add_record(r)
+        stats = w.close()
+        self.assertEqual(stats['features'], 6)
+        self.assertEqual(stats['bytes'], os.path.getsize(self.filename))
+
+        features = self.read_helper()
+        self.assertEqual([f['properties']['city'] for f in features], [r.city for r in self.recs])
+        self.assertEqual(features[0]['geometry'], {'type': 'Point', 'coordinates': [-122.0, 37.0]})
+
+
+if __name__ == '__main__':
+    unittest.main()
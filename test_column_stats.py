@@ -0,0 +1,132 @@
+import os
+import json
+import unittest
+import tempfile
+
+import records
+import column_stats
+
+
+IDS = {'city': {'datatype': 'string'},
+       'dlat': {'datatype': 'real'},
+       'units': {'datatype': 'integer'},
+       'dlon': {'datatype': 'real'}}
+
+
+class TestDistinctCounter(unittest.TestCase):
+    def test_exact(self):
+        dc = column_stats.DistinctCounter()
+        for v in ['a', 'b', 'a', 'c', 'b']:
+            dc.add(v)
+        self.assertEqual(dc.count(), 3)
+        self.assertTrue(dc.exact_count())
+
+    def test_estimate(self):
+        dc = column_stats.DistinctCounter()
+        n = 50000
+        for i in range(n):
+            dc.add('value {i}'.format(i=i))
+            dc.add('value {i}'.format(i=i // 2))
+        self.assertFalse(dc.exact_count())
+        # About 1.6% standard error; allow four of them.
+        self.assertLess(abs(dc.count() - n) / float(n), 0.065)
+
+    def test_merge(self):
+        (a, b) = (column_stats.DistinctCounter(), column_stats.DistinctCounter())
+        for i in range(3000):
+            a.add(i)
+        for i in range(2000, 5000):
+            b.add(i)
+        a.merge(b)
+        self.assertLess(abs(a.count() - 5000) / 5000.0, 0.065)
+
+        (a, b) = (column_stats.DistinctCounter(), column_stats.DistinctCounter())
+        a.add('x')
+        b.add('x')
+        b.add('y')
+        a.merge(b)
+        self.assertEqual(a.count(), 2)
+        self.assertTrue(a.exact_count())
+
+    def test_state(self):
+        for n in [10, 5000]:
+            dc = column_stats.DistinctCounter()
+            for i in range(n):
+                dc.add('value {i}'.format(i=i))
+            restored = column_stats.DistinctCounter.from_state(json.loads(json.dumps(dc.state())))
+            self.assertEqual(restored.count(), dc.count())
+            restored.add('value 0')
+            restored.add('one more')
+            dc.add('one more')
+            self.assertEqual(restored.count(), dc.count())
+
+
+class TestLayerStats(unittest.TestCase):
+    def setUp(self):
+        Record = records.record_type(IDS)
+        self.recs = [Record._make(r) for r in [
+            [37.5, -122.25, 'Oakland', 3],
+            [37.75, -122.5, 'San Francisco', None],
+            [37.25, -122.0, None, 7],
+            [37.0, -122.75, 'Oakland', -1]]]
+
+    def test_stats(self):
+        stats = column_stats.LayerStats(IDS)
+        for r in self.recs:
+            stats.add(r)
+        out = stats.as_dict()
+        self.assertEqual(out['rows'], 4)
+        self.assertEqual(out['extent'], [-122.75, 37.0, -122.0, 37.75])
+        self.assertEqual(out['columns']['units'],
+                         {'datatype': 'integer', 'count': 3, 'nulls': 1, 'min': -1, 'max': 7})
+        self.assertEqual(out['columns']['city'],
+                         {'datatype': 'string', 'count': 3, 'nulls': 1,
+                          'distinct': 2, 'distinct_exact': True})
+        self.assertEqual(out['columns']['dlat']['min'], 37.0)
+
+    def test_columns(self):
+        stats = column_stats.LayerStats(IDS, ['units'])
+        stats.add(self.recs[0])
+        self.assertEqual(list(stats.as_dict()['columns']), ['units'])
+
+    def test_empty(self):
+        out = column_stats.LayerStats(IDS).as_dict()
+        self.assertEqual(out['rows'], 0)
+        self.assertIsNone(out['extent'])
+        self.assertIsNone(out['columns']['units']['min'])
+
+    def test_write(self):
+        stats = column_stats.LayerStats(IDS)
+        for r in self.recs:
+            stats.add(r)
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'layer.stats.json')
+            stats.write(filename, source='layer.csv')
+            with open(filename, encoding='utf-8') as fp:
+                out = json.load(fp)
+        self.assertEqual(out['source'], 'layer.csv')
+        self.assertEqual(out['columns']['city']['distinct'], 2)
+
+    def test_merge(self):
+        (a, b, whole) = (column_stats.LayerStats(IDS), column_stats.LayerStats(IDS), column_stats.LayerStats(IDS))
+        for (i, r) in enumerate(self.recs):
+            (a if i % 2 else b).add(r)
+            whole.add(r)
+        a.merge(b)
+        a.merge(column_stats.LayerStats(IDS))
+        self.assertEqual(a.as_dict(), whole.as_dict())
+
+    def test_restore(self):
+        stats = column_stats.LayerStats(IDS)
+        for r in self.recs[:2]:
+            stats.add(r)
+        restored = column_stats.LayerStats(IDS)
+        restored.restore(json.loads(json.dumps(stats.state())))
+        for r in self.recs[2:]:
+            stats.add(r)
+            restored.add(r)
+        self.assertEqual(restored.as_dict(), stats.as_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import unittest
+
+import compare
+import geoparquet_writer
+
+
+class TestMultisetHash(unittest.TestCase):
+    def hash_helper(self, features):
+        mh = compare.MultisetHash()
+        for (props, x, y) in features:
+            mh.add(props, x, y)
+        return (mh.count, mh.hexdigest())
+
+    def test_order(self):
+        features = [({'a': 1}, 1.0, 2.0), ({'a': 2}, 3.0, 4.0), ({'a': 3}, 5.0, 6.0)]
+        self.assertEqual(self.hash_helper(features), self.hash_helper(features[::-1]))
+
+    def test_duplicates(self):
+        (a, b) = (({'a': 1}, 1.0, 2.0), ({'a': 2}, 3.0, 4.0))
+        self.assertNotEqual(self.hash_helper([a, a, b])[1], self.hash_helper([b])[1])
+        self.assertNotEqual(self.hash_helper([a, a, b])[1], self.hash_helper([a, b, b])[1])
+
+    def test_normalized(self):
+        # Printed digits, padding and dropped nulls don't matter...
+        self.assertEqual(self.hash_helper([({'a': 0.1 + 0.2, 'b': 'x ', 'c': None}, -122.1, 37.5)]),
+                         self.hash_helper([({'a': 0.3, 'b': 'x'}, -122.1000000000001, 37.5)]))
+        # ...but values do.
+        self.assertNotEqual(self.hash_helper([({'a': 1}, -122.1, 37.5)]),
+                            self.hash_helper([({'a': 2}, -122.1, 37.5)]))
+
+
+class TestCompare(unittest.TestCase):
+    def test_results(self):
+        modes = [('one', [], '.geojson', None), ('two', [], '.geojson', 'one'), ('three', [], '.shp', 'one')]
+        results = [{'example': 'e', 'copies': 1, 'mode': m, 'features': 5, 'hash': h, 'error': None}
+                   for (m, h) in [('one', 'aa'), ('two', 'aa'), ('three', 'bb')]]
+        compare.compare_results(results, modes)
+        self.assertEqual([r['equivalent'] for r in results], ['baseline', 'same', 'DIFFERENT'])
+
+        results[0]['error'] = 'RuntimeError: no GDAL'
+        compare.compare_results(results, modes)
+        self.assertEqual([r['equivalent'] for r in results], ['failed', 'no one', 'no one'])
+        compare.compare_results(results, modes, baseline_mode='two')
+        self.assertEqual([r['equivalent'] for r in results], ['failed', 'baseline', 'DIFFERENT'])
+
+    @unittest.skipIf(geoparquet_writer.pyarrow is None, "needs the 'pyarrow' package")
+    def test_example(self):
+        keyfile = os.path.join(os.path.dirname(compare.__file__), 'examples', 'Solid_Waste_Centers.key.csv')
+        modes = [m for m in compare.MODES if m[0] in ['geojsonl', 'spatial-sort', 'parquet']]
+        results = [compare.run_case({'example': 'Solid_Waste_Centers', 'keyfile': keyfile,
+                                     'datafile': keyfile.replace('.key.csv', '.csv'),
+                                     'copies': 1, 'rows': 40, 'mode': m})
+                   for m in modes]
+        compare.compare_results(results, modes, baseline_mode='geojsonl')
+        self.assertEqual([r['error'] for r in results], [None]*3)
+        self.assertEqual([r['equivalent'] for r in results], ['baseline', 'same', 'same'])
+        self.assertEqual(results[0]['features'], 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
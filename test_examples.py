@@ -2,6 +2,10 @@ import unittest
 import os
 import shutil
 import hashlib
+import gzip
+import sqlite3
+import csv
+import json
 
 import osgeo.ogr
 
@@ -148,6 +152,280 @@ class TestSolidWasteGeoJSON(unittest.TestCase):
         # compare_layer_defs_helper(self, self.dsfile)
         check_features_helper(self, self.dsfile)
             
-        
+
+
+class TestSolidWasteCompactGeoJSON(unittest.TestCase):
+    def setUp(self):
+        self.keyfile = "Solid_Waste_Centers.key.csv"
+        self.datafile = self.keyfile.replace('.key.csv', '.csv')
+        self.dsfile = self.keyfile.replace('.key.csv', '.geojson')
+        self.outfiles = [self.keyfile.replace('.key.csv', pat) for pat in ['.geojson', '.geojson.gz']]
+
+        copy_helper(self.keyfile)
+        copy_helper(self.datafile)
+        for o in self.outfiles:
+            remove_helper(o)
+
+    def test(self):
+        keyfile = os.path.join(TEST_DIR, self.keyfile)
+        datafile = os.path.join(TEST_DIR, self.datafile)
+        CSVToGeo.main(['--keyfile', keyfile, '--datafile', datafile,
+                       '--compact', '--dropnulls', '--precision', '6', '--compress', 'gzip'])
+
+        check_features_helper(self, self.dsfile)
+
+        dest = os.path.join(TEST_DIR, self.dsfile)
+        with gzip.open(dest+'.gz', 'rb') as fp:
+            compressed = fp.read()
+        with open(dest, 'rb') as fp:
+            self.assertEqual(compressed, fp.read())
+
+
+class TestSolidWasteFiltered(unittest.TestCase):
+    def setUp(self):
+        self.keyfile = "Solid_Waste_Centers.key.csv"
+        self.datafile = self.keyfile.replace('.key.csv', '.csv')
+        self.dsfile = self.keyfile.replace('.key.csv', '.geojson')
+        self.statsfile = self.keyfile.replace('.key.csv', '.stats.json')
+
+        copy_helper(self.keyfile)
+        copy_helper(self.datafile)
+        remove_helper(self.dsfile)
+        remove_helper(self.statsfile)
+
+    def test(self):
+        keyfile = os.path.join(TEST_DIR, self.keyfile)
+        datafile = os.path.join(TEST_DIR, self.datafile)
+        CSVToGeo.main(['--keyfile', keyfile, '--datafile', datafile, '--compact',
+                       '--where', 'city=Redwood City', '--bbox=-122.5,37.0,-122.0,37.5', '--stats'])
+
+        with open(os.path.join(TEST_DIR, self.dsfile), encoding='utf-8') as fp:
+            collection = json.load(fp)
+        features = collection['features']
+        self.assertGreater(len(features), 0)
+        self.assertLess(len(features), 8)
+        for f in features:
+            self.assertEqual(f['properties']['city'], 'Redwood City')
+            (x, y) = f['geometry']['coordinates']
+            self.assertTrue(-122.5 <= x <= -122.0 and 37.0 <= y <= 37.5)
+        xs = [f['geometry']['coordinates'][0] for f in features]
+        ys = [f['geometry']['coordinates'][1] for f in features]
+        self.assertEqual(collection['bbox'], [min(xs), min(ys), max(xs), max(ys)])
+
+        # The sidecar stats cover just the rows that were written.
+        with open(os.path.join(TEST_DIR, self.statsfile), encoding='utf-8') as fp:
+            stats = json.load(fp)
+        self.assertEqual(stats['rows'], len(features))
+        self.assertEqual(stats['extent'], collection['bbox'])
+        self.assertEqual(stats['columns']['city']['distinct'], 1)
+        self.assertEqual(stats['columns']['city']['nulls'], 0)
+
+
+class TestSolidWasteShards(unittest.TestCase):
+    def setUp(self):
+        self.keyfile = "Solid_Waste_Centers.key.csv"
+        self.datafile = self.keyfile.replace('.key.csv', '.csv')
+        self.shards = ['Solid_Waste_Centers.part{n}.csv'.format(n=n) for n in range(3)]
+        self.outfiles = ['Solid_Waste_Centers.geojsonl', 'All_Sites.geojsonl', 'All_Sites.stats.json']
+
+        copy_helper(self.keyfile)
+        copy_helper(self.datafile)
+        for o in self.outfiles:
+            remove_helper(o)
+
+        # Deal the rows out to the shards in turn.
+        with open(os.path.join(TEST_DIR, self.datafile), encoding='utf-8', newline='') as fp:
+            reader = csv.reader(fp)
+            header = next(reader)
+            rows = list(reader)
+        for (n, shard) in enumerate(self.shards):
+            with open(os.path.join(TEST_DIR, shard), 'w', encoding='utf-8', newline='') as fp:
+                writer = csv.writer(fp)
+                writer.writerow(header)
+                writer.writerows(rows[n::len(self.shards)])
+
+    def tearDown(self):
+        for shard in self.shards:
+            remove_helper(shard)
+
+    def read_helper(self, filename):
+        with open(os.path.join(TEST_DIR, filename), encoding='utf-8') as fp:
+            return sorted(fp)
+
+    def test(self):
+        keyfile = os.path.join(TEST_DIR, self.keyfile)
+        CSVToGeo.main(['--keyfile', keyfile, '--datafile', os.path.join(TEST_DIR, self.datafile),
+                       '--outext', '.geojsonl'])
+        CSVToGeo.main(['--keyfile', keyfile, '--outext', '.geojsonl',
+                       '--datafile', os.path.join(TEST_DIR, 'Solid_Waste_Centers.part*.csv'),
+                       '--outname', os.path.join(TEST_DIR, 'All_Sites.csv'), '--stats'])
+        self.assertEqual(self.read_helper('All_Sites.geojsonl'), self.read_helper('Solid_Waste_Centers.geojsonl'))
+        with open(os.path.join(TEST_DIR, 'All_Sites.stats.json'), encoding='utf-8') as fp:
+            stats = json.load(fp)
+        self.assertEqual(stats['rows'], len(self.read_helper('All_Sites.geojsonl')))
+        self.assertEqual(stats['source'], ', '.join(self.shards))
+
+    def test_line_numbers(self):
+        # Errors name the shard, and the line within it.
+        with open(os.path.join(TEST_DIR, self.shards[1]), 'a', encoding='utf-8') as fp:
+            fp.write('x,notanumber,Bad Site,,,,,,,,,,1,1,"(37.5, -122.3)"\n')
+        with open(os.path.join(TEST_DIR, self.shards[1]), encoding='utf-8') as fp:
+            lines = len(fp.read().splitlines())
+        with self.assertRaises(ValueError) as cm:
+            CSVToGeo.main(['--keyfile', os.path.join(TEST_DIR, self.keyfile), '--outext', '.geojsonl',
+                           '--datafile'] + [os.path.join(TEST_DIR, s) for s in self.shards] +
+                          ['--outname', os.path.join(TEST_DIR, 'All_Sites.csv')])
+        self.assertIn(self.shards[1], str(cm.exception))
+        self.assertIn('CSV row {n} '.format(n=lines), str(cm.exception))
+
+
+class TestSolidWasteSpatialJoin(unittest.TestCase):
+    def setUp(self):
+        self.keyfile = "Solid_Waste_Centers.key.csv"
+        self.datafile = self.keyfile.replace('.key.csv', '.csv')
+        self.dsfile = self.keyfile.replace('.key.csv', '.geojson')
+        self.polyfile = os.path.join(TEST_DIR, 'halves.geojson')
+
+        copy_helper(self.keyfile)
+        copy_helper(self.datafile)
+        remove_helper(self.dsfile)
+        # Split the county into north and south halves at 37.5.
+        halves = []
+        for (name, ymin, ymax) in [('north', 37.5, 38.0), ('south', 37.0, 37.5)]:
+            ring = [[-123.0, ymin], [-122.0, ymin], [-122.0, ymax], [-123.0, ymax], [-123.0, ymin]]
+            halves.append({'type': 'Feature', 'properties': {'half': name},
+                           'geometry': {'type': 'Polygon', 'coordinates': [ring]}})
+        with open(self.polyfile, 'w', encoding='utf-8') as fp:
+            json.dump({'type': 'FeatureCollection', 'features': halves}, fp)
+
+    def tearDown(self):
+        os.remove(self.polyfile)
+
+    def test(self):
+        keyfile = os.path.join(TEST_DIR, self.keyfile)
+        datafile = os.path.join(TEST_DIR, self.datafile)
+        CSVToGeo.main(['--keyfile', keyfile, '--datafile', datafile, '--compact',
+                       '--join', self.polyfile, '--join-fields', 'half'])
+
+        with open(os.path.join(TEST_DIR, self.dsfile), encoding='utf-8') as fp:
+            features = json.load(fp)['features']
+        self.assertEqual(len(features), 40)
+        for f in features:
+            (x, y) = f['geometry']['coordinates']
+            self.assertEqual(f['properties']['half'], 'north' if y > 37.5 else 'south')
+
+
+class TestSolidWasteMBTiles(unittest.TestCase):
+    def setUp(self):
+        self.keyfile = "Solid_Waste_Centers.key.csv"
+        self.datafile = self.keyfile.replace('.key.csv', '.csv')
+        self.dsfile = self.keyfile.replace('.key.csv', '.mbtiles')
+
+        copy_helper(self.keyfile)
+        copy_helper(self.datafile)
+        remove_helper(self.dsfile)
+
+    def test(self):
+        keyfile = os.path.join(TEST_DIR, self.keyfile)
+        datafile = os.path.join(TEST_DIR, self.datafile)
+        CSVToGeo.main(['--keyfile', keyfile, '--datafile', datafile,
+                       '--outext', '.mbtiles', '--maxzoom', '10'])
+
+        conn = sqlite3.connect(os.path.join(TEST_DIR, self.dsfile))
+        try:
+            zooms = dict(conn.execute('SELECT zoom_level, count(*) FROM tiles GROUP BY zoom_level').fetchall())
+            metadata = dict(conn.execute('SELECT name, value FROM metadata').fetchall())
+        finally:
+            conn.close()
+        self.assertEqual(sorted(zooms), list(range(11)))
+        self.assertEqual(zooms[0], 1)
+        self.assertEqual(metadata['format'], 'pbf')
+
+
+class TestSolidWasteNativeShapefile(unittest.TestCase):
+    def setUp(self):
+        self.keyfile = "Solid_Waste_Centers.key.csv"
+        self.datafile = self.keyfile.replace('.key.csv', '.csv')
+        self.dsfile = self.keyfile.replace('.key.csv', '.shp')
+        self.outfiles = [self.keyfile.replace('.key.csv', pat) for pat in ['.shp', '.shx', '.dbf', '.prj', '.cpg']]
+
+        copy_helper(self.keyfile)
+        copy_helper(self.datafile)
+        for o in self.outfiles:
+            remove_helper(o)
+
+    def test(self):
+        keyfile = os.path.join(TEST_DIR, self.keyfile)
+        datafile = os.path.join(TEST_DIR, self.datafile)
+        CSVToGeo.main(['--keyfile', keyfile, '--datafile', datafile,
+                       '--outext', '.shp', '--writer', 'native'])
+
+        # Read the native writer's output back through OGR.
+        check_features_helper(self, self.dsfile)
+
+        ds = osgeo.ogr.Open(os.path.join(TEST_DIR, self.dsfile))
+        try:
+            layer0 = ds.GetLayer(0)
+            self.assertEqual(layer0.GetFeatureCount(), 40)
+            self.assertEqual(layer0.GetGeomType(), osgeo.ogr.wkbPoint)
+            self.assertEqual(layer0.GetSpatialRef().GetAuthorityCode(None), '4326')
+        finally:
+            ds.Destroy()
+
+
+class TestSolidWasteMultipleOutputs(unittest.TestCase):
+    def setUp(self):
+        self.keyfile = "Solid_Waste_Centers.key.csv"
+        self.datafile = self.keyfile.replace('.key.csv', '.csv')
+        self.outfiles = [self.keyfile.replace('.key.csv', pat) for pat in ['.geojson', '.shp', '.shx', '.dbf', '.prj', '.cpg', '.gpkg']]
+
+        copy_helper(self.keyfile)
+        copy_helper(self.datafile)
+        for o in self.outfiles:
+            remove_helper(o)
+
+    def test(self):
+        keyfile = os.path.join(TEST_DIR, self.keyfile)
+        datafile = os.path.join(TEST_DIR, self.datafile)
+        CSVToGeo.main(['--keyfile', keyfile, '--datafile', datafile,
+                       '--outext', '.geojson,.shp,.gpkg'])
+
+        check_features_helper(self, self.keyfile.replace('.key.csv', '.geojson'))
+        check_features_helper(self, self.keyfile.replace('.key.csv', '.shp'))
+        gpkg = self.keyfile.replace('.key.csv', '.gpkg')
+        check_features_helper(self, gpkg, os.path.join(EXAMPLES_DIR, self.keyfile.replace('.key.csv', '.geojson')))
+
+
+class TestFirePolicePartitioned(unittest.TestCase):
+    def setUp(self):
+        self.keyfile = "Fire__Police__and_Sheriff_Locations_Map.key.csv"
+        self.datafile = self.keyfile.replace('.key.csv', '.csv')
+        self.indexfile = self.keyfile.replace('.key.csv', '.partitions.csv')
+
+        copy_helper(self.keyfile)
+        copy_helper(self.datafile)
+        remove_helper(self.indexfile)
+
+    def test(self):
+        keyfile = os.path.join(TEST_DIR, self.keyfile)
+        datafile = os.path.join(TEST_DIR, self.datafile)
+        CSVToGeo.main(['--keyfile', keyfile, '--datafile', datafile,
+                       '--partition-by', 'service', '--maxopen', '2'])
+
+        with open(os.path.join(TEST_DIR, self.indexfile), newline='') as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertTrue(len(rows) > 1)
+
+        example = extract_layer0_features_helper(os.path.join(EXAMPLES_DIR, self.keyfile.replace('.key.csv', '.geojson')))
+        partitioned = {}
+        for row in rows:
+            features = extract_layer0_features_helper(os.path.join(TEST_DIR, row['filename']))
+            self.assertEqual(len(features), int(row['count']))
+            for props in features.values():
+                self.assertEqual(str(props['service']) if props['service'] else 'null', row['partition'])
+            partitioned.update(features)
+        self.assertEqual(set(partitioned), set(example))
+
+
 if __name__ == '__main__':
     unittest.main()
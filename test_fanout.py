@@ -0,0 +1,97 @@
+import os
+import unittest
+import tempfile
+
+import fanout
+import records
+import geojson_writer
+
+
+class ListWriter(object):
+    """Stands in for an output writer, keeping records in memory."""
+    def __init__(self, fail_at=None):
+        self.records = []
+        self.closed = False
+        self.aborted = False
+        self.fail_at = fail_at
+
+    def add_record(self, record):
+        if len(self.records) == self.fail_at:
+            raise RuntimeError("disk full")
+        self.records.append(record)
+
+    def close(self):
+        self.closed = True
+        return len(self.records)
+
+    def abort(self):
+        self.aborted = True
+
+
+class TestFanOutWriter(unittest.TestCase):
+    def test_all_writers_get_every_record(self):
+        writers = [ListWriter(), ListWriter(), ListWriter()]
+        writer = fanout.FanOutWriter(writers)
+        records = [(float(i), float(-i), 'Fire') for i in range(5000)]
+        for r in records:
+            writer.add_record(r)
+        self.assertEqual(writer.close(), [5000, 5000, 5000])
+        for w in writers:
+            self.assertTrue(w.closed)
+            self.assertEqual(w.records, records)
+
+    def test_error(self):
+        writers = [ListWriter(), ListWriter(fail_at=10), ListWriter()]
+        writer = fanout.FanOutWriter(writers)
+        try:
+            with self.assertRaises(RuntimeError):
+                for i in range(100000):
+                    writer.add_record((0.0, 0.0, i))
+                writer.close()
+        finally:
+            writer.abort()
+        for w in writers:
+            self.assertFalse(w.closed)
+            self.assertTrue(w.aborted)
+        self.assertFalse(any(t.is_alive() for t in writer._threads))
+
+    def test_error_at_close(self):
+        # The failure is only found once every record has been sent.
+        writers = [ListWriter(), ListWriter(fail_at=10)]
+        writer = fanout.FanOutWriter(writers)
+        for i in range(100):
+            writer.add_record((0.0, 0.0, i))
+        with self.assertRaises(RuntimeError):
+            writer.close()
+        for w in writers:
+            self.assertFalse(w.closed)
+            self.assertTrue(w.aborted)
+
+    def test_abort(self):
+        writers = [ListWriter(), ListWriter()]
+        writer = fanout.FanOutWriter(writers)
+        for i in range(1000):
+            writer.add_record((0.0, 0.0, i))
+        writer.abort()
+        for w in writers:
+            self.assertFalse(w.closed)
+            self.assertTrue(w.aborted)
+            self.assertEqual(len(w.records), fanout.BATCH_SIZE)
+        self.assertFalse(any(t.is_alive() for t in writer._threads))
+
+    def test_partial_output_removed(self):
+        ids = {'n': {'datatype': 'integer'}}
+        Record = records.record_type(ids)
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'out.geojson')
+            writer = fanout.FanOutWriter([geojson_writer.CompactGeoJSONWriter(filename, ids, 4326),
+                                          ListWriter(fail_at=10)])
+            with self.assertRaises(RuntimeError):
+                for i in range(100):
+                    writer.add_record(Record(37.0, -122.0, i))
+                writer.close()
+            self.assertFalse(os.path.exists(filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+import os
+import shutil
+import tempfile
+
+import fast_reader
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(fast_reader.__file__), "examples")
+
+
+def read_helper(engine, filename, encoding='utf-8', wanted=None):
+    with fast_reader.open_reader(filename, encoding, wanted, engine) as reader:
+        return (reader.header, list(reader))
+
+
+class TestMmapMatchesCSV(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def compare_helper(self, data, encoding='utf-8', wanted=None):
+        filename = os.path.join(self.dir, 'data.csv')
+        with open(filename, 'wb') as fp:
+            fp.write(data)
+        (csv_header, csv_rows) = read_helper('csv', filename, encoding)
+        (mmap_header, mmap_rows) = read_helper('mmap', filename, encoding, wanted)
+        self.assertEqual(csv_header, mmap_header)
+        if wanted is not None:
+            csv_rows = [({h: v for (h, v) in row.items() if h in wanted}, line_num)
+                        for (row, line_num) in csv_rows]
+        self.assertEqual(csv_rows, mmap_rows)
+        return mmap_rows
+
+    def test_simple(self):
+        self.compare_helper(b'a,b,c\n1,2,3\n4,5,6\n')
+
+    def test_no_trailing_newline(self):
+        self.compare_helper(b'a,b,c\n1,2,3\n4,5,6')
+
+    def test_crlf(self):
+        self.compare_helper(b'a,b,c\r\n1,2,3\r\n4,5,6\r\n')
+
+    def test_quoted_newlines(self):
+        rows = self.compare_helper(b'a,b\n"x\ny\nz",2\n"(1, 2)","say ""hi"""\n3,4\n')
+        self.assertEqual([line_num for (row, line_num) in rows], [4, 5, 6])
+
+    def test_empty_cells(self):
+        self.compare_helper(b'a,b,c\n,,\n"",x,\n')
+
+    def test_short_and_blank_rows(self):
+        self.compare_helper(b'a,b,c\n1\n\n4,5,6\n')
+
+    def test_bom_and_utf8(self):
+        self.compare_helper('﻿Name,City\nCafé,"San José"\n'.encode('utf-8'))
+
+    def test_latin1(self):
+        self.compare_helper('Name,City\nCafé,"San José"\n'.encode('latin1'), 'latin1')
+
+    def test_wanted(self):
+        rows = self.compare_helper(b'a,b,c\n1,"2,x",3\n', wanted=set(['b', 'c']))
+        self.assertEqual(rows[0][0], {'b': '2,x', 'c': '3'})
+
+    def test_example(self):
+        with open(os.path.join(EXAMPLES_DIR, 'Solid_Waste_Centers.csv'), 'rb') as fp:
+            self.compare_helper(fp.read())
+
+    def test_small_blocks(self):
+        # Make blocks end inside quoted cells and long records.
+        block_size = fast_reader.BLOCK_SIZE
+        try:
+            for size in [1, 7, 64, 500]:
+                fast_reader.BLOCK_SIZE = size
+                with open(os.path.join(EXAMPLES_DIR, 'Solid_Waste_Centers.csv'), 'rb') as fp:
+                    self.compare_helper(fp.read())
+                self.compare_helper(b'a,b\n1,2\n"x\ny",3\n4,5\r\n\n6,"7\n\n8"\n')
+        finally:
+            fast_reader.BLOCK_SIZE = block_size
+
+    def test_block_count(self):
+        filename = os.path.join(EXAMPLES_DIR, 'Solid_Waste_Centers.csv')
+        with fast_reader.MmapReader(filename, 'utf-8') as reader:
+            self.assertEqual(len(list(reader.blocks())), 1)
+        block_size = fast_reader.BLOCK_SIZE
+        try:
+            # Records here are a few hundred bytes, so every block but the
+            # last should be more than half full.
+            fast_reader.BLOCK_SIZE = 4000
+            with fast_reader.MmapReader(filename, 'utf-8') as reader:
+                blocks = list(reader.blocks())
+            size = os.path.getsize(filename)
+            self.assertEqual(len(blocks), size // 4000 + 1)
+            self.assertTrue(all(end - start > 2000 for (start, end, rows) in blocks[:-1]))
+            self.assertEqual(blocks[-1][1], size)
+        finally:
+            fast_reader.BLOCK_SIZE = block_size
+
+
+class TestResumableReader(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'data.csv')
+        with open(self.filename, 'wb') as fp:
+            fp.write('a,b\n1,2\n"x\ny",\u00e9\n4,5\r\n6,"7\n\n8"\n9,10\n'.encode('utf-8'))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_matches_csv(self):
+        (header, rows) = read_helper('csv', self.filename)
+        with fast_reader.ResumableReader(self.filename, 'utf-8') as reader:
+            self.assertEqual(reader.header, header)
+            self.assertEqual(list(reader), rows)
+
+    def test_resume(self):
+        (header, rows) = read_helper('csv', self.filename)
+        for n in range(len(rows)):
+            with fast_reader.ResumableReader(self.filename, 'utf-8') as reader:
+                it = iter(reader)
+                for i in range(n):
+                    next(it)
+                start = reader.position()
+            with fast_reader.ResumableReader(self.filename, 'utf-8', start=start) as reader:
+                self.assertEqual(list(reader), rows[n:])
+                self.assertEqual(reader.position()['offset'], os.path.getsize(self.filename))
+
+    def test_changed(self):
+        with fast_reader.ResumableReader(self.filename, 'utf-8') as reader:
+            it = iter(reader)
+            next(it)
+            next(it)
+            start = reader.position()
+        with open(self.filename, 'r+b') as fp:
+            fp.write(b'A')
+        with self.assertRaises(ValueError):
+            fast_reader.ResumableReader(self.filename, 'utf-8', start=start)
+
+    def test_encoding(self):
+        with self.assertRaises(ValueError):
+            fast_reader.ResumableReader(self.filename, 'utf-16')
+
+
+class TestMmapEncodings(unittest.TestCase):
+    def test_ok(self):
+        self.assertTrue(fast_reader.mmap_encoding_ok('UTF8'))
+        self.assertTrue(fast_reader.mmap_encoding_ok('latin1'))
+
+    def test_not_ok(self):
+        self.assertFalse(fast_reader.mmap_encoding_ok('utf-16'))
+        self.assertFalse(fast_reader.mmap_encoding_ok('no-such-encoding'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import unittest
+import os
+import csv
+import shutil
+import tempfile
+
+import geocoder
+
+
+class TestNormalize(unittest.TestCase):
+    def test_normalize(self):
+        self.assertEqual(geocoder.normalize_address(' 22 Oak  Avenue, North '), '22 OAK AVE N')
+        self.assertEqual(geocoder.normalize_address('22 oak ave.'), '22 OAK AVE')
+        self.assertEqual(geocoder.normalize_address(' , '), '')
+
+
+class TestGeocoder(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.gazetteer = os.path.join(self.dir, 'addresses.csv')
+        self.cache = os.path.join(self.dir, 'addresses.geocache.sqlite')
+        with open(self.gazetteer, 'w', encoding='utf-8', newline='') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['addr', 'y', 'x'])
+            writer.writerow(['22 Oak Ave', '37.4', '-122.1'])
+            writer.writerow(['1 Main St', '37.5', '-122.2'])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def geocoder_helper(self):
+        return geocoder.Geocoder(self.gazetteer, ['addr', 'y', 'x'], 4326, self.cache)
+
+    def test_lookup(self):
+        gc = self.geocoder_helper()
+        self.assertEqual(gc.geocode('22 OAK AVENUE'), (37.4, -122.1))
+        self.assertEqual(gc.geocode('22 Oak Avenue Apt 4'), (37.4, -122.1))
+        self.assertIsNone(gc.geocode('99 Nowhere Rd'))
+        self.assertEqual(gc.geocode('22 oak ave.'), (37.4, -122.1))
+        gc.close()
+        self.assertEqual(gc.stats['lookups'], 3)
+        self.assertEqual(gc.stats['memory_hits'], 1)
+        self.assertEqual(gc.stats['not_found'], 1)
+
+    def test_uncounted(self):
+        gc = self.geocoder_helper()
+        gc.geocode('1 Main Street')
+        self.assertEqual(geocoder.Uncounted(gc).geocode('1 Main Street'), (37.5, -122.2))
+        self.assertEqual(gc.stats['rows'], 1)
+        self.assertEqual(gc.stats['memory_hits'], 0)
+        gc.close()
+
+    def test_cache_persists(self):
+        gc = self.geocoder_helper()
+        gc.geocode('1 Main Street')
+        gc.geocode('99 Nowhere Rd')
+        gc.close()
+
+        gc = self.geocoder_helper()
+        self.assertEqual(gc.geocode('1 Main Street'), (37.5, -122.2))
+        self.assertIsNone(gc.geocode('99 Nowhere Rd'))
+        self.assertEqual(gc.stats['cache_hits'], 2)
+        self.assertEqual(gc.stats['lookups'], 0)
+        self.assertIsNone(gc._index) # the gazetteer was never loaded
+        gc.close()
+
+    def test_changed_gazetteer_clears_cache(self):
+        gc = self.geocoder_helper()
+        gc.geocode('1 Main Street')
+        gc.close()
+        with open(self.gazetteer, 'a', encoding='utf-8', newline='') as fp:
+            csv.writer(fp).writerow(['5 Elm St', '37.6', '-122.3'])
+
+        gc = self.geocoder_helper()
+        gc.geocode('1 Main Street')
+        self.assertEqual(gc.stats['lookups'], 1)
+        gc.close()
+
+    def test_changed_epsg_or_fields_clears_cache(self):
+        gc = self.geocoder_helper()
+        gc.geocode('1 Main Street')
+        gc.close()
+
+        gc = geocoder.Geocoder(self.gazetteer, ['addr', 'y', 'x'], 3857, self.cache)
+        gc.geocode('1 Main Street')
+        self.assertEqual(gc.stats['lookups'], 1)
+        gc.close()
+
+        gc = geocoder.Geocoder(self.gazetteer, ['addr', 'x', 'y'], 3857, self.cache)
+        self.assertEqual(gc.geocode('1 Main Street'), (-122.2, 37.5))
+        self.assertEqual(gc.stats['lookups'], 1)
+        gc.close()
+
+    def test_missing_column(self):
+        gc = geocoder.Geocoder(self.gazetteer, ['address', 'lat', 'lon'], 4326, self.cache)
+        with self.assertRaises(ValueError):
+            gc.geocode('1 Main Street')
+        gc.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import json
+import unittest
+import tempfile
+
+import records
+import geojson_writer
+
+
+IDS = {'city': {'datatype': 'string'},
+       'pop': {'datatype': 'real'},
+       'dlat': {'datatype': 'real'},
+       'dlon': {'datatype': 'real'}}
+
+
+def strict_loads(text):
+    def reject(name):
+        raise ValueError("{name} is not valid JSON".format(name=name))
+    return json.loads(text, parse_constant=reject)
+
+
+class TestNonFinite(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        Record = records.record_type(IDS)
+        self.recs = [Record._make([37.0, -122.0, 'A', float('nan')]),
+                     Record._make([37.5, -122.5, 'B', float('inf')]),
+                     Record._make([float('nan'), -122.0, 'C', 1.5])]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def check_features(self, features):
+        self.assertEqual([f['properties']['pop'] for f in features], [None, None, 1.5])
+        self.assertEqual(features[0]['geometry'], {'type': 'Point', 'coordinates': [-122.0, 37.0]})
+        self.assertIsNone(features[2]['geometry'])
+
+    def test_compact(self):
+        filename = os.path.join(self.tmp.name, 'data.geojson')
+        w = geojson_writer.CompactGeoJSONWriter(filename, IDS, 4326)
+        for r in self.recs:
+            w.add_record(r)
+        w.close()
+        with open(filename, encoding='utf-8') as fp:
+            self.check_features(strict_loads(fp.read())['features'])
+
+    def test_dropnulls(self):
+        filename = os.path.join(self.tmp.name, 'data.geojson')
+        w = geojson_writer.CompactGeoJSONWriter(filename, IDS, 4326, dropnulls=True)
+        for r in self.recs:
+            w.add_record(r)
+        w.close()
+        with open(filename, encoding='utf-8') as fp:
+            features = strict_loads(fp.read())['features']
+        self.assertNotIn('pop', features[0]['properties'])
+
+    def test_seq(self):
+        filename = os.path.join(self.tmp.name, 'data.geojsonl')
+        w = geojson_writer.GeoJSONSeqWriter(filename, IDS, 4326)
+        for r in self.recs:
+            w.add_record(r)
+        w.close()
+        with open(filename, encoding='utf-8') as fp:
+            self.check_features([strict_loads(line) for line in fp])
+
+
+if __name__ == '__main__':
+    unittest.main()
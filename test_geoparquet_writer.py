@@ -0,0 +1,84 @@
+import os
+import json
+import struct
+import unittest
+import tempfile
+
+import records
+import geoparquet_writer
+
+if geoparquet_writer.pyarrow is not None:
+    import pyarrow.parquet
+
+
+IDS = {'city': {'datatype': 'string'},
+       'dlat': {'datatype': 'real'},
+       'units': {'datatype': 'integer'},
+       'dlon': {'datatype': 'real'}}
+
+
+@unittest.skipIf(geoparquet_writer.pyarrow is None, "needs the 'pyarrow' package")
+class TestGeoParquetWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmp.name, 'sites.parquet')
+        Record = records.record_type(IDS)
+        self.recs = [Record._make([37.0 + i/100.0, -122.0 - i/100.0, 'City {n}'.format(n=i % 3), i if i % 4 else None])
+                     for i in range(10)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_helper(self, **kwargs):
+        w = geoparquet_writer.GeoParquetWriter(self.filename, IDS, 4326, **kwargs)
+        for r in self.recs:
+            w.add_record(r)
+        return w.close()
+
+    def test_abort(self):
+        w = geoparquet_writer.GeoParquetWriter(self.filename, IDS, 4326)
+        for r in self.recs:
+            w.add_record(r)
+        w.abort()
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_columns(self):
+        stats = self.write_helper(row_group_size=4, bbox=[-122.09, 37.0, -122.0, 37.09])
+        self.assertEqual(stats['rows'], 10)
+        self.assertEqual(stats['row_groups'], 3)
+        self.assertEqual(pyarrow.parquet.ParquetFile(self.filename).metadata.num_row_groups, 3)
+
+        table = pyarrow.parquet.read_table(self.filename)
+        self.assertEqual(table.column_names, ['city', 'dlat', 'units', 'dlon', 'geometry'])
+        self.assertEqual(str(table.schema.field('units').type), 'int64')
+        self.assertEqual(str(table.schema.field('dlat').type), 'double')
+        self.assertEqual(table.column('units').to_pylist(), [r.units for r in self.recs])
+        self.assertEqual(table.column('city').to_pylist(), [r.city for r in self.recs])
+        points = [struct.unpack('<BIdd', g)[2:] for g in table.column('geometry').to_pylist()]
+        self.assertEqual(points, [(r.dlon, r.dlat) for r in self.recs])
+
+    def test_geo_metadata(self):
+        self.write_helper(bbox=[-122.09, 37.0, -122.0, 37.09])
+        schema = pyarrow.parquet.read_schema(self.filename)
+        geo = json.loads(schema.metadata[b'geo'])
+        self.assertEqual(geo['primary_column'], 'geometry')
+        column = geo['columns']['geometry']
+        self.assertEqual(column['encoding'], 'WKB')
+        self.assertEqual(column['geometry_types'], ['Point'])
+        self.assertEqual(column['bbox'], [-122.09, 37.0, -122.0, 37.09])
+        self.assertNotIn('crs', column)
+
+    def test_column_selection(self):
+        self.write_helper(compression='zstd')
+        table = pyarrow.parquet.read_table(self.filename, columns=['units'])
+        self.assertEqual(table.column_names, ['units'])
+
+    def test_bad_options(self):
+        with self.assertRaises(ValueError):
+            geoparquet_writer.GeoParquetWriter(self.filename, IDS, 4326, compression='rar')
+        with self.assertRaises(ValueError):
+            geoparquet_writer.GeoParquetWriter(self.filename, IDS, 4326, row_group_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
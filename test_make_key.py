@@ -0,0 +1,118 @@
+import unittest
+import os
+import random
+import shutil
+import tempfile
+
+import make_key
+import read_key
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(make_key.__file__), "examples")
+
+
+class TestInferDatatype(unittest.TestCase):
+    def test_integer(self):
+        self.assertEqual(make_key.infer_datatype(['1', ' 22 ', '', '-3']), 'integer')
+
+    def test_real(self):
+        self.assertEqual(make_key.infer_datatype(['1', '2.5', '', '-3e2']), 'real')
+
+    def test_zipcode_with_bad_value(self):
+        self.assertEqual(make_key.infer_datatype(['94061', '94062-1234']), 'string')
+
+    def test_leading_zeros(self):
+        self.assertEqual(make_key.infer_datatype(['01234', '94061']), 'string')
+
+    def test_zero(self):
+        self.assertEqual(make_key.infer_datatype(['0', '10']), 'integer')
+
+    def test_not_python_literals(self):
+        self.assertEqual(make_key.infer_datatype(['1_000', 'nan']), 'string')
+
+    def test_blank(self):
+        self.assertEqual(make_key.infer_datatype(['', '  ']), 'string')
+
+
+class TestMakeIdentifier(unittest.TestCase):
+    def test_simple(self):
+        self.assertEqual(make_key.make_identifier('Site Name', set()), 'site_name')
+
+    def test_truncated_and_unique(self):
+        used = set()
+        self.assertEqual(make_key.make_identifier('Operational Status', used), 'operationa')
+        self.assertEqual(make_key.make_identifier('Operational State', used), 'operatio_2')
+
+    def test_leading_digit(self):
+        self.assertEqual(make_key.make_identifier('2nd Address', set()), 'c_2nd_addr')
+
+    def test_reserved(self):
+        self.assertNotEqual(make_key.make_identifier('dlat', set()), 'dlat')
+
+
+class TestReservoirSample(unittest.TestCase):
+    def test_small(self):
+        (sample, count) = make_key.reservoir_sample(range(5), 10)
+        self.assertEqual(sorted(sample), list(range(5)))
+        self.assertEqual(count, 5)
+
+    def test_bounded(self):
+        (sample, count) = make_key.reservoir_sample(range(10000), 100, random.Random(1))
+        self.assertEqual(len(sample), 100)
+        self.assertEqual(count, 10000)
+        self.assertEqual(len(set(sample)), 100)
+        # Drawn from the whole range, not just the start.
+        self.assertTrue(max(sample) > 5000)
+
+
+class TestProposeKey(unittest.TestCase):
+    def test_latlon(self):
+        header = ['Name', 'Latitude', 'Longitude']
+        sample = [{'Name': 'a', 'Latitude': '37.5', 'Longitude': '-122.2'},
+                  {'Name': 'b', 'Latitude': '', 'Longitude': ''}]
+        (settings, cols) = make_key.propose_key(header, sample)
+        settings = dict(settings)
+        self.assertEqual(settings['dlatcol'], 'Latitude')
+        self.assertEqual(settings['dloncol'], 'Longitude')
+        self.assertEqual(settings['maxskippct'], 51)
+        self.assertEqual([c['identifier'] for c in cols], ['name', 'dlat', 'dlon'])
+
+    def test_dllcol(self):
+        header = ['Name', 'Location 1']
+        sample = [{'Name': 'a', 'Location 1': '4200 Farm Hill Blvd\nRedwood City, CA 94061\n(37.447061, -122.260384)'}]
+        (settings, cols) = make_key.propose_key(header, sample)
+        settings = dict(settings)
+        self.assertEqual(settings['dllcol'], 'Location 1')
+        self.assertEqual(settings['dllre'], make_key.DLLRE_ADDRESS)
+        self.assertEqual([c['identifier'] for c in cols], ['name', '', 'dlat', 'dlon', 'address'])
+
+    def test_dllcol_with_address_column(self):
+        header = ['Name', 'Address', 'Location 1']
+        sample = [{'Name': 'a', 'Address': '4200 Farm Hill Blvd',
+                   'Location 1': '4200 Farm Hill Blvd\nRedwood City, CA 94061\n(37.447061, -122.260384)'}]
+        (settings, cols) = make_key.propose_key(header, sample)
+        self.assertEqual([c['identifier'] for c in cols], ['name', 'address_2', '', 'dlat', 'dlon', 'address'])
+
+
+class TestExampleKeys(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_round_trip(self):
+        for name in ['Solid_Waste_Centers', 'Schools_of_San_Mateo_County']:
+            keyfile = os.path.join(self.dir, name+'.key.csv')
+            make_key.main(['--datafile', os.path.join(EXAMPLES_DIR, name+'.csv'),
+                           '--keyfile', keyfile, '--seed', '1'])
+            kf = read_key.KeyFile()
+            kf.read(keyfile)
+            self.assertEqual(kf.globals['epsg_code'], 4326)
+            self.assertTrue(kf.globals['dllcol'])
+            self.assertIn('dlat', kf.ids)
+            self.assertIn('dlon', kf.ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import unittest
+import os
+import csv
+import shutil
+import tempfile
+
+import partition
+import records
+import string_dict
+
+
+class ListWriter(object):
+    """Stands in for an output data source, keeping records in memory."""
+    opened = []
+    written = {}
+    closed = []
+
+    def __init__(self, filename, append):
+        self.filename = filename
+        ListWriter.opened.append((filename, append))
+        if not append:
+            ListWriter.written[filename] = []
+
+    def add_record(self, record):
+        ListWriter.written[self.filename].append(record)
+
+    def close(self):
+        ListWriter.closed.append(self.filename)
+
+
+IDS = {'service': {'datatype': 'string'}}
+FIELDS = records.record_fields(IDS)
+Record = records.record_type(IDS)
+SERVICE = 2
+
+
+def record_helper(service, dlon, dlat):
+    return Record(dlat, dlon, service)
+
+
+class TestPartitionKey(unittest.TestCase):
+    def test_by_identifier(self):
+        self.assertEqual(partition.partition_key(record_helper('Fire', 0, 0), SERVICE), 'Fire')
+
+    def test_null(self):
+        self.assertEqual(partition.partition_key(record_helper(None, 0, 0), SERVICE), 'null')
+
+    def test_grid(self):
+        self.assertEqual(partition.partition_key(record_helper('Fire', -122.25, 37.5), grid_size=0.5), 'x-245_y75')
+
+    def test_both(self):
+        self.assertEqual(partition.partition_key(record_helper('Fire', 0.1, 0.1), SERVICE, 1.0), 'Fire_x0_y0')
+
+
+class TestPartitionRouter(unittest.TestCase):
+    def setUp(self):
+        ListWriter.opened = []
+        ListWriter.written = {}
+        ListWriter.closed = []
+        self.dir = tempfile.mkdtemp()
+        self.fileroot = os.path.join(self.dir, 'data')
+        self.records = [record_helper(s, float(i), float(-i))
+                        for i in range(2000) for s in ['Fire', 'Police', 'Sheriff Office']]
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def route_helper(self, threads, max_open, encoder=None):
+        router = partition.PartitionRouter(self.fileroot, '.geojson', ListWriter, FIELDS,
+                                           partition_by='service', threads=threads, max_open=max_open,
+                                           encoder=encoder)
+        for r in self.records:
+            router.add_record(r)
+        return (router, router.close())
+
+    def test_counts(self):
+        (router, parts) = self.route_helper(2, 8)
+        self.assertEqual(sorted(parts), ['Fire', 'Police', 'Sheriff Office'])
+        for key in parts:
+            self.assertEqual(parts[key]['count'], 2000)
+            self.assertEqual(len(ListWriter.written[parts[key]['filename']]), 2000)
+        self.assertEqual(parts['Fire']['extent'], [0.0, -1999.0, 1999.0, 0.0])
+        self.assertTrue(parts['Sheriff Office']['filename'].endswith('data.Sheriff_Office.geojson'))
+
+    def test_reopens_when_capped(self):
+        (router, parts) = self.route_helper(1, 1)
+        self.assertTrue(any(append for (filename, append) in ListWriter.opened))
+        for key in parts:
+            self.assertEqual(len(ListWriter.written[parts[key]['filename']]), 2000)
+
+    def test_encoded_batches(self):
+        encoder = string_dict.RecordEncoder(FIELDS, {'service': 'string'})
+        (router, parts) = self.route_helper(2, 8, encoder)
+        self.assertEqual(ListWriter.written[parts['Police']['filename']][:2],
+                         [record_helper('Police', 0.0, -0.0), record_helper('Police', 1.0, -1.0)])
+        self.assertEqual(encoder.stats()['columns'], {'service': {'distinct': 3, 'encoded': True}})
+
+    def test_abort(self):
+        router = partition.PartitionRouter(self.fileroot, '.geojson', ListWriter, FIELDS,
+                                           partition_by='service', threads=2, max_open=8)
+        for r in self.records:
+            router.add_record(r)
+        router.abort()
+        self.assertEqual(sorted(ListWriter.closed), sorted(ListWriter.written))
+        self.assertFalse(any(t.is_alive() for t in router._threads))
+
+    def test_writer_error(self):
+        def open_writer(filename, append):
+            if 'Police' in filename:
+                raise RuntimeError("disk full")
+            return ListWriter(filename, append)
+        router = partition.PartitionRouter(self.fileroot, '.geojson', open_writer, FIELDS,
+                                           partition_by='service', threads=2, max_open=8)
+        try:
+            with self.assertRaises(RuntimeError):
+                for r in self.records:
+                    router.add_record(r)
+                router.close()
+        finally:
+            router.abort()
+        self.assertEqual(sorted(ListWriter.closed), sorted(ListWriter.written))
+        self.assertFalse(any(t.is_alive() for t in router._threads))
+
+    def test_index(self):
+        (router, parts) = self.route_helper(2, 8)
+        index = self.fileroot + '.partitions.csv'
+        router.write_index(index)
+        with open(index, newline='') as fp:
+            rows = list(csv.DictReader(fp))
+        self.assertEqual([r['partition'] for r in rows], list(parts))
+        self.assertEqual([int(r['count']) for r in rows], [2000, 2000, 2000])
+
+
+if __name__ == '__main__':
+    unittest.main()
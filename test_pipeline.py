@@ -0,0 +1,78 @@
+import unittest
+import time
+import threading
+
+import pipeline
+
+
+def rows_helper(n):
+    return [({'n': str(i)}, i+2) for i in range(n)]
+
+
+class TestPipeline(unittest.TestCase):
+    def test_order(self):
+        written = []
+        stats = pipeline.run(iter(rows_helper(5000)),
+                             lambda rows: [int(r['n']) for (r, line_num) in rows if int(r['n']) % 3],
+                             written.extend, block_rows=100)
+        self.assertEqual(written, [i for i in range(5000) if i % 3])
+        self.assertEqual(stats['rows'], 5000)
+        self.assertEqual(stats['blocks'], 50)
+        self.assertEqual(stats['records'], len(written))
+
+    def test_memory_ceiling(self):
+        # A tiny ceiling still leaves room for one block per queue.
+        written = []
+        stats = pipeline.run(rows_helper(1000), lambda rows: rows, written.extend,
+                             memory_mb=0.001, block_rows=10)
+        self.assertEqual(stats['queue_blocks'], 1)
+        self.assertEqual(len(written), 1000)
+
+    def test_empty(self):
+        written = []
+        stats = pipeline.run([], lambda rows: rows, written.extend)
+        self.assertEqual(written, [])
+        self.assertEqual(stats['rows'], 0)
+
+    def test_parse_error(self):
+        def parse(rows):
+            if rows[0][1] > 500:
+                raise ValueError("bad cell")
+            return rows
+        with self.assertRaises(ValueError):
+            pipeline.run(rows_helper(100000), parse, lambda records: None, block_rows=100)
+
+    def test_write_error(self):
+        def write(records):
+            raise IOError("disk full")
+        with self.assertRaises(IOError):
+            pipeline.run(rows_helper(100000), lambda rows: rows, write, block_rows=100)
+
+    def test_write_error_stops_parsing(self):
+        failed = threading.Event()
+        parsed = []
+        def parse(rows):
+            parsed.append(rows[0][1])
+            if len(parsed) > 1:
+                failed.wait()
+                time.sleep(0.05) # for the writer to cancel
+            return rows
+        def write(records):
+            failed.set()
+            raise IOError("disk full")
+        with self.assertRaises(IOError):
+            pipeline.run(rows_helper(100000), parse, write, block_rows=100)
+        self.assertLessEqual(len(parsed), 2)
+
+    def test_read_error(self):
+        def rows():
+            for row in rows_helper(1000):
+                yield row
+            raise UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'invalid start byte')
+        written = []
+        with self.assertRaises(UnicodeDecodeError):
+            pipeline.run(rows(), lambda rows: rows, written.extend, block_rows=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
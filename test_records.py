@@ -0,0 +1,33 @@
+import unittest
+
+import records
+
+
+IDS = {'city': {'datatype': 'string'},
+       'dlat': {'datatype': 'real'},
+       'in': {'datatype': 'integer'},
+       'dlon': {'datatype': 'real'}}
+
+
+class TestRecordType(unittest.TestCase):
+    def test_fields(self):
+        self.assertEqual(records.record_fields(IDS), ('dlat', 'dlon', 'city', 'in'))
+        self.assertEqual(records.field_index(IDS)['in'], 3)
+
+    def test_record(self):
+        Record = records.record_type(IDS)
+        record = Record._make([37.5, -122.25, 'Oakland', 3])
+        self.assertEqual(record[records.DLAT], 37.5)
+        self.assertEqual(record[records.DLON], -122.25)
+        self.assertEqual(record.city, 'Oakland')
+        self.assertEqual(record[Record._index['in']], 3)
+        self.assertEqual(record._asdict(), {'dlat': 37.5, 'dlon': -122.25, 'city': 'Oakland', 'in': 3})
+
+    def test_no_instance_dict(self):
+        Record = records.record_type(IDS)
+        record = Record._make([0.0, 0.0, None, None])
+        self.assertFalse(hasattr(record, '__dict__'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+import parse_datatypes
+import row_filter
+
+
+PARSE = parse_datatypes.ParseDatatype(number_NA=[''])
+
+
+class KeyFileHelper(object):
+    """Just the ids part of a read_key.KeyFile."""
+    ids = {'city': {'csv_header': 'Place Name', 'datatype': 'string'},
+           'unit_num': {'csv_header': 'Unit Number', 'datatype': 'integer'},
+           'dlat': {'csv_header': '', 'datatype': 'real'}}
+
+
+def filter_helper(*where):
+    return row_filter.RowFilter(KeyFileHelper(), PARSE, where=list(where))
+
+
+class TestParse(unittest.TestCase):
+    def test_bbox(self):
+        self.assertEqual(row_filter.parse_bbox('-122.5,37,-122,37.5'), [-122.5, 37.0, -122.0, 37.5])
+
+    def test_bad_bbox(self):
+        for text in ['1,2,3', 'a,b,c,d', '1,2,0,3']:
+            with self.assertRaises(ValueError):
+                row_filter.parse_bbox(text)
+
+    def test_bad_where(self):
+        for text in ['city', 'nope=1', 'dlat>37', 'unit_num=one']:
+            with self.assertRaises(ValueError):
+                filter_helper(text)
+
+
+class TestRowFilter(unittest.TestCase):
+    def test_equals(self):
+        rf = filter_helper('city=Redwood City')
+        self.assertTrue(rf.match_cells({'Place Name': ' Redwood City  '}))
+        self.assertFalse(rf.match_cells({'Place Name': 'Brisbane'}))
+
+    def test_numeric(self):
+        rf = filter_helper('unit_num>=2', 'unit_num!=3')
+        self.assertTrue(rf.match_cells({'Unit Number': '2'}))
+        self.assertFalse(rf.match_cells({'Unit Number': '3'}))
+        self.assertFalse(rf.match_cells({'Unit Number': '10.5'}))
+        self.assertFalse(rf.match_cells({'Unit Number': ''}))
+
+    def test_null(self):
+        self.assertTrue(filter_helper('unit_num=').match_cells({'Unit Number': ''}))
+        self.assertTrue(filter_helper('unit_num!=').match_cells({'Unit Number': '1'}))
+
+    def test_bbox(self):
+        rf = row_filter.RowFilter(KeyFileHelper(), PARSE, bbox=[-122.5, 37.0, -122.0, 37.5])
+        self.assertTrue(rf.match_location(37.2, -122.2))
+        self.assertFalse(rf.match_location(37.6, -122.2))
+        self.assertTrue(rf.match_cells({}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import logging
+import unittest
+import tempfile
+
+import run_log
+
+
+class Counted(object):
+    """A field that counts how often it's formatted."""
+    formatted = 0
+
+    def __format__(self, spec):
+        Counted.formatted += 1
+        return 'counted'
+
+
+class TestSkipLog(unittest.TestCase):
+    def test_counts(self):
+        skips = run_log.SkipLog(examples=2)
+        for i in range(5):
+            skips.add(run_log.Skip('lat/lon is blank', 'row {line}', line=i))
+        skips.add(run_log.Skip('location is odd', 'row {line}', line=9))
+        self.assertEqual(skips.count(), 6)
+        self.assertEqual(skips.counts, {'lat/lon is blank': 5, 'location is odd': 1})
+        self.assertEqual([str(s) for s in skips.kept['lat/lon is blank']], ['row 0', 'row 1'])
+
+    def test_lazy(self):
+        Counted.formatted = 0
+        skips = run_log.SkipLog(examples=3)
+        for i in range(1000):
+            skips.add(run_log.Skip('lat/lon is blank', 'row {val}', val=Counted()))
+        self.assertEqual(Counted.formatted, 0)
+        skips.state()
+        self.assertEqual(Counted.formatted, 3)
+
+    def test_state(self):
+        skips = run_log.SkipLog(examples=2)
+        for i in range(3):
+            skips.add(run_log.Skip('lat/lon is blank', 'row {line}', line=i))
+        restored = run_log.SkipLog(examples=2)
+        restored.restore(skips.state())
+        restored.add(run_log.Skip('lat/lon is blank', 'row {line}', line=3))
+        self.assertEqual(restored.count(), 4)
+        self.assertEqual([str(s) for s in restored.kept['lat/lon is blank']], ['row 0', 'row 1'])
+
+
+    def test_merge(self):
+        (a, b) = (run_log.SkipLog(examples=2), run_log.SkipLog(examples=2))
+        a.add(run_log.Skip('lat/lon is blank', 'row {line}', line=1))
+        for i in range(3):
+            b.add(run_log.Skip('lat/lon is blank', 'row {line}', line=i))
+        a.merge(b.state(), prefix='b.csv: ')
+        self.assertEqual(a.count(), 4)
+        self.assertEqual([str(s) for s in a.kept['lat/lon is blank']], ['row 1', 'b.csv: row 0'])
+
+
+class TestStart(unittest.TestCase):
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'logs', 'run.log')
+            run_log.start(filename, 'WARNING')
+            try:
+                logging.info("not this")
+                logging.warning("but this")
+                skips = run_log.SkipLog()
+                skips.add(run_log.Skip('lat/lon is blank', 'row {line}', line=2))
+                skips.report()
+            finally:
+                run_log.stop()
+            with open(filename, encoding='utf-8') as fp:
+                text = fp.read()
+        self.assertIn('|WARNING|', text)
+        self.assertIn('but this', text)
+        self.assertNotIn('not this', text)
+        self.assertNotIn('row 2', text)
+
+    def test_process_pool(self):
+        with tempfile.TemporaryDirectory() as d:
+            filename = os.path.join(d, 'run.log')
+            run_log.start(filename, 'INFO')
+            try:
+                with run_log.process_pool(2) as pool:
+                    self.assertEqual(list(pool.map(log_helper, range(3))), [0, 1, 2])
+            finally:
+                run_log.stop()
+            with open(filename, encoding='utf-8') as fp:
+                text = fp.read()
+        for n in range(3):
+            self.assertIn('from worker {n}'.format(n=n), text)
+
+
+def log_helper(n):
+    logging.info("from worker {n}".format(n=n))
+    return n
+
+
+if __name__ == '__main__':
+    unittest.main()
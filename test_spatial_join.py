@@ -0,0 +1,66 @@
+import unittest
+import random
+
+import osgeo.ogr
+
+import records
+import spatial_join
+
+
+def square(x, y, size):
+    return [(x, y), (x+size, y), (x+size, y+size), (x, y+size), (x, y)]
+
+
+class TestSTRTree(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rand = random.Random(1)
+        boxes = []
+        for i in range(2000):
+            (x, y) = (rand.uniform(0, 100), rand.uniform(0, 100))
+            boxes.append((x, y, x + rand.uniform(0, 5), y + rand.uniform(0, 5)))
+        tree = spatial_join.STRTree(boxes)
+        self.assertGreater(len(tree.levels), 1)
+        xs = [rand.uniform(-5, 105) for i in range(500)]
+        ys = [rand.uniform(-5, 105) for i in range(500)]
+        found = tree.query_points(xs, ys)
+        for (x, y, hits) in zip(xs, ys, found):
+            expected = [i for (i, b) in enumerate(boxes) if b[0] <= x <= b[2] and b[1] <= y <= b[3]]
+            self.assertEqual(hits, expected)
+
+    def test_empty(self):
+        self.assertEqual(spatial_join.STRTree([]).query_points([1.0], [1.0]), [[]])
+
+
+class TestPointInRings(unittest.TestCase):
+    def test_hole(self):
+        rings = [square(0, 0, 10), square(4, 4, 2)]
+        self.assertTrue(spatial_join.point_in_rings(1, 1, rings))
+        self.assertFalse(spatial_join.point_in_rings(5, 5, rings))
+        self.assertFalse(spatial_join.point_in_rings(11, 5, rings))
+
+
+class TestSpatialJoin(unittest.TestCase):
+    def test_tag_records(self):
+        sj = spatial_join.SpatialJoin(['district', 'pop'], {'district': 'string', 'pop': 'integer'},
+                                      [[square(0, 0, 10)], [square(10, 0, 10)]],
+                                      [('West', 100), ('East Side', 200)])
+        self.assertEqual(sj.str_widths, {'district': 9})
+        ids = {'name': {'datatype': 'string'}, 'district': {'datatype': 'string'}, 'pop': {'datatype': 'integer'}}
+        Record = records.record_type(ids)
+        recs = [Record(5.0, 5.0, 'a', None, None), Record(5.0, 15.0, 'b', None, None),
+                Record(50.0, 50.0, 'c', None, None)]
+        tagged = list(sj.tag_records(iter(recs), Record))
+        self.assertEqual([r.district for r in tagged], ['West', 'East Side', None])
+        self.assertEqual([r.pop for r in tagged], [100, 200, None])
+        self.assertEqual(sj.stats['tagged'], 2)
+
+    def test_integer64_as_string(self):
+        self.assertEqual(spatial_join._datatype(osgeo.ogr.OFTInteger), 'integer')
+        self.assertEqual(spatial_join._datatype(osgeo.ogr.OFTInteger64), 'string')
+        datatype = spatial_join._datatype(osgeo.ogr.OFTInteger64)
+        self.assertEqual(spatial_join._value(60816001001000, datatype), '60816001001000')
+        self.assertIsNone(spatial_join._value(None, datatype))
+
+
+if __name__ == '__main__':
+    unittest.main()
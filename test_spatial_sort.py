@@ -0,0 +1,71 @@
+import random
+import unittest
+
+import records
+import spatial_sort
+
+
+IDS = {'n': {'datatype': 'integer'},
+       'dlat': {'datatype': 'real'},
+       'dlon': {'datatype': 'real'}}
+
+
+class TestHilbertIndex(unittest.TestCase):
+    def test_order1(self):
+        # The first-order curve visits (0,0), (0,1), (1,1), (1,0).
+        self.assertEqual([spatial_sort.hilbert_index(x, y, 1) for (x, y) in [(0, 0), (0, 1), (1, 1), (1, 0)]],
+                         [0, 1, 2, 3])
+
+    def test_neighbours(self):
+        # Each step along the curve moves to an adjacent cell.
+        order = 4
+        cells = {spatial_sort.hilbert_index(x, y, order): (x, y)
+                 for x in range(1 << order) for y in range(1 << order)}
+        self.assertEqual(sorted(cells), list(range(1 << (2*order))))
+        for d in range(1, len(cells)):
+            ((x0, y0), (x1, y1)) = (cells[d-1], cells[d])
+            self.assertEqual(abs(x1 - x0) + abs(y1 - y0), 1)
+
+
+class TestSpatialSorter(unittest.TestCase):
+    def setUp(self):
+        self.Record = records.record_type(IDS)
+        rand = random.Random(3)
+        self.recs = [self.Record._make([rand.uniform(37.0, 38.0), rand.uniform(-123.0, -122.0), i])
+                     for i in range(5000)]
+        # Duplicate points keep their data file order.
+        self.recs += [self.Record._make([37.5, -122.5, 5000 + i]) for i in range(10)]
+        self.extent = [-123.0, 37.0, -122.0, 38.0]
+
+    def sort_helper(self, memory_mb):
+        out = []
+        sorter = spatial_sort.SpatialSorter(out.append, self.Record, self.extent, memory_mb=memory_mb)
+        for r in self.recs:
+            sorter.add_record(r)
+        return (out, sorter.close())
+
+    def test_in_memory(self):
+        key = spatial_sort.HilbertKey(self.extent)
+        (out, stats) = self.sort_helper(spatial_sort.DEFAULT_MEMORY_MB)
+        self.assertEqual(stats['runs'], 1)
+        self.assertEqual(stats['spilled_bytes'], 0)
+        self.assertEqual(out, sorted(self.recs, key=key))
+        self.assertTrue(all(isinstance(r, self.Record) for r in out))
+
+    def test_spilled(self):
+        (in_memory, stats) = self.sort_helper(spatial_sort.DEFAULT_MEMORY_MB)
+        (out, stats) = self.sort_helper(0.1)
+        self.assertGreater(stats['runs'], 2)
+        self.assertGreater(stats['spilled_bytes'], 0)
+        self.assertEqual(stats['records'], len(self.recs))
+        self.assertEqual(out, in_memory)
+        same = [r.n for r in out if (r.dlat, r.dlon) == (37.5, -122.5)]
+        self.assertEqual(same, list(range(5000, 5010)))
+
+    def test_outside_extent(self):
+        key = spatial_sort.HilbertKey([0.0, 0.0, 1.0, 1.0])
+        self.assertEqual(key(self.Record._make([5.0, -5.0, 0])), key(self.Record._make([1.0, 0.0, 0])))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+import string_dict
+
+
+class TestRecordBatch(unittest.TestCase):
+    def setUp(self):
+        self.encoder = string_dict.RecordEncoder(['city', 'count'],
+                                                 {'city': 'string', 'count': 'integer'})
+
+    def test_round_trip(self):
+        batch = self.encoder.new_batch()
+        rows = [('Oakland', 1), (None, 2), ('Oakland', None), ('Berkeley', 4)]
+        for row in rows:
+            batch.append(row)
+        self.assertEqual(len(batch), 4)
+        self.assertEqual(list(batch.rows()), rows)
+        self.assertEqual(batch.columns[0].tolist(), [1, 0, 1, 2])
+        self.assertEqual(batch.columns[1], [1, 2, None, 4])
+
+    def test_shared_dictionary(self):
+        first = self.encoder.new_batch()
+        second = self.encoder.new_batch()
+        first.append(('Oakland', 1))
+        second.append(('Oakland', 2))
+        self.assertEqual(second.columns[0].tolist(), [1])
+        self.assertEqual(self.encoder.stats()['columns']['city'], {'distinct': 1, 'encoded': True})
+
+    def test_demoted_to_plain(self):
+        batch = self.encoder.new_batch()
+        rows = [('Unique {n}'.format(n=n), n) for n in range(string_dict.MIN_ROWS + 10)]
+        for row in rows:
+            batch.append(row)
+        self.assertFalse(self.encoder.dictionaries[0].active)
+        self.assertIsInstance(batch.columns[0], list)
+        self.assertEqual(list(batch.rows()), rows)
+        # New batches start out plain once the column is demoted.
+        self.assertIsInstance(self.encoder.new_batch().columns[0], list)
+
+    def test_stats(self):
+        batch = self.encoder.new_batch()
+        for n in range(100):
+            batch.append(('A fairly long street name', n))
+        stats = self.encoder.stats()
+        self.assertEqual(stats['cells'], 100)
+        self.assertLess(stats['encoded_bytes'], stats['plain_bytes'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+import vector_tiles
+
+
+class TestVarint(unittest.TestCase):
+    def test_small(self):
+        self.assertEqual(vector_tiles._varint(1), b'\x01')
+
+    def test_multibyte(self):
+        self.assertEqual(vector_tiles._varint(300), b'\xac\x02')
+
+    def test_zigzag(self):
+        self.assertEqual([vector_tiles._zigzag(n) for n in [0, -1, 1, -2, 2]],
+                         [0, 1, 2, 3, 4])
+
+
+class TestMercator(unittest.TestCase):
+    def test_origin(self):
+        (mx, my) = vector_tiles.mercator(0.0, 0.0)
+        self.assertAlmostEqual(mx, 0.5)
+        self.assertAlmostEqual(my, 0.5)
+
+    def test_clamped(self):
+        (mx, my) = vector_tiles.mercator(-180.0, 90.0)
+        self.assertAlmostEqual(mx, 0.0)
+        self.assertAlmostEqual(my, 0.0)
+
+
+class TestTileFeatures(unittest.TestCase):
+    def setUp(self):
+        # Three points close together and one far away.
+        self.points = [vector_tiles.mercator(lon, lat) + ((name,),)
+                       for (lon, lat, name) in [(-122.26, 37.44, 'a'),
+                                                (-122.2601, 37.4401, 'b'),
+                                                (-122.2602, 37.4402, 'c'),
+                                                (2.35, 48.85, 'd')]]
+
+    def test_unclustered(self):
+        tiles = vector_tiles.tile_features(self.points, 14, False, 16)
+        self.assertEqual(sum(len(f) for f in tiles.values()), 4)
+        for features in tiles.values():
+            for (px, py, values) in features:
+                self.assertTrue(0 <= px < vector_tiles.EXTENT)
+                self.assertTrue(0 <= py < vector_tiles.EXTENT)
+
+    def test_clustered(self):
+        tiles = vector_tiles.tile_features(self.points, 2, True, 16)
+        features = [f for fs in tiles.values() for f in fs]
+        self.assertEqual(len(features), 2)
+        self.assertEqual(sorted(values[-1] for (px, py, values) in features), [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
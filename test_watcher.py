@@ -0,0 +1,117 @@
+import os
+import shutil
+import unittest
+import tempfile
+import threading
+
+import watcher
+import make_key
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(watcher.__file__), "examples")
+
+
+def write_helper(filename, text):
+    with open(filename, 'w', encoding='utf-8') as fp:
+        fp.write(text)
+
+
+class TestFindPairs(unittest.TestCase):
+    def test(self):
+        with tempfile.TemporaryDirectory() as d:
+            for name in ['a.key.csv', 'a.csv', 'b.key.csv', 'c.gen.key.csv', 'c.csv', 'd.csv']:
+                write_helper(os.path.join(d, name), 'x')
+            self.assertEqual(watcher.find_pairs(d),
+                             {os.path.join(d, 'a.key.csv'): os.path.join(d, 'a.csv')})
+
+    def test_draft_key_ignored(self):
+        with tempfile.TemporaryDirectory() as d:
+            datafile = os.path.join(d, 'Solid_Waste_Centers.csv')
+            shutil.copy(os.path.join(EXAMPLES_DIR, 'Solid_Waste_Centers.csv'), datafile)
+            keyfile = make_key.main(['--datafile', datafile, '--seed', '1'])
+            self.assertTrue(os.path.exists(keyfile))
+            self.assertEqual(watcher.find_pairs(d), {})
+            os.rename(keyfile, os.path.join(d, 'Solid_Waste_Centers.key.csv'))
+            self.assertEqual(watcher.find_pairs(d),
+                             {os.path.join(d, 'Solid_Waste_Centers.key.csv'): datafile})
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.keyfile = os.path.join(self.dir, 'sites.key.csv')
+        self.datafile = os.path.join(self.dir, 'sites.csv')
+        write_helper(self.keyfile, 'key')
+        write_helper(self.datafile, 'data')
+        self.converted = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def convert(self, keyfile, datafile):
+        with self.lock:
+            self.converted.append((keyfile, datafile))
+
+    def scan_helper(self, w, now):
+        started = w.scan(now)
+        for f in list(w._running.values()):
+            f.result()
+        return started
+
+    def test_settle(self):
+        w = watcher.Watcher(self.dir, self.convert, settle=2.0)
+        try:
+            # Not converted until the files have held still.
+            self.assertEqual(self.scan_helper(w, 100.0), 0)
+            self.assertEqual(self.scan_helper(w, 101.0), 0)
+            self.assertEqual(self.scan_helper(w, 102.0), 1)
+            self.assertEqual(self.converted, [(self.keyfile, self.datafile)])
+            # Nothing changed, so nothing to do.
+            self.assertEqual(self.scan_helper(w, 110.0), 0)
+
+            # A data file still being written waits until it settles.
+            write_helper(self.datafile, 'more data')
+            self.assertEqual(self.scan_helper(w, 111.0), 0)
+            write_helper(self.datafile, 'more data, and more')
+            self.assertEqual(self.scan_helper(w, 112.0), 0)
+            self.assertEqual(self.scan_helper(w, 113.0), 0)
+            self.assertEqual(self.scan_helper(w, 114.0), 1)
+            self.assertEqual(len(self.converted), 2)
+            self.assertEqual(w.stats['conversions'], 2)
+        finally:
+            w.close()
+
+    def test_up_to_date(self):
+        w = watcher.Watcher(self.dir, self.convert, up_to_date=lambda k, d: True, settle=0)
+        try:
+            self.scan_helper(w, 100.0)
+            self.assertEqual(self.scan_helper(w, 100.0), 0)
+            self.assertEqual(self.converted, [])
+            write_helper(self.keyfile, 'new key')
+            self.scan_helper(w, 101.0)
+            self.assertEqual(self.scan_helper(w, 101.0), 1)
+        finally:
+            w.close()
+
+    def test_failure(self):
+        def fail(keyfile, datafile):
+            raise ValueError("bad cell")
+        w = watcher.Watcher(self.dir, fail, settle=0)
+        try:
+            self.scan_helper(w, 100.0)
+            self.assertEqual(self.scan_helper(w, 100.0), 1)
+            self.assertEqual(w.stats['failures'], 1)
+            # Not retried until the pair changes.
+            self.assertEqual(self.scan_helper(w, 101.0), 0)
+        finally:
+            w.close()
+
+    def test_missing_dir(self):
+        with self.assertRaises(ValueError):
+            watcher.Watcher(os.path.join(self.dir, 'nope'), self.convert)
+
+
+if __name__ == '__main__':
+    unittest.main()
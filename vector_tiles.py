@@ -0,0 +1,322 @@
+# Builds a pyramid of Mapbox Vector Tiles (MVT) from point records, and
+# stores them in an MBTiles file: a SQLite database that tile-serving
+# libraries and most web map toolkits can read without a tile server.
+#
+# Points are bucketed into web mercator tiles for each zoom level. At
+# low zoom levels, points that fall into the same small grid cell are
+# clustered into one point with a 'point_count' property, so tiles stay
+# small even when a layer has many points. Encoding and compressing
+# the tiles is done in a pool of worker processes; bucketing and
+# clustering the points stays in this process, one zoom level at a time.
+#
+# Only the parts of the MVT protobuf format needed for point layers are
+# written here: see https://github.com/mapbox/vector-tile-spec
+
+import os
+import math
+import gzip
+import json
+import sqlite3
+import array
+import struct
+import concurrent.futures
+
+import osgeo.osr
+
+import string_dict
+import records
+import run_log
+
+
+EXTENT = 4096
+MAX_LAT = 85.0511287798066
+
+# Number of tiles handed to a worker process at a time.
+TILES_PER_TASK = 256
+
+
+# ################################################################
+# Protobuf encoding helpers
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _bytes_field(field, data):
+    return _key(field, 2) + _varint(len(data)) + data
+
+
+def _varint_field(field, n):
+    return _key(field, 0) + _varint(n)
+
+
+def _packed_field(field, values):
+    return _bytes_field(field, b''.join(_varint(v) for v in values))
+
+
+def _value(val):
+    """Encode a property value as an MVT Value message."""
+    if isinstance(val, bool):
+        return _varint_field(7, int(val))
+    elif isinstance(val, int):
+        return _varint_field(6, _zigzag(val))
+    elif isinstance(val, float):
+        return _key(3, 1) + struct.pack('<d', val)
+    else:
+        return _bytes_field(1, str(val).encode('utf-8'))
+
+
+def encode_tile(layer_name, keys, features):
+    """Encode one tile with a single point layer.
+
+    keys is the list of property names
+    features is a list of (px, py, values) with px, py in tile
+    coordinates (0..EXTENT) and values in the same order as keys
+    """
+    values = []
+    value_idx = {}
+    feature_msgs = []
+    for (px, py, props) in features:
+        tags = []
+        for (k, val) in enumerate(props):
+            if val is None:
+                continue
+            vkey = (type(val), val)
+            if vkey not in value_idx:
+                value_idx[vkey] = len(values)
+                values.append(val)
+            tags.extend((k, value_idx[vkey]))
+        geometry = [(1 & 0x7) | (1 << 3), _zigzag(px), _zigzag(py)] # MoveTo(1)
+        msg = b''
+        if tags:
+            msg += _packed_field(2, tags)
+        msg += _varint_field(3, 1) # POINT
+        msg += _packed_field(4, geometry)
+        feature_msgs.append(msg)
+
+    layer = _varint_field(15, 2) + _bytes_field(1, layer_name.encode('utf-8'))
+    layer += b''.join(_bytes_field(2, f) for f in feature_msgs)
+    layer += b''.join(_bytes_field(3, k.encode('utf-8')) for k in keys)
+    layer += b''.join(_bytes_field(4, _value(v)) for v in values)
+    layer += _varint_field(5, EXTENT)
+    return _bytes_field(3, layer)
+
+
+def _encode_tiles(layer_name, keys, tiles):
+    """Worker process entry point: encode and gzip a batch of tiles."""
+    return [(z, x, y, gzip.compress(encode_tile(layer_name, keys, features)))
+            for (z, x, y, features) in tiles]
+
+
+# ################################################################
+# Tiling
+
+def mercator(lon, lat):
+    """Return web mercator coordinates scaled to 0..1, from the top left."""
+    lat = max(min(lat, MAX_LAT), -MAX_LAT)
+    mx = (lon + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    my = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return (min(max(mx, 0.0), 1.0), min(max(my, 0.0), 1.0))
+
+
+def tile_features(points, zoom, cluster, clusterpx):
+    """Bucket points into the tiles for one zoom level.
+
+    points is an iterable of (mx, my, values), with mx, my from mercator()
+    cluster combines points in the same clusterpx-wide grid cell,
+    keeping the first point and adding a point_count.
+
+    Returns {(x, y): [(px, py, values), ...]}
+    """
+    scale = (1 << zoom) * EXTENT
+    last = (1 << zoom) - 1
+    # clusterpx is in screen pixels for a 256 pixel tile.
+    cell = max(1, clusterpx * EXTENT // 256)
+    tiles = {}
+    clusters = {}
+    for (mx, my, values) in points:
+        wx = min(int(mx * scale), scale - 1)
+        wy = min(int(my * scale), scale - 1)
+        (tx, ty) = (min(wx // EXTENT, last), min(wy // EXTENT, last))
+        if cluster:
+            ckey = (wx // cell, wy // cell)
+            if ckey in clusters:
+                clusters[ckey][1] += 1
+                continue
+            clusters[ckey] = [(tx, ty, wx - tx*EXTENT, wy - ty*EXTENT, values), 1]
+        else:
+            tiles.setdefault((tx, ty), []).append((wx - tx*EXTENT, wy - ty*EXTENT, values))
+
+    for ((tx, ty, px, py, values), count) in clusters.values():
+        tiles.setdefault((tx, ty), []).append((px, py, values + (count,)))
+    return tiles
+
+
+class MBTilesWriter(object):
+    """Collects point records, then writes an MBTiles file of vector
+    tiles when closed.
+
+    filename is the output .mbtiles filename
+    ids is the key file's {identifier: {name: value}} map
+    epsg_code is the integer EPSG projection code of the records
+    minzoom and maxzoom are the zoom range to build
+    clusterzoom is the highest zoom level where points are clustered
+    clusterpx is the cluster grid cell size, in 256-pixel tile pixels
+    workers is the number of worker processes, or None for one per CPU
+    """
+    def __init__(self, filename, ids, epsg_code, minzoom=0, maxzoom=14,
+                 clusterzoom=None, clusterpx=16, workers=None):
+        if minzoom < 0 or maxzoom > 24 or minzoom > maxzoom:
+            msg = "Zoom range {minz}..{maxz} is not valid; zooms must be 0..24 with minzoom <= maxzoom".format(
+                minz=minzoom, maxz=maxzoom)
+            raise ValueError(msg)
+        if clusterzoom is None:
+            clusterzoom = maxzoom - 1
+
+        self.filename = filename
+        self.layer_name = os.path.splitext(os.path.basename(filename))[0]
+        self.keys = list(ids)
+        index = records.field_index(ids)
+        self._positions = [index[c] for c in self.keys]
+        self.field_types = {c: 'String' if ids[c]['datatype'] == 'string' else 'Number' for c in ids}
+        self.minzoom = minzoom
+        self.maxzoom = maxzoom
+        self.clusterzoom = clusterzoom
+        self.clusterpx = clusterpx
+        self.workers = workers
+        # Every point is kept until the tiles are built, so store them
+        # compactly: coordinates in arrays, string values dictionary encoded.
+        self.xs = array.array('d')
+        self.ys = array.array('d')
+        self.encoder = string_dict.RecordEncoder(self.keys, {c: ids[c]['datatype'] for c in ids})
+        self.values = self.encoder.new_batch()
+        self.bounds = None
+
+        self.transform = None
+        if epsg_code != 4326:
+            src = osgeo.osr.SpatialReference()
+            src.ImportFromEPSG(epsg_code)
+            dest = osgeo.osr.SpatialReference()
+            dest.ImportFromEPSG(4326)
+            for srs in (src, dest):
+                if hasattr(srs, 'SetAxisMappingStrategy'):
+                    srs.SetAxisMappingStrategy(osgeo.osr.OAMS_TRADITIONAL_GIS_ORDER)
+            self.transform = osgeo.osr.CoordinateTransformation(src, dest)
+
+
+    def add_record(self, record):
+        (lon, lat) = (record[records.DLON], record[records.DLAT])
+        if self.transform is not None:
+            (lon, lat) = self.transform.TransformPoint(lon, lat)[:2]
+        if self.bounds is None:
+            self.bounds = [lon, lat, lon, lat]
+        else:
+            self.bounds = [min(self.bounds[0], lon), min(self.bounds[1], lat),
+                           max(self.bounds[2], lon), max(self.bounds[3], lat)]
+        (mx, my) = mercator(lon, lat)
+        self.xs.append(mx)
+        self.ys.append(my)
+        self.values.append([record[pos] for pos in self._positions])
+
+
+    def points(self):
+        """Yield the (mx, my, values) for each point."""
+        row = self.values.row
+        for (i, (mx, my)) in enumerate(zip(self.xs, self.ys)):
+            yield (mx, my, row(i))
+
+
+    def _tasks(self):
+        for zoom in range(self.minzoom, self.maxzoom+1):
+            cluster = zoom <= self.clusterzoom
+            tiles = tile_features(self.points(), zoom, cluster, self.clusterpx)
+            keys = self.keys + ['point_count'] if cluster else self.keys
+            batch = []
+            for ((x, y), features) in tiles.items():
+                batch.append((zoom, x, y, features))
+                if len(batch) >= TILES_PER_TASK:
+                    yield (keys, batch)
+                    batch = []
+            if batch:
+                yield (keys, batch)
+
+
+    def close(self):
+        """Build the tiles and write the MBTiles file. Returns the
+        number of tiles written.
+        """
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+        conn = sqlite3.connect(self.filename)
+        conn.execute('CREATE TABLE metadata (name text, value text)')
+        conn.execute('CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob)')
+        conn.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+
+        tile_count = 0
+        max_pending = 4 * (self.workers or os.cpu_count() or 1)
+        with run_log.process_pool(self.workers) as pool:
+            pending = set()
+            tasks = self._tasks()
+            while True:
+                # Keep a bounded number of batches in flight, so the
+                # encoded tiles don't all pile up in memory at once.
+                for (keys, batch) in tasks:
+                    pending.add(pool.submit(_encode_tiles, self.layer_name, keys, batch))
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    break
+                (done, pending) = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    rows = [(z, x, (1 << z) - 1 - y, sqlite3.Binary(data)) # MBTiles rows are TMS, flipped in y
+                            for (z, x, y, data) in future.result()]
+                    conn.executemany('INSERT INTO tiles VALUES (?, ?, ?, ?)', rows)
+                    tile_count += len(rows)
+
+        conn.executemany('INSERT INTO metadata VALUES (?, ?)', self._metadata())
+        conn.commit()
+        conn.close()
+        return tile_count
+
+
+    def abort(self):
+        """Drop the collected points without building any tiles."""
+        self.xs = array.array('d')
+        self.ys = array.array('d')
+        self.values = self.encoder.new_batch()
+
+
+    def _metadata(self):
+        bounds = self.bounds if self.bounds is not None else [-180.0, -MAX_LAT, 180.0, MAX_LAT]
+        center = [(bounds[0]+bounds[2])/2, (bounds[1]+bounds[3])/2, self.minzoom]
+        fields = dict(self.field_types)
+        fields['point_count'] = 'Number'
+        vector_layers = [{'id': self.layer_name, 'fields': fields,
+                          'minzoom': self.minzoom, 'maxzoom': self.maxzoom}]
+        return [('name', self.layer_name),
+                ('format', 'pbf'),
+                ('type', 'overlay'),
+                ('version', '1'),
+                ('minzoom', str(self.minzoom)),
+                ('maxzoom', str(self.maxzoom)),
+                ('bounds', ','.join(repr(b) for b in bounds)),
+                ('center', ','.join(repr(c) for c in center)),
+                ('json', json.dumps({'vector_layers': vector_layers}))]
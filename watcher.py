@@ -0,0 +1,218 @@
+# Watches a directory for key file / data file pairs, and reconverts a
+# pair whenever its key file or data file changes.
+#
+# A pair is a NAME.key.csv key file and the NAME.csv data file next to
+# it. Draft NAME.gen.key.csv files from make_key.py are left alone until
+# they've been checked and renamed.
+#
+# Files are often copied into the directory slowly, so a file only
+# counts as changed once its size and modification time have held still
+# for the settle time. Conversions run on a pool of threads in the one
+# process, so GDAL, the compiled key files, the --join polygons and the
+# geocoder stay loaded from one conversion to the next.
+#
+# Changes are found by scanning the directory, which only costs a stat
+# per .csv file. If the inotify_simple package is installed, the watcher
+# sleeps until the directory changes instead of scanning every poll
+# interval.
+
+import os
+import time
+import logging
+import threading
+import concurrent.futures
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+import make_key
+
+
+KEY_EXT = '.key.csv'
+DRAFT_KEY_EXT = make_key.DRAFT_KEY_EXT
+DATA_EXT = '.csv'
+
+# With inotify, rescan at least this often anyway, in case an event is
+# missed (inotify doesn't see changes made on other NFS clients).
+IDLE_SECS = 60.0
+
+
+def find_pairs(directory):
+    """Return a {keyfile: datafile} map of the pairs in directory whose
+    data file exists.
+    """
+    names = set(os.listdir(directory))
+    pairs = {}
+    for name in names:
+        if not name.endswith(KEY_EXT) or name.endswith(DRAFT_KEY_EXT):
+            continue
+        dataname = name[:-len(KEY_EXT)] + DATA_EXT
+        if dataname in names:
+            pairs[os.path.join(directory, name)] = os.path.join(directory, dataname)
+    return pairs
+
+
+def file_signature(filename):
+    """Return (size, mtime) for filename, or None if it's gone."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+class Watcher(object):
+    """Reconverts the pairs in a directory as they change.
+
+    directory is the directory to watch
+    convert is called as convert(keyfile, datafile) to convert a pair;
+      it is called from the worker threads
+    up_to_date is an optional up_to_date(keyfile, datafile) that returns
+      True if the pair's output is newer than both files, so pairs that
+      were converted before the watcher started aren't redone
+    workers is the most conversions to run at once
+    settle is how long, in seconds, a file must go unchanged before
+      it's converted
+    poll is how often, in seconds, to scan the directory
+    """
+    def __init__(self, directory, convert, up_to_date=None, workers=None,
+                 settle=2.0, poll=1.0):
+        if not os.path.isdir(directory):
+            raise ValueError("The --watch directory '{d}' does not exist".format(d=directory))
+        self.directory = directory
+        self.convert = convert
+        self.up_to_date = up_to_date
+        self.settle = settle
+        self.poll = poll
+        self.stats = {'scans': 0, 'conversions': 0, 'failures': 0}
+        self._stats_lock = threading.Lock()
+
+        # {filename: (signature, time first seen with that signature)}
+        self._seen = {}
+        # {keyfile: (key signature, data signature) last converted}
+        self._converted = {}
+        # {keyfile: Future} for the conversions that are running
+        self._running = {}
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+
+        self._inotify = None
+        if inotify_simple is not None:
+            flags = inotify_simple.flags
+            self._inotify = inotify_simple.INotify()
+            self._inotify.add_watch(directory, flags.CREATE | flags.MODIFY | flags.CLOSE_WRITE |
+                                    flags.MOVED_TO | flags.DELETE | flags.MOVED_FROM)
+        logging.info("Watching {d} for changes{how}".format(
+            d=directory, how=' with inotify' if self._inotify is not None else ''))
+
+
+    def _settled(self, filename, now):
+        """Return the signature of filename if it has held still for the
+        settle time, else None.
+        """
+        sig = file_signature(filename)
+        seen = self._seen.get(filename)
+        if seen is None or seen[0] != sig:
+            self._seen[filename] = (sig, now)
+            return None
+        if sig is None or now - seen[1] < self.settle:
+            return None
+        return sig
+
+
+    def scan(self, now=None):
+        """Start conversions for the pairs that have changed. Returns
+        the number started.
+        """
+        if now is None:
+            now = time.time()
+        self.stats['scans'] += 1
+        for keyfile in [k for (k, f) in self._running.items() if f.done()]:
+            del self._running[keyfile]
+
+        started = 0
+        pairs = find_pairs(self.directory)
+        for (keyfile, datafile) in sorted(pairs.items()):
+            sigs = (self._settled(keyfile, now), self._settled(datafile, now))
+            if None in sigs or keyfile in self._running:
+                continue
+            if keyfile not in self._converted and self.up_to_date is not None and self.up_to_date(keyfile, datafile):
+                self._converted[keyfile] = sigs
+            if self._converted.get(keyfile) == sigs:
+                continue
+            # Remember what's being converted, so a change made during
+            # the conversion starts another one.
+            self._converted[keyfile] = sigs
+            self._running[keyfile] = self._pool.submit(self._convert, keyfile, datafile)
+            started += 1
+
+        # Forget files that have gone away.
+        names = set(pairs) | set(pairs.values())
+        for filename in [f for f in self._seen if f not in names]:
+            del self._seen[filename]
+        return started
+
+
+    def _convert(self, keyfile, datafile):
+        start = time.time()
+        logging.info("Converting {d} with {k}".format(d=datafile, k=keyfile))
+        try:
+            self.convert(keyfile, datafile)
+        except Exception as e:
+            # Keep watching; the pair is retried when it changes again.
+            with self._stats_lock:
+                self.stats['failures'] += 1
+            logging.exception(e)
+            print("Could not convert {d}: {e}".format(d=datafile, e=e))
+            return
+        with self._stats_lock:
+            self.stats['conversions'] += 1
+        line = "Converted {d} in {secs:.2f}s".format(d=datafile, secs=time.time()-start)
+        print(line)
+        logging.info(line)
+
+
+    def _pending(self):
+        """Return True if a file is waiting to settle or a conversion is
+        running, so the next scan can't wait for a directory change.
+        """
+        if any(not f.done() for f in self._running.values()):
+            return True
+        sigs = [s for (s, t) in self._seen.values()]
+        converted = set(s for pair in self._converted.values() for s in pair)
+        return any(s not in converted for s in sigs)
+
+
+    def wait(self):
+        """Wait until the next scan is due."""
+        if self._inotify is None:
+            time.sleep(self.poll)
+            return
+        timeout = self.poll if self._pending() else IDLE_SECS
+        # read_delay lets a burst of writes finish before scanning.
+        self._inotify.read(timeout=int(timeout*1000), read_delay=100)
+
+
+    def run(self, stop=None):
+        """Scan and convert until stop, a threading.Event, is set (or
+        forever, if stop is None).
+        """
+        while stop is None or not stop.is_set():
+            self.scan()
+            self.wait()
+
+
+    def close(self):
+        """Wait for the running conversions, and stop watching."""
+        self._pool.shutdown(wait=True)
+        if self._inotify is not None:
+            self._inotify.close()
+
+
+def report_stats(stats):
+    """Log and print a summary of the watch."""
+    line = "Watch made {conv} conversions, {fail} of which failed, in {scans} directory scans.".format(
+        conv=stats['conversions'] + stats['failures'], fail=stats['failures'], scans=stats['scans'])
+    print(line)
+    logging.info(line)